@@ -0,0 +1,44 @@
+-- Migration 008: Alert statistics aggregation
+-- Computes dashboard alert statistics inside Postgres so callers fetch one
+-- small JSON object instead of every alert row in the range
+
+CREATE OR REPLACE FUNCTION alert_stats(rid UUID, d_from TIMESTAMPTZ, d_to TIMESTAMPTZ)
+RETURNS JSON AS $$
+    WITH scoped AS (
+        SELECT priority, status, rule_id, created_at, acknowledged_at
+        FROM feedback_alerts
+        WHERE restaurant_id = rid
+            AND created_at >= d_from
+            AND created_at <= d_to
+    )
+    SELECT json_build_object(
+        'total_alerts', count(*),
+        'by_priority', json_build_object(
+            'immediate', count(*) FILTER (WHERE priority = 'immediate'),
+            'high', count(*) FILTER (WHERE priority = 'high'),
+            'medium', count(*) FILTER (WHERE priority = 'medium'),
+            'low', count(*) FILTER (WHERE priority = 'low')
+        ),
+        'by_status', json_build_object(
+            'pending', count(*) FILTER (WHERE status = 'pending'),
+            'acknowledged', count(*) FILTER (WHERE status = 'acknowledged'),
+            'resolved', count(*) FILTER (WHERE status = 'resolved')
+        ),
+        'average_response_time', avg(EXTRACT(EPOCH FROM acknowledged_at - created_at))
+            FILTER (WHERE acknowledged_at IS NOT NULL),
+        'top_issues', (
+            SELECT COALESCE(json_agg(json_build_array(rule_id, issue_count) ORDER BY issue_count DESC), '[]'::json)
+            FROM (
+                SELECT rule_id, count(*) AS issue_count
+                FROM scoped
+                WHERE rule_id IS NOT NULL
+                GROUP BY rule_id
+                ORDER BY issue_count DESC
+                LIMIT 5
+            ) top_rules
+        )
+    )
+    FROM scoped;
+$$ LANGUAGE sql STABLE;
+
+COMMENT ON FUNCTION alert_stats(UUID, TIMESTAMPTZ, TIMESTAMPTZ) IS 'Alert counts, response time and top rules for a restaurant and date range';
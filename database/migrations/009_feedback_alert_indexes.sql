@@ -0,0 +1,15 @@
+-- Migration 009: Feedback alert read-path indexes
+-- Composite indexes for active-alert listings and the alert_stats function.
+-- CREATE INDEX CONCURRENTLY cannot run inside a transaction block, so this
+-- file is intentionally not wrapped in BEGIN/COMMIT.
+
+-- get_active_alerts: restaurant_id + status = 'pending', newest first
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_alerts_rid_status_created
+    ON feedback_alerts (restaurant_id, status, created_at DESC)
+    INCLUDE (priority, rule_id);
+
+-- alert_stats / get_alert_statistics: restaurant_id + created_at range.
+-- INCLUDE columns let the aggregation use an index-only scan.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_alerts_rid_created
+    ON feedback_alerts (restaurant_id, created_at DESC)
+    INCLUDE (priority, status, rule_id, acknowledged_at);
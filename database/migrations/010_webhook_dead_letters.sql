@@ -0,0 +1,26 @@
+-- Migration 010: Webhook dead-letter queue
+-- Alert webhook batches that exhaust their retries (or are rejected by an open
+-- circuit breaker) are stored here for inspection and replay
+
+CREATE TABLE IF NOT EXISTS webhook_dead_letters (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    webhook_url TEXT NOT NULL,
+    payload JSONB NOT NULL,
+    error TEXT,
+    replayed_at TIMESTAMPTZ,
+    created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_webhook_dead_letters_pending
+    ON webhook_dead_letters(created_at) WHERE replayed_at IS NULL;
+
+-- RLS (Row Level Security): payloads carry alert details and webhook URLs,
+-- so only the backend (service role) may read or write them
+ALTER TABLE webhook_dead_letters ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Service role manages webhook dead letters"
+    ON webhook_dead_letters FOR ALL
+    USING (auth.role() = 'service_role')
+    WITH CHECK (auth.role() = 'service_role');
+
+COMMENT ON TABLE webhook_dead_letters IS 'Undeliverable alert webhook batches awaiting replay';
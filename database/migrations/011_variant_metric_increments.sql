@@ -0,0 +1,35 @@
+-- Migration 011: Atomic A/B variant metric increments
+-- Adds per-variant counter deltas to feedback_experiments.variants in one
+-- UPDATE, so concurrent workers never overwrite each other's counts.
+-- deltas: {"<variant_id>": {"<metric>": <delta>, ...}, ...}
+
+CREATE OR REPLACE FUNCTION increment_variant_metrics(eid UUID, deltas JSONB)
+RETURNS BOOLEAN AS $$
+    WITH updated AS (
+        UPDATE feedback_experiments e SET variants = (
+            SELECT jsonb_agg(
+                CASE WHEN inc.metric_deltas IS NULL THEN v.value
+                ELSE jsonb_set(
+                    v.value, '{metrics}',
+                    COALESCE(v.value -> 'metrics', '{}'::jsonb)
+                    || (
+                        SELECT jsonb_object_agg(
+                            d.key,
+                            COALESCE((v.value -> 'metrics' ->> d.key)::numeric, 0) + d.value::numeric
+                        )
+                        FROM jsonb_each_text(inc.metric_deltas) AS d
+                    )
+                ) END
+                ORDER BY v.ordinality
+            )
+            FROM jsonb_array_elements(e.variants) WITH ORDINALITY AS v
+            LEFT JOIN jsonb_each(deltas) AS inc(variant_id, metric_deltas)
+                ON inc.variant_id = v.value ->> 'id'
+        )
+        WHERE e.id = eid
+        RETURNING 1
+    )
+    SELECT EXISTS (SELECT 1 FROM updated);
+$$ LANGUAGE sql;
+
+COMMENT ON FUNCTION increment_variant_metrics(UUID, JSONB) IS 'Add per-variant metric deltas to an experiment in one atomic update';
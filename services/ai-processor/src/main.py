@@ -19,7 +19,8 @@ from .schemas import (
     AIProcessingRequest,
     AIProcessingResponse,
     WhatsAppWebhook,
-    ConversationContext
+    ConversationContext,
+    PrayerScheduleRequest
 )
 
 # Global service instances (initialized during startup)
@@ -210,6 +211,29 @@ async def get_prayer_status(city: str = "Riyadh"):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get prayer status: {str(e)}")
 
+@app.post("/api/prayer-schedule")
+async def get_prayer_schedule(request: PrayerScheduleRequest):
+    """
+    Get buffered prayer windows for a batch of dates
+    Lets schedulers resolve prayer conflicts locally instead of per message
+    """
+    if not prayer_time_service:
+        raise HTTPException(status_code=503, detail="Prayer time service not initialized")
+    
+    try:
+        schedule = {}
+        for day in sorted(set(request.dates)):
+            schedule[day.isoformat()] = await prayer_time_service.get_prayer_windows(
+                request.location, day
+            )
+        
+        return {
+            "location": request.location,
+            "schedule": schedule
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get prayer schedule: {str(e)}")
+
 @app.post("/api/process-whatsapp-webhook")
 async def process_whatsapp_webhook(webhook: WhatsAppWebhook):
     """
@@ -1,6 +1,6 @@
 from pydantic import BaseModel, Field
 from typing import Dict, Any, Optional, List
-from datetime import datetime
+from datetime import date, datetime
 from enum import Enum
 
 class SentimentType(str, Enum):
@@ -66,6 +66,10 @@ class PrayerTimeStatus(BaseModel):
     time_until_next: Optional[int] = None  # minutes
     city: str = "Riyadh"
 
+class PrayerScheduleRequest(BaseModel):
+    dates: List[date] = Field(..., description="Dates to fetch prayer windows for")
+    location: str = "Riyadh"
+
 class OpenRouterRequest(BaseModel):
     model: str = "google/gemini-flash-1.5"
     messages: List[Dict[str, str]]
@@ -1,7 +1,7 @@
 import httpx
 import asyncio
 from datetime import datetime, timedelta
-from typing import Dict, Optional, Any
+from typing import Dict, List, Optional, Any
 import pytz
 from ..utils.cache import CacheManager
 from ..utils.config import get_config
@@ -122,6 +122,29 @@ class PrayerTimeService:
             print(f"Error getting next prayer: {e}")
             return None
     
+    async def get_prayer_windows(self, city: str = "Riyadh", date: Optional[datetime] = None) -> List[Dict[str, str]]:
+        """Get buffered prayer windows (local Riyadh time) for a specific city and date."""
+        if date is None:
+            date = datetime.now(pytz.timezone('Asia/Riyadh')).date()
+        
+        prayer_times = await self.get_prayer_times(city, date)
+        if not prayer_times:
+            return []
+        
+        buffer = timedelta(minutes=self.prayer_buffer_minutes)
+        windows = []
+        for prayer_name in self.prayer_names:
+            if prayer_times.get(prayer_name):
+                prayer_time = datetime.strptime(prayer_times[prayer_name], "%H:%M").time()
+                prayer_dt = datetime.combine(date, prayer_time)
+                windows.append({
+                    "name": prayer_name,
+                    "start": (prayer_dt - buffer).isoformat(),
+                    "end": (prayer_dt + buffer).isoformat()
+                })
+        
+        return windows
+    
     async def get_prayer_times(self, city: str = "Riyadh", date: Optional[datetime] = None) -> Optional[Dict[str, str]]:
         """Get prayer times for a specific city and date."""
         try:
@@ -19,7 +19,10 @@ from ..schemas import (
     CampaignResponse,
     CampaignMetrics,
     ExperimentConfig,
-    ScheduleParameters
+    ScheduleParameters,
+    CampaignListAdapter,
+    to_json_list_response,
+    to_json_response
 )
 
 router = APIRouter(prefix="/api/feedback-campaigns", tags=["feedback-campaigns"])
@@ -67,20 +70,24 @@ async def upload_csv(
         
         # Use streaming for large files
         if validation_result.get('requires_streaming', False):
-            # Process using streaming approach
+            # Process using streaming approach; recipients arrive per chunk
+            recipients = []
             async for result in csv_processor.process_recipients_streaming(contents):
                 if result['type'] == 'error':
                     raise HTTPException(
                         status_code=status.HTTP_400_BAD_REQUEST,
                         detail=result['message']
                     )
+                elif result['type'] == 'recipients_chunk':
+                    recipients.extend(result['data'])
                 elif result['type'] == 'completed':
-                    processed_data = result
+                    processed_data = {**result, 'recipients': recipients}
                     break
                 # Progress updates could be sent to client via WebSocket in future
         else:
-            # Use traditional approach for smaller files
-            df = pd.read_csv(io.StringIO(contents.decode('utf-8')))
+            # Use traditional approach for smaller files; read_csv decodes the
+            # bytes as it parses, so no full-size str copy is made
+            df = pd.read_csv(io.BytesIO(contents), encoding='utf-8')
             validation_result = csv_processor.validate_csv(df)
             if not validation_result['valid']:
                 raise HTTPException(
@@ -141,8 +148,8 @@ async def upload_csv(
 async def create_campaign(campaign: CampaignCreate):
     """Create a new feedback campaign"""
     try:
-        result = await campaign_repo.create_campaign(campaign.dict())
-        return CampaignResponse(**result)
+        result = await campaign_repo.create_campaign(campaign.model_dump())
+        return to_json_response(CampaignResponse(**result))
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -174,7 +181,7 @@ async def list_campaigns(
         offset=offset
     )
     
-    return [CampaignResponse(**c) for c in campaigns]
+    return to_json_list_response(CampaignListAdapter, campaigns)
 
 
 @router.post("/{campaign_id}/schedule")
@@ -201,7 +208,7 @@ async def schedule_campaign(
         # Schedule the campaign
         scheduled_jobs = await feedback_scheduler.schedule_campaign(
             campaign_id,
-            schedule_params.dict()
+            schedule_params.model_dump()
         )
         
         # Update campaign status
@@ -213,7 +220,7 @@ async def schedule_campaign(
                 'scheduled_end': schedule_params.end_time,
                 'settings': {
                     **campaign.get('settings', {}),
-                    'schedule_params': schedule_params.dict(),
+                    'schedule_params': schedule_params.model_dump(),
                     'scheduled_jobs': scheduled_jobs
                 }
             }
@@ -245,7 +252,7 @@ async def get_campaign_metrics(campaign_id: UUID):
                 detail="Campaign not found"
             )
         
-        return CampaignMetrics(**metrics)
+        return to_json_response(CampaignMetrics(**metrics))
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -279,7 +286,7 @@ async def create_experiment(
         # Create experiment
         experiment_data = await campaign_repo.create_experiment(
             campaign_id,
-            experiment.dict()
+            experiment.model_dump()
         )
         
         return {
@@ -16,7 +16,13 @@ from .schemas import (
     PrayerTimeResponse,
     ConversationCreate,
     MessageCreate,
-    CustomerCreate
+    CustomerCreate,
+    CampaignCreate,
+    ConversationListAdapter,
+    CustomerListAdapter,
+    MessageListAdapter,
+    to_json_list_response,
+    to_json_response
 )
 from .services.prayer_service import PrayerTimeService
 from .services.conversation_service import ConversationService
@@ -24,6 +30,7 @@ from .services.customer_service import CustomerService
 from .middleware.rate_limiter import rate_limit_middleware
 from .middleware.input_sanitization import InputSanitizationMiddleware
 from .api import feedback_campaigns
+from .repositories.campaign_repository import close_pg_pool
 
 # Global services
 prayer_service = PrayerTimeService()
@@ -34,9 +41,14 @@ customer_service = CustomerService()
 async def lifespan(app: FastAPI):
     # Startup
     print("🚀 Starting CRM-RES Core API...")
+    # Build validators for the deferred request schemas hit on hot endpoints
+    for schema in (MessageCreate, ConversationCreate, CustomerCreate, CampaignCreate):
+        schema.model_rebuild(force=True)
     yield
     # Shutdown
     print("🛑 Shutting down CRM-RES Core API...")
+    await feedback_campaigns.feedback_scheduler.aclose()
+    await close_pg_pool()
 
 app = FastAPI(
     title="CRM-RES Core API",
@@ -114,7 +126,7 @@ async def get_conversations(
         conversations = await conversation_service.get_conversations(
             db, skip=skip, limit=limit, status=status
         )
-        return conversations
+        return to_json_list_response(ConversationListAdapter, conversations)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get conversations: {str(e)}")
 
@@ -125,7 +137,7 @@ async def get_conversation(conversation_id: str, db=Depends(get_db)):
         conversation = await conversation_service.get_conversation(db, conversation_id)
         if not conversation:
             raise HTTPException(status_code=404, detail="Conversation not found")
-        return conversation
+        return to_json_response(ConversationResponse.model_validate(conversation))
     except HTTPException:
         raise
     except Exception as e:
@@ -139,7 +151,7 @@ async def create_conversation(
     """Create a new conversation"""
     try:
         new_conversation = await conversation_service.create_conversation(db, conversation)
-        return new_conversation
+        return to_json_response(ConversationResponse.model_validate(new_conversation))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to create conversation: {str(e)}")
 
@@ -156,7 +168,7 @@ async def get_messages(
         messages = await conversation_service.get_messages(
             db, conversation_id, skip=skip, limit=limit
         )
-        return messages
+        return to_json_list_response(MessageListAdapter, messages)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get messages: {str(e)}")
 
@@ -169,7 +181,7 @@ async def create_message(
     """Create a new message in a conversation"""
     try:
         new_message = await conversation_service.create_message(db, conversation_id, message)
-        return new_message
+        return to_json_response(MessageResponse.model_validate(new_message))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to create message: {str(e)}")
 
@@ -183,7 +195,7 @@ async def get_customers(
     """Get all customers"""
     try:
         customers = await customer_service.get_customers(db, skip=skip, limit=limit)
-        return customers
+        return to_json_list_response(CustomerListAdapter, customers)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get customers: {str(e)}")
 
@@ -194,7 +206,7 @@ async def get_customer(customer_id: str, db=Depends(get_db)):
         customer = await customer_service.get_customer(db, customer_id)
         if not customer:
             raise HTTPException(status_code=404, detail="Customer not found")
-        return customer
+        return to_json_response(CustomerResponse.model_validate(customer))
     except HTTPException:
         raise
     except Exception as e:
@@ -208,7 +220,7 @@ async def create_customer(
     """Create a new customer"""
     try:
         new_customer = await customer_service.create_customer(db, customer)
-        return new_customer
+        return to_json_response(CustomerResponse.model_validate(new_customer))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to create customer: {str(e)}")
 
@@ -3,13 +3,60 @@ Campaign Repository
 Data access layer for feedback campaigns
 """
 
-from typing import Dict, List, Any, Optional, Tuple
+from typing import AsyncIterator, Dict, List, Any, Optional, Tuple
 from datetime import datetime
+from types import MappingProxyType
 from uuid import UUID, uuid4
 from supabase import create_client, Client
+import asyncio
+import asyncpg
+import json
 import os
 
 
+# Message status -> timestamp column stamped when the status is reached
+_STATUS_TIMESTAMP_FIELD = MappingProxyType({
+    'sent': 'sent_at',
+    'delivered': 'delivered_at',
+    'read': 'read_at',
+    'responded': 'response_received_at'
+})
+
+# Direct Postgres pool for hot primary-key reads. Prepared statements are
+# cached per connection; set PG_STATEMENT_CACHE_SIZE=0 when connecting
+# through pgbouncer/Supavisor in transaction mode.
+_pg_pool: Optional[asyncpg.Pool] = None
+_pg_pool_lock = asyncio.Lock()
+
+
+async def _get_pg_pool() -> Optional[asyncpg.Pool]:
+    """Lazily create the shared asyncpg pool (None when DATABASE_URL is unset)"""
+    global _pg_pool
+    
+    if _pg_pool is None and os.getenv('DATABASE_URL'):
+        # Concurrent first requests must not each open a pool
+        async with _pg_pool_lock:
+            if _pg_pool is None:
+                _pg_pool = await asyncpg.create_pool(
+                    dsn=os.getenv('DATABASE_URL'),
+                    min_size=int(os.getenv('PG_POOL_MIN_SIZE', '10')),
+                    max_size=int(os.getenv('PG_POOL_MAX_SIZE', '50')),
+                    statement_cache_size=int(os.getenv('PG_STATEMENT_CACHE_SIZE', '256'))
+                )
+    
+    return _pg_pool
+
+
+async def close_pg_pool() -> None:
+    """Close the shared asyncpg pool, if one was opened"""
+    global _pg_pool
+    
+    async with _pg_pool_lock:
+        if _pg_pool is not None:
+            await _pg_pool.close()
+            _pg_pool = None
+
+
 class CampaignRepository:
     """Repository for campaign data operations"""
     
@@ -19,6 +66,29 @@ class CampaignRepository:
             os.getenv('SUPABASE_KEY')
         )
     
+    async def _fetch_by_id(self, table: str, record_id: UUID) -> Optional[Dict[str, Any]]:
+        """
+        Fetch a single row by primary key
+        Uses the asyncpg pool when configured, PostgREST otherwise
+        """
+        pool = await _get_pg_pool()
+        
+        if pool is None:
+            result = self.supabase.table(table).select('*').eq(
+                'id', str(record_id)
+            ).single().execute()
+            
+            return result.data if result.data else None
+        
+        # row_to_json keeps the row shape identical to the PostgREST response
+        async with pool.acquire() as conn:
+            row = await conn.fetchval(
+                f'SELECT row_to_json(t) FROM {table} t WHERE t.id = $1',
+                UUID(str(record_id))
+            )
+        
+        return json.loads(row) if row else None
+    
     async def create_campaign(self, campaign_data: Dict[str, Any]) -> Dict[str, Any]:
         """Create a new feedback campaign"""
         campaign_data['id'] = str(uuid4())
@@ -32,11 +102,7 @@ class CampaignRepository:
     
     async def get_campaign(self, campaign_id: UUID) -> Optional[Dict[str, Any]]:
         """Get a campaign by ID"""
-        result = self.supabase.table('feedback_campaigns').select('*').eq(
-            'id', str(campaign_id)
-        ).single().execute()
-        
-        return result.data if result.data else None
+        return await self._fetch_by_id('feedback_campaigns', campaign_id)
     
     async def update_campaign(
         self,
@@ -133,6 +199,48 @@ class CampaignRepository:
         
         return result.data if result.data else []
     
+    async def iter_campaign_recipients(
+        self,
+        campaign_id: UUID,
+        status: Optional[str] = None,
+        page_size: int = 1000,
+        columns: str = '*'
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream recipients for a campaign page by page
+        Uses keyset pagination on (visit_timestamp, id) so memory stays
+        bounded and deep pages cost the same as the first one.
+        `columns` must include id and visit_timestamp.
+        """
+        last_row: Optional[Dict[str, Any]] = None
+        
+        while True:
+            query = self.supabase.table('campaign_recipients').select(columns).eq(
+                'campaign_id', str(campaign_id)
+            )
+            
+            if status:
+                query = query.eq('status', status)
+            
+            if last_row is not None:
+                last_ts = last_row['visit_timestamp']
+                query = query.or_(
+                    f'visit_timestamp.gt."{last_ts}",'
+                    f'and(visit_timestamp.eq."{last_ts}",id.gt.{last_row["id"]})'
+                )
+            
+            query = query.order('visit_timestamp').order('id').limit(page_size)
+            result = await asyncio.to_thread(query.execute)
+            page = result.data if result.data else []
+            
+            for recipient in page:
+                yield recipient
+            
+            if len(page) < page_size:
+                return
+            
+            last_row = page[-1]
+    
     async def update_recipient_status(
         self,
         recipient_id: UUID,
@@ -168,6 +276,27 @@ class CampaignRepository:
         
         return result.data[0] if result.data else None
     
+    async def bulk_create_campaign_messages(
+        self,
+        messages: List[Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        """Bulk create campaign message records; returns the inserted rows"""
+        created_at = datetime.now().isoformat()
+        for message in messages:
+            message['id'] = str(uuid4())
+            message['created_at'] = created_at
+        
+        # Batch insert (Supabase handles up to 1000 at once)
+        batch_size = 1000
+        inserted = []
+        
+        for i in range(0, len(messages), batch_size):
+            batch = messages[i:i + batch_size]
+            result = self.supabase.table('campaign_messages').insert(batch).execute()
+            inserted.extend(result.data or [])
+        
+        return inserted
+    
     async def get_campaign_messages(
         self,
         campaign_id: UUID,
@@ -187,11 +316,7 @@ class CampaignRepository:
     
     async def get_message(self, message_id: UUID) -> Optional[Dict[str, Any]]:
         """Get a specific message"""
-        result = self.supabase.table('campaign_messages').select('*').eq(
-            'id', str(message_id)
-        ).single().execute()
-        
-        return result.data if result.data else None
+        return await self._fetch_by_id('campaign_messages', message_id)
     
     async def update_message(
         self,
@@ -211,43 +336,51 @@ class CampaignRepository:
         status: str
     ) -> bool:
         """Update message status"""
-        status_field_map = {
-            'sent': 'sent_at',
-            'delivered': 'delivered_at',
-            'read': 'read_at',
-            'responded': 'response_received_at'
-        }
-        
-        update_data = {'status': status}
-        
-        if status in status_field_map:
-            update_data[status_field_map[status]] = datetime.now().isoformat()
+        timestamp_field = _STATUS_TIMESTAMP_FIELD.get(status)
+        
+        if timestamp_field is None:
+            update_data = {'status': status}
+        else:
+            update_data = {
+                'status': status,
+                timestamp_field: datetime.now().isoformat()
+            }
         
         return await self.update_message(message_id, update_data)
     
+    async def mark_sent(self, message_id: UUID) -> bool:
+        """Mark a message as sent (send-loop fast path)"""
+        return await self.update_message(
+            message_id,
+            {'status': 'sent', 'sent_at': datetime.now().isoformat()}
+        )
+    
     async def get_campaign_metrics(self, campaign_id: UUID) -> Dict[str, Any]:
         """Calculate campaign metrics"""
-        # Get all recipients
-        recipients = await self.get_campaign_recipients(campaign_id)
-        total_recipients = len(recipients)
+        # Stream recipients and only keep the per-status counts
+        total_recipients = 0
+        status_counts = {}
+        async for recipient in self.iter_campaign_recipients(
+            campaign_id,
+            columns='id, visit_timestamp, status'
+        ):
+            total_recipients += 1
+            status = recipient.get('status', 'pending')
+            status_counts[status] = status_counts.get(status, 0) + 1
         
         if total_recipients == 0:
             return {
                 'campaign_id': str(campaign_id),
                 'total_recipients': 0,
                 'messages_sent': 0,
+                'responses_received': 0,
                 'response_rate': 0,
                 'average_rating': 0,
                 'sentiment_distribution': {},
-                'completion_rate': 0
+                'completion_rate': 0,
+                'status_breakdown': {}
             }
         
-        # Count by status
-        status_counts = {}
-        for recipient in recipients:
-            status = recipient.get('status', 'pending')
-            status_counts[status] = status_counts.get(status, 0) + 1
-        
         # Get feedback data
         feedback_query = self.supabase.table('feedback').select(
             'rating, sentiment_score'
@@ -294,9 +427,10 @@ class CampaignRepository:
         experiment_data: Dict[str, Any]
     ) -> Dict[str, Any]:
         """Create an A/B test experiment"""
-        experiment_data['id'] = str(uuid4())
+        # Keep a caller-assigned id/status so the row can be looked up again
+        experiment_data.setdefault('id', str(uuid4()))
         experiment_data['campaign_id'] = str(campaign_id)
-        experiment_data['status'] = 'running'
+        experiment_data.setdefault('status', 'running')
         experiment_data['created_at'] = datetime.now().isoformat()
         
         result = self.supabase.table('feedback_experiments').insert(
@@ -310,21 +444,147 @@ class CampaignRepository:
         experiment_id: UUID
     ) -> Optional[Dict[str, Any]]:
         """Get an experiment by ID"""
-        result = self.supabase.table('feedback_experiments').select('*').eq(
-            'id', str(experiment_id)
-        ).single().execute()
+        return await self._fetch_by_id('feedback_experiments', experiment_id)
+    
+    async def list_experiment_ids(self, status: str) -> List[str]:
+        """Get the ids of all experiments in a status"""
+        result = self.supabase.table('feedback_experiments').select('id').eq(
+            'status', status
+        ).execute()
+        
+        return [row['id'] for row in result.data or []]
+    
+    async def create_variant_assignment(self, assignment: Dict[str, Any]) -> bool:
+        """Store a customer's variant assignment (one per customer per experiment)"""
+        result = self.supabase.table('variant_assignments').upsert(
+            assignment,
+            on_conflict='experiment_id,customer_phone'
+        ).execute()
         
-        return result.data if result.data else None
+        return bool(result.data)
+    
+    async def get_variant_assignment(
+        self,
+        experiment_id: UUID,
+        customer_phone: str
+    ) -> Optional[str]:
+        """Get the variant a customer was assigned in an experiment"""
+        result = self.supabase.table('variant_assignments').select('variant_id').eq(
+            'experiment_id', str(experiment_id)
+        ).eq('customer_phone', customer_phone).limit(1).execute()
+        
+        return result.data[0]['variant_id'] if result.data else None
     
     async def update_experiment_metrics(
         self,
         experiment_id: UUID,
         metrics: Dict[str, Any]
     ) -> bool:
-        """Update experiment metrics"""
+        """Update experiment metrics (updated_at is set by the table trigger)"""
         result = self.supabase.table('feedback_experiments').update({
-            'metrics': metrics,
-            'updated_at': datetime.now().isoformat()
+            'metrics': metrics
         }).eq('id', str(experiment_id)).execute()
         
-        return bool(result.data)
\ No newline at end of file
+        return bool(result.data)
+    
+    async def update_experiment_state(
+        self,
+        experiment_id: UUID,
+        payload: bytes
+    ) -> bool:
+        """
+        Write a pre-serialized experiment state (JSON object of column values)
+        Only status, timestamps, winner and significance are written; variant
+        metrics change through the atomic delta updates
+        With the asyncpg pool the bytes go straight into a jsonb parameter
+        """
+        pool = await _get_pg_pool()
+        
+        if pool is None:
+            result = self.supabase.table('feedback_experiments').update(
+                json.loads(payload)
+            ).eq('id', str(experiment_id)).execute()
+            
+            return bool(result.data)
+        
+        async with pool.acquire() as conn:
+            status = await conn.execute(
+                """
+                UPDATE feedback_experiments e SET
+                    status = p.status,
+                    started_at = p.started_at,
+                    ended_at = p.ended_at,
+                    winning_variant = p.winning_variant,
+                    statistical_significance = p.statistical_significance
+                FROM jsonb_populate_record(NULL::feedback_experiments, $2::jsonb) p
+                WHERE e.id = $1
+                """,
+                UUID(str(experiment_id)),
+                payload.decode('utf-8')
+            )
+        
+        return status == 'UPDATE 1'
+    
+    async def update_experiment_status(
+        self,
+        experiment_id: UUID,
+        fields: Dict[str, Any]
+    ) -> bool:
+        """Update experiment state columns (status, timestamps, winner) only"""
+        result = self.supabase.table('feedback_experiments').update(
+            fields
+        ).eq('id', str(experiment_id)).execute()
+        
+        return bool(result.data)
+    
+    async def bulk_increment_participants(
+        self,
+        experiment_id: UUID,
+        increments: Dict[str, int]
+    ) -> bool:
+        """Add participant deltas to the variants stored on an experiment"""
+        return await self._apply_variant_metric_deltas(
+            experiment_id,
+            {variant_id: {'participants': delta} for variant_id, delta in increments.items()}
+        )
+    
+    async def update_variant_result(
+        self,
+        experiment_id: UUID,
+        variant_id: str,
+        increments: Dict[str, float]
+    ) -> bool:
+        """Add one recorded result's counter increments to a variant's stored metrics"""
+        return await self._apply_variant_metric_deltas(
+            experiment_id,
+            {variant_id: increments}
+        )
+    
+    async def _apply_variant_metric_deltas(
+        self,
+        experiment_id: UUID,
+        increments: Dict[str, Dict[str, float]]
+    ) -> bool:
+        """
+        Add per-variant metric deltas in the feedback_experiments.variants JSONB array
+        Runs as one atomic UPDATE in increment_variant_metrics (migration 011)
+        """
+        if not increments:
+            return True
+        
+        pool = await _get_pg_pool()
+        
+        if pool is None:
+            result = self.supabase.rpc('increment_variant_metrics', {
+                'eid': str(experiment_id),
+                'deltas': increments
+            }).execute()
+            
+            return bool(result.data)
+        
+        async with pool.acquire() as conn:
+            return await conn.fetchval(
+                'SELECT increment_variant_metrics($1, $2::jsonb)',
+                UUID(str(experiment_id)),
+                json.dumps(increments)
+            )
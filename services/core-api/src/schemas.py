@@ -1,6 +1,19 @@
-from pydantic import BaseModel, Field, validator
-from typing import Optional, List, Dict, Any
-from datetime import datetime
+from __future__ import annotations
+
+from fastapi import Response
+from pydantic import (
+    BaseModel,
+    ConfigDict,
+    Field,
+    StringConstraints,
+    TypeAdapter,
+    computed_field,
+    create_model
+)
+from pydantic.fields import FieldInfo
+from pydantic.dataclasses import dataclass
+from typing import Optional, List, Dict, Any, Literal, Annotated, Union
+from datetime import datetime, timezone
 from uuid import UUID
 from enum import Enum
 
@@ -35,36 +48,109 @@ class OrderStatus(str, Enum):
     DELIVERED = "delivered"
     CANCELLED = "cancelled"
 
+# Literal value sets for hot-path fields; the Enum classes above stay the
+# constants used by business logic
+ConversationStatusValue = Literal["active", "waiting", "resolved", "closed"]
+MessageDirectionValue = Literal["inbound", "outbound"]
+MessageTypeValue = Literal["text", "image", "audio", "document", "video"]
+SentimentValue = Literal["positive", "neutral", "negative"]
+
+# Free-form JSON object (metadata/settings) passed through without walking
+# its keys and values; the database column is the source of truth for shape
+JsonDict = Annotated[Any, Field(default=None)]
+
+# UUIDs loaded by SQLAlchemy (UUID(as_uuid=True)) are already uuid.UUID
+# instances, so strict mode skips the string-parse branch entirely
+OrmUUID = Annotated[UUID, Field(strict=True)]
+
+# Format checks run as compiled regexes inside pydantic-core
+PhoneNumber = Annotated[
+    str,
+    StringConstraints(min_length=10, max_length=20, pattern=r"^\+?[0-9]{10,20}$")
+]
+EmailAddress = Annotated[
+    str,
+    StringConstraints(max_length=255, pattern=r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+]
+
 # Base schemas
 class BaseSchema(BaseModel):
-    class Config:
-        from_attributes = True
-        json_encoders = {
-            datetime: lambda v: v.isoformat(),
-            UUID: lambda v: str(v)
-        }
+    # datetime/UUID use pydantic-core's native ISO-8601 / hex serializers;
+    # enum fields store their plain value so dumps skip the Enum lookup
+    model_config = ConfigDict(
+        from_attributes=True,
+        ser_json_timedelta="iso8601",
+        use_enum_values=True
+    )
+
+# Create/Update payloads build their validators on first use rather than at
+# import; hot ones are rebuilt eagerly in the app lifespan hook
+DEFERRED_SCHEMA_CONFIG = ConfigDict(defer_build=True, extra="ignore")
+
+# Response payloads are built once and only serialized; pydantic models have
+# no __slots__ option, so immutability is the part that applies here
+RESPONSE_SCHEMA_CONFIG = ConfigDict(frozen=True)
+
+class UpdateSchema(BaseSchema):
+    # PATCH handlers fill these in attribute by attribute; keep assignment
+    # unvalidated so each set doesn't re-run the field validators
+    model_config = ConfigDict(
+        **DEFERRED_SCHEMA_CONFIG,
+        populate_by_name=True,
+        validate_assignment=False
+    )
+
+def make_partial(
+    name: str,
+    base: type[BaseSchema],
+    exclude: frozenset = frozenset()
+) -> type[UpdateSchema]:
+    """
+    Derive a PATCH schema from a *Base schema: every field not excluded
+    becomes optional with a None default, keeping its original constraints
+    """
+    fields = {
+        field_name: (
+            field.annotation if field.annotation is Any else Optional[field.annotation],
+            FieldInfo.merge_field_infos(field, default=None)
+        )
+        for field_name, field in base.model_fields.items()
+        if field_name not in exclude
+    }
+    return create_model(name, __base__=UpdateSchema, __module__=__name__, **fields)
+
+def to_json_response(model: BaseSchema, status_code: int = 200) -> Response:
+    """Serialize a schema in one pydantic-core pass, skipping jsonable_encoder"""
+    return Response(
+        content=model.model_dump_json(by_alias=True),
+        status_code=status_code,
+        media_type="application/json"
+    )
+
+def to_json_list_response(adapter: TypeAdapter, rows: Any, status_code: int = 200) -> Response:
+    """Validate and serialize a list of rows through a prebuilt list adapter"""
+    return Response(
+        content=adapter.dump_json(adapter.validate_python(rows), by_alias=True),
+        status_code=status_code,
+        media_type="application/json"
+    )
 
 # Customer schemas
 class CustomerBase(BaseSchema):
-    phone_number: str = Field(..., min_length=10, max_length=20)
+    phone_number: PhoneNumber
     name: Optional[str] = Field(None, max_length=255)
-    email: Optional[str] = Field(None, max_length=255)
+    email: Optional[EmailAddress] = None
     language_preference: str = Field("ar", max_length=10)
     notes: Optional[str] = None
-    metadata: Optional[Dict[str, Any]] = None
+    metadata: JsonDict
 
 class CustomerCreate(CustomerBase):
-    pass
-
-class CustomerUpdate(BaseSchema):
-    name: Optional[str] = Field(None, max_length=255)
-    email: Optional[str] = Field(None, max_length=255)
-    language_preference: Optional[str] = Field(None, max_length=10)
-    notes: Optional[str] = None
-    metadata: Optional[Dict[str, Any]] = None
+    model_config = DEFERRED_SCHEMA_CONFIG
+CustomerUpdate = make_partial("CustomerUpdate", CustomerBase, frozenset({"phone_number"}))
 
 class CustomerResponse(CustomerBase):
-    id: UUID
+    model_config = RESPONSE_SCHEMA_CONFIG
+    id: OrmUUID
     created_at: datetime
     updated_at: datetime
     last_contact: Optional[datetime] = None
@@ -74,25 +160,22 @@ class CustomerResponse(CustomerBase):
 # Conversation schemas
 class ConversationBase(BaseSchema):
     whatsapp_id: str = Field(..., max_length=255)
-    status: ConversationStatus = ConversationStatus.ACTIVE
+    status: ConversationStatusValue = "active"
     priority: str = Field("normal", max_length=20)
     assigned_to: Optional[str] = Field(None, max_length=255)
     tags: Optional[List[str]] = None
-    metadata: Optional[Dict[str, Any]] = None
+    metadata: JsonDict
 
 class ConversationCreate(ConversationBase):
+    model_config = DEFERRED_SCHEMA_CONFIG
     customer_id: UUID
 
-class ConversationUpdate(BaseSchema):
-    status: Optional[ConversationStatus] = None
-    priority: Optional[str] = Field(None, max_length=20)
-    assigned_to: Optional[str] = Field(None, max_length=255)
-    tags: Optional[List[str]] = None
-    metadata: Optional[Dict[str, Any]] = None
+ConversationUpdate = make_partial("ConversationUpdate", ConversationBase, frozenset({"whatsapp_id"}))
 
 class ConversationResponse(ConversationBase):
-    id: UUID
-    customer_id: UUID
+    model_config = RESPONSE_SCHEMA_CONFIG
+    id: OrmUUID
+    customer_id: OrmUUID
     created_at: datetime
     updated_at: datetime
     last_message_at: Optional[datetime] = None
@@ -103,29 +186,31 @@ class ConversationResponse(ConversationBase):
 # Message schemas
 class MessageBase(BaseSchema):
     whatsapp_message_id: str = Field(..., max_length=255)
-    direction: MessageDirection
-    message_type: MessageType = MessageType.TEXT
+    direction: MessageDirectionValue
+    message_type: MessageTypeValue = "text"
     content: str
     media_url: Optional[str] = Field(None, max_length=500)
     timestamp: datetime
     is_read: bool = False
     is_ai_generated: bool = False
-    sentiment: Optional[Sentiment] = None
+    sentiment: Optional[SentimentValue] = None
     confidence: Optional[int] = Field(None, ge=0, le=100)
-    metadata: Optional[Dict[str, Any]] = None
+    metadata: JsonDict
 
 class MessageCreate(MessageBase):
+    model_config = DEFERRED_SCHEMA_CONFIG
     conversation_id: UUID
 
-class MessageUpdate(BaseSchema):
+class MessageUpdate(UpdateSchema):
     is_read: Optional[bool] = None
-    sentiment: Optional[Sentiment] = None
+    sentiment: Optional[SentimentValue] = None
     confidence: Optional[int] = Field(None, ge=0, le=100)
-    metadata: Optional[Dict[str, Any]] = None
+    metadata: JsonDict
 
 class MessageResponse(MessageBase):
-    id: UUID
-    conversation_id: UUID
+    model_config = RESPONSE_SCHEMA_CONFIG
+    id: OrmUUID
+    conversation_id: OrmUUID
     created_at: datetime
 
 # Prayer Time schemas
@@ -140,19 +225,22 @@ class PrayerTimeBase(BaseSchema):
     isha: datetime
 
 class PrayerTimeCreate(PrayerTimeBase):
-    pass
-
+    model_config = DEFERRED_SCHEMA_CONFIG
 class PrayerTimeResponse(PrayerTimeBase):
+    model_config = RESPONSE_SCHEMA_CONFIG
     id: UUID
     created_at: datetime
 
 class CurrentPrayerResponse(BaseSchema):
+    model_config = RESPONSE_SCHEMA_CONFIG
     current: Optional[PrayerTimeResponse] = None
     next: Optional[PrayerTimeResponse] = None
     is_prayer_time: bool = False
 
 # Order schemas
-class OrderItem(BaseSchema):
+# Plain value type: a slotted pydantic dataclass is lighter per item than a model
+@dataclass(frozen=True, slots=True)
+class OrderItem:
     name: str
     quantity: int = Field(..., ge=1)
     price: int = Field(..., ge=0)  # in cents
@@ -164,19 +252,22 @@ class OrderBase(BaseSchema):
     total_amount: int = Field(..., ge=0)  # in cents
     items: List[OrderItem]
     notes: Optional[str] = None
-    metadata: Optional[Dict[str, Any]] = None
+    metadata: JsonDict
 
 class OrderCreate(OrderBase):
+    model_config = DEFERRED_SCHEMA_CONFIG
     conversation_id: UUID
     customer_id: UUID
     branch_id: Optional[UUID] = None
 
-class OrderUpdate(BaseSchema):
-    status: Optional[OrderStatus] = None
-    notes: Optional[str] = None
-    metadata: Optional[Dict[str, Any]] = None
+OrderUpdate = make_partial(
+    "OrderUpdate",
+    OrderBase,
+    frozenset({"order_number", "total_amount", "items"})
+)
 
 class OrderResponse(OrderBase):
+    model_config = RESPONSE_SCHEMA_CONFIG
     id: UUID
     conversation_id: UUID
     customer_id: UUID
@@ -186,33 +277,40 @@ class OrderResponse(OrderBase):
     confirmed_at: Optional[datetime] = None
     delivered_at: Optional[datetime] = None
 
+_OrderItemListAdapter = TypeAdapter(List[OrderItem])
+
+def build_order(
+    order_cls: type[OrderBase],
+    order_data: Dict[str, Any],
+    items_json: bytes
+) -> OrderBase:
+    """
+    Build an order whose items arrive as a raw JSON array (bulk imports).
+    The items are validated straight from bytes in a single adapter pass and
+    attached without walking them again through the parent model.
+    """
+    items = _OrderItemListAdapter.validate_json(items_json)
+    order = order_cls.model_validate({**order_data, "items": []})
+    return order.model_copy(update={"items": items})
+
 # Restaurant schemas
 class RestaurantBase(BaseSchema):
     name: str = Field(..., max_length=255)
-    phone_number: str = Field(..., min_length=10, max_length=20)
+    phone_number: PhoneNumber
     address: Optional[str] = None
     city: str = Field(..., max_length=100)
     timezone: str = Field("Asia/Riyadh", max_length=50)
     language: str = Field("ar", max_length=10)
     is_active: bool = True
-    settings: Optional[Dict[str, Any]] = None
-    metadata: Optional[Dict[str, Any]] = None
+    settings: JsonDict
+    metadata: JsonDict
 
 class RestaurantCreate(RestaurantBase):
-    pass
-
-class RestaurantUpdate(BaseSchema):
-    name: Optional[str] = Field(None, max_length=255)
-    phone_number: Optional[str] = Field(None, min_length=10, max_length=20)
-    address: Optional[str] = None
-    city: Optional[str] = Field(None, max_length=100)
-    timezone: Optional[str] = Field(None, max_length=50)
-    language: Optional[str] = Field(None, max_length=10)
-    is_active: Optional[bool] = None
-    settings: Optional[Dict[str, Any]] = None
-    metadata: Optional[Dict[str, Any]] = None
+    model_config = DEFERRED_SCHEMA_CONFIG
+RestaurantUpdate = make_partial("RestaurantUpdate", RestaurantBase)
 
 class RestaurantResponse(RestaurantBase):
+    model_config = RESPONSE_SCHEMA_CONFIG
     id: UUID
     created_at: datetime
     updated_at: datetime
@@ -220,26 +318,21 @@ class RestaurantResponse(RestaurantBase):
 # Branch schemas
 class BranchBase(BaseSchema):
     name: str = Field(..., max_length=255)
-    phone_number: str = Field(..., min_length=10, max_length=20)
+    phone_number: PhoneNumber
     address: Optional[str] = None
     city: str = Field(..., max_length=100)
     is_active: bool = True
-    settings: Optional[Dict[str, Any]] = None
-    metadata: Optional[Dict[str, Any]] = None
+    settings: JsonDict
+    metadata: JsonDict
 
 class BranchCreate(BranchBase):
+    model_config = DEFERRED_SCHEMA_CONFIG
     restaurant_id: UUID
 
-class BranchUpdate(BaseSchema):
-    name: Optional[str] = Field(None, max_length=255)
-    phone_number: Optional[str] = Field(None, min_length=10, max_length=20)
-    address: Optional[str] = None
-    city: Optional[str] = Field(None, max_length=100)
-    is_active: Optional[bool] = None
-    settings: Optional[Dict[str, Any]] = None
-    metadata: Optional[Dict[str, Any]] = None
+BranchUpdate = make_partial("BranchUpdate", BranchBase)
 
 class BranchResponse(BranchBase):
+    model_config = RESPONSE_SCHEMA_CONFIG
     id: UUID
     restaurant_id: UUID
     created_at: datetime
@@ -252,12 +345,12 @@ class AnalyticsBase(BaseSchema):
     metric_value: int
     restaurant_id: Optional[UUID] = None
     branch_id: Optional[UUID] = None
-    metadata: Optional[Dict[str, Any]] = None
+    metadata: JsonDict
 
 class AnalyticsCreate(AnalyticsBase):
-    pass
-
+    model_config = DEFERRED_SCHEMA_CONFIG
 class AnalyticsResponse(AnalyticsBase):
+    model_config = RESPONSE_SCHEMA_CONFIG
     id: UUID
     created_at: datetime
 
@@ -272,26 +365,63 @@ class DashboardAnalytics(BaseSchema):
     satisfaction_score: float
     prayer_time_active: bool
 
+class ConversationStatusBreakdown(BaseSchema):
+    active: int = 0
+    waiting: int = 0
+    resolved: int = 0
+    closed: int = 0
+
 class ConversationAnalytics(BaseSchema):
     period: str
     total_conversations: int
-    conversations_by_status: Dict[str, int]
+    conversations_by_status: ConversationStatusBreakdown
     conversations_by_hour: Dict[str, int]
     average_response_time: float
-    satisfaction_trend: List[Dict[str, Any]]
-    top_customers: List[Dict[str, Any]]
+    satisfaction_trend: List[Any] = []
+    top_customers: List[Any] = []
 
 # WhatsApp webhook schemas
-class WhatsAppWebhookMessage(BaseSchema):
+class WhatsAppWebhookMessageBase(BaseSchema):
     id: str
-    from: str
-    timestamp: str
-    type: str
-    text: Optional[Dict[str, str]] = None
-    image: Optional[Dict[str, str]] = None
-    audio: Optional[Dict[str, str]] = None
-    document: Optional[Dict[str, str]] = None
-    video: Optional[Dict[str, str]] = None
+    from_: str = Field(..., alias="from")
+    # Unix seconds; WhatsApp sends a numeric string, coerced to int here
+    timestamp: int
+
+    @property
+    def sent_at(self) -> datetime:
+        return datetime.fromtimestamp(self.timestamp, tz=timezone.utc)
+
+class WhatsAppTextMessage(WhatsAppWebhookMessageBase):
+    type: Literal["text"]
+    text: Dict[str, str]
+
+class WhatsAppImageMessage(WhatsAppWebhookMessageBase):
+    type: Literal["image"]
+    image: Dict[str, str]
+
+class WhatsAppAudioMessage(WhatsAppWebhookMessageBase):
+    type: Literal["audio"]
+    audio: Dict[str, str]
+
+class WhatsAppDocumentMessage(WhatsAppWebhookMessageBase):
+    type: Literal["document"]
+    document: Dict[str, str]
+
+class WhatsAppVideoMessage(WhatsAppWebhookMessageBase):
+    type: Literal["video"]
+    video: Dict[str, str]
+
+# Tagged on "type", so validation dispatches straight to one variant
+WhatsAppWebhookMessage = Annotated[
+    Union[
+        WhatsAppTextMessage,
+        WhatsAppImageMessage,
+        WhatsAppAudioMessage,
+        WhatsAppDocumentMessage,
+        WhatsAppVideoMessage
+    ],
+    Field(discriminator="type")
+]
 
 class WhatsAppWebhookEntry(BaseSchema):
     id: str
@@ -309,6 +439,7 @@ class AIProcessingRequest(BaseSchema):
     context: Optional[Dict[str, Any]] = None
 
 class AIProcessingResponse(BaseSchema):
+    model_config = RESPONSE_SCHEMA_CONFIG
     response: str
     sentiment: Optional[Sentiment] = None
     confidence: Optional[float] = None
@@ -348,26 +479,36 @@ class CampaignBase(BaseSchema):
     status: CampaignStatus = CampaignStatus.DRAFT
     scheduled_start: Optional[datetime] = None
     scheduled_end: Optional[datetime] = None
-    settings: Optional[Dict[str, Any]] = None
+    settings: JsonDict
 
 class CampaignCreate(CampaignBase):
-    pass
-
-class CampaignUpdate(BaseSchema):
-    name: Optional[str] = Field(None, max_length=255)
-    description: Optional[str] = None
-    status: Optional[CampaignStatus] = None
-    scheduled_start: Optional[datetime] = None
-    scheduled_end: Optional[datetime] = None
-    settings: Optional[Dict[str, Any]] = None
+    model_config = DEFERRED_SCHEMA_CONFIG
+CampaignUpdate = make_partial("CampaignUpdate", CampaignBase, frozenset({"restaurant_id"}))
 
 class CampaignResponse(CampaignBase):
+    model_config = RESPONSE_SCHEMA_CONFIG
     id: UUID
     created_at: datetime
     updated_at: Optional[datetime] = None
     created_by: Optional[UUID] = None
     metrics: Optional[Dict[str, Any]] = None
-    recipient_count: Optional[int] = 0
+
+    @computed_field
+    @property
+    def recipient_count(self) -> int:
+        # Derived from the metrics snapshot written by update_campaign_metrics
+        return (self.metrics or {}).get("total_recipients", 0)
+
+class SentimentDistribution(BaseSchema):
+    positive: int = 0
+    neutral: int = 0
+    negative: int = 0
+
+class RecipientStatusBreakdown(BaseSchema):
+    pending: int = 0
+    sent: int = 0
+    responded: int = 0
+    failed: int = 0
 
 class CampaignMetrics(BaseSchema):
     campaign_id: UUID
@@ -376,9 +517,9 @@ class CampaignMetrics(BaseSchema):
     responses_received: int
     response_rate: float
     average_rating: float
-    sentiment_distribution: Dict[str, int]
+    sentiment_distribution: SentimentDistribution
     completion_rate: float
-    status_breakdown: Dict[str, int]
+    status_breakdown: RecipientStatusBreakdown
 
 class ScheduleParameters(BaseSchema):
     start_time: datetime
@@ -411,4 +552,25 @@ class FeedbackData(BaseSchema):
     sentiment_score: float = Field(..., ge=-1, le=1)
     topics: List[str] = []
     is_repeated_issue: bool = False
-    metadata: Optional[Dict[str, Any]] = None
\ No newline at end of file
+    metadata: JsonDict
+
+# Annotations are postponed; resolve the response models in one pass now that
+# every referenced type exists
+for _response_schema in (
+    CustomerResponse,
+    ConversationResponse,
+    MessageResponse,
+    OrderResponse,
+    RestaurantResponse,
+    BranchResponse,
+    AnalyticsResponse,
+    CampaignResponse
+):
+    _response_schema.model_rebuild()
+
+# List response adapters, built once at import and reused by list endpoints
+CustomerListAdapter = TypeAdapter(List[CustomerResponse])
+ConversationListAdapter = TypeAdapter(List[ConversationResponse])
+MessageListAdapter = TypeAdapter(List[MessageResponse])
+OrderListAdapter = TypeAdapter(List[OrderResponse])
+CampaignListAdapter = TypeAdapter(List[CampaignResponse])
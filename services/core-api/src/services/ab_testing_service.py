@@ -6,15 +6,89 @@ Manages experiments for feedback collection optimization
 from typing import Dict, List, Any, Optional, Tuple
 from uuid import UUID, uuid4
 from datetime import datetime, timedelta
+from collections import Counter, defaultdict
+import asyncio
+import bisect
+import hashlib
+import logging
 import random
 import json
-from dataclasses import dataclass
+import operator
+import time
+from dataclasses import dataclass, field
+from itertools import accumulate
 from enum import Enum
+from cachetools import TTLCache
 import numpy as np
+import orjson
 from scipy import stats
 
 from ..repositories.campaign_repository import CampaignRepository
 
+logger = logging.getLogger(__name__)
+
+# Participant counts are written back in batches rather than per assignment
+PARTICIPANT_FLUSH_INTERVAL = 1.0  # seconds
+PARTICIPANT_FLUSH_BATCH_SIZE = 500
+
+# Significance is re-run on a growing participant schedule, plus a periodic sweep
+ANALYSIS_MIN_NEW_PARTICIPANTS = 50
+ANALYSIS_GROWTH_FACTOR = 1.1
+ANALYSIS_SWEEP_INTERVAL = 60.0  # seconds
+
+# (experiment_id, customer_phone) -> variant_id, kept for the response window
+ASSIGNMENT_CACHE_SIZE = 100_000
+ASSIGNMENT_CACHE_TTL = 3600  # seconds
+
+# Hot experiments stay in memory; misses and expired entries reload from the DB
+EXPERIMENT_CACHE_SIZE = 1024
+EXPERIMENT_CACHE_TTL = 30  # seconds
+
+
+def _stable_unit_hash(key: str) -> float:
+    """
+    Map a key to a uniform float in [0, 1) that is stable across processes.
+    Uses a 64-bit BLAKE2b digest and keeps the top 53 bits (full double precision).
+    """
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+    return (int.from_bytes(digest, 'big') >> 11) * (1.0 / (1 << 53))
+
+
+_iso_cache: Tuple[int, str] = (0, '')
+
+
+def _iso_now() -> str:
+    """Current time as a seconds-precision ISO string, formatted once per second"""
+    global _iso_cache
+    second = int(time.time())
+    if second != _iso_cache[0]:
+        _iso_cache = (second, datetime.fromtimestamp(second).isoformat())
+    return _iso_cache[1]
+
+
+def _parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    """Parse an ISO timestamp column value (None stays None)"""
+    return datetime.fromisoformat(value) if value else None
+
+
+# Column layout of ABTestExperiment.metrics (one row per variant). Every
+# column is additive, so workers can persist them as increments; the rating
+# mean and variance are derived from the count, sum and sum of squares
+METRIC_COLUMNS = (
+    'participants',
+    'responses',
+    'positive_sentiment',
+    'completed_conversations',
+    'ratings',
+    'rating_sum',
+    'rating_sum_sq'
+)
+PARTICIPANTS, RESPONSES, POSITIVE_SENTIMENT, COMPLETED, RATINGS, RATING_SUM, RATING_SUM_SQ = range(
+    len(METRIC_COLUMNS)
+)
+# Columns the significance analysis reads; its result is memoized on these
+ANALYSIS_INPUT_COLUMNS = [PARTICIPANTS, RESPONSES, RATINGS, RATING_SUM, RATING_SUM_SQ]
+
 
 class ExperimentStatus(str, Enum):
     """A/B Test experiment statuses"""
@@ -25,6 +99,17 @@ class ExperimentStatus(str, Enum):
     ARCHIVED = "archived"
 
 
+# Pre-resolved enum members for hot-path identity checks and serialization
+_STATUS_DRAFT = ExperimentStatus.DRAFT
+_STATUS_RUNNING = ExperimentStatus.RUNNING
+_STATUS_VALUES = {status: status.value for status in ExperimentStatus}
+
+
+# Stored variant shape, read in one C-level attrgetter call per variant
+_VARIANT_KEYS = ('id', 'name', 'weight', 'template', 'parameters', 'metrics')
+_VARIANT_GET = operator.attrgetter('id', 'name', 'weight', 'template', 'parameters', 'counters')
+
+
 class VariantAssignmentStrategy(str, Enum):
     """Strategies for assigning variants to users"""
     RANDOM = "random"
@@ -32,7 +117,7 @@ class VariantAssignmentStrategy(str, Enum):
     HASH_BASED = "hash_based"  # Consistent assignment based on phone number
 
 
-@dataclass
+@dataclass(slots=True)
 class ExperimentVariant:
     """Single variant in an A/B test"""
     id: str
@@ -40,21 +125,50 @@ class ExperimentVariant:
     weight: float  # 0.0 to 1.0
     template: str
     parameters: Dict[str, Any]
-    metrics: Dict[str, float] = None
+    idx: int = 0  # Row in the owning experiment's metrics array
+    metrics_row: np.ndarray = field(default=None, repr=False)
     
     def __post_init__(self):
-        if self.metrics is None:
-            self.metrics = {
-                "participants": 0,
-                "responses": 0,
-                "response_rate": 0.0,
-                "average_rating": 0.0,
-                "completion_rate": 0.0,
-                "positive_sentiment": 0.0
-            }
+        if self.metrics_row is None:
+            self.metrics_row = np.zeros(len(METRIC_COLUMNS))
+    
+    @property
+    def metrics(self) -> Dict[str, float]:
+        """Snapshot of the variant's metrics with derived rates"""
+        row = self.metrics_row
+        participants = int(row[PARTICIPANTS])
+        return {
+            "participants": participants,
+            "responses": int(row[RESPONSES]),
+            "response_rate": float(row[RESPONSES] / participants) if participants else 0.0,
+            "ratings": int(row[RATINGS]),
+            "average_rating": self.average_rating,
+            "completion_rate": float(row[COMPLETED] / participants) if participants else 0.0,
+            "positive_sentiment": int(row[POSITIVE_SENTIMENT])
+        }
+    
+    @property
+    def counters(self) -> Dict[str, float]:
+        """Stored (additive) metric columns"""
+        return dict(zip(METRIC_COLUMNS, self.metrics_row.tolist()))
+    
+    @property
+    def average_rating(self) -> float:
+        """Mean of the ratings seen so far"""
+        n = self.metrics_row[RATINGS]
+        return float(self.metrics_row[RATING_SUM] / n) if n else 0.0
+    
+    @property
+    def rating_variance(self) -> float:
+        """Sample variance of the ratings seen so far"""
+        row = self.metrics_row
+        n = row[RATINGS]
+        if n < 2:
+            return 0.0
+        return max(float((row[RATING_SUM_SQ] - row[RATING_SUM] ** 2 / n) / (n - 1)), 0.0)
 
 
-@dataclass
+@dataclass(slots=True)
 class ABTestExperiment:
     """A/B Test experiment configuration"""
     id: str
@@ -71,10 +185,49 @@ class ABTestExperiment:
     ended_at: Optional[datetime] = None
     winning_variant: Optional[str] = None
     statistical_significance: Optional[Dict[str, Any]] = None
+    cum_weights: List[float] = field(default=None, init=False, repr=False)
+    metrics: np.ndarray = field(default=None, init=False, repr=False)
+    total_participants: int = field(default=0, init=False)
+    total_responses: int = field(default=0, init=False)
+    _last_analyzed_n: int = field(default=0, init=False, repr=False)
+    _next_analyze_at: int = field(default=0, init=False, repr=False)
+    _rng: random.Random = field(default=None, init=False, repr=False)
+    _analysis_cache_key: Optional[bytes] = field(default=None, init=False, repr=False)
+    _analysis_cache_value: Optional[Dict[str, Any]] = field(default=None, init=False, repr=False)
     
     def __post_init__(self):
         if self.created_at is None:
             self.created_at = datetime.now()
+        # Per-experiment generator seeded from OS entropy, so workers and
+        # cache reloads of the same experiment do not replay one sequence
+        self._rng = random.Random()
+        self.refresh_cum_weights()
+        
+        # Variant metrics live in one (V, M) array; each variant keeps a row view
+        self.metrics = np.zeros((len(self.variants), len(METRIC_COLUMNS)))
+        for idx, variant in enumerate(self.variants):
+            self.metrics[idx] = variant.metrics_row
+            variant.idx = idx
+            variant.metrics_row = self.metrics[idx]
+        
+        # Running totals, maintained alongside the per-variant counters
+        self.total_participants = int(self.metrics[:, PARTICIPANTS].sum())
+        self.total_responses = int(self.metrics[:, RESPONSES].sum())
+    
+    def totals_consistent(self) -> bool:
+        """Check the running totals against the per-variant counters"""
+        return (
+            self.total_participants == int(self.metrics[:, PARTICIPANTS].sum()) and
+            self.total_responses == int(self.metrics[:, RESPONSES].sum())
+        )
+    
+    def refresh_cum_weights(self):
+        """Recompute cumulative variant weights; call after any weight change"""
+        cum_weights = list(accumulate(v.weight for v in self.variants))
+        if cum_weights:
+            # Clamp FP drift so every draw in [0, 1) lands on a variant
+            cum_weights[-1] = 1.0
+        self.cum_weights = cum_weights
 
 
 class ABTestingService:
@@ -82,7 +235,19 @@ class ABTestingService:
     
     def __init__(self):
         self.campaign_repo = CampaignRepository()
-        self.experiments: Dict[str, ABTestExperiment] = {}
+        self._experiments: TTLCache = TTLCache(
+            maxsize=EXPERIMENT_CACHE_SIZE,
+            ttl=EXPERIMENT_CACHE_TTL
+        )
+        self._dirty_counts: Dict[str, Counter] = defaultdict(Counter)
+        self._pending_assignments = 0
+        self._flush_requested = asyncio.Event()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._sweep_task: Optional[asyncio.Task] = None
+        self._assignment_cache: TTLCache = TTLCache(
+            maxsize=ASSIGNMENT_CACHE_SIZE,
+            ttl=ASSIGNMENT_CACHE_TTL
+        )
     
     async def create_experiment(
         self,
@@ -124,12 +289,12 @@ class ABTestingService:
             name=name,
             description=description,
             variants=variant_objects,
-            status=ExperimentStatus.DRAFT,
+            status=_STATUS_DRAFT,
             assignment_strategy=assignment_strategy,
             min_sample_size=min_sample_size
         )
         
-        self.experiments[experiment_id] = experiment
+        self._experiments[experiment_id] = experiment
         
         # Store in database
         await self.campaign_repo.create_experiment(campaign_id, {
@@ -139,29 +304,130 @@ class ABTestingService:
             'variants': [self._variant_to_dict(v) for v in variant_objects],
             'assignment_strategy': assignment_strategy.value,
             'min_sample_size': min_sample_size,
-            'status': ExperimentStatus.DRAFT.value
+            'status': _STATUS_VALUES[_STATUS_DRAFT]
         })
         
         return experiment_id
     
+    async def _get_experiment(self, experiment_id: str) -> Optional[ABTestExperiment]:
+        """Get an experiment from the cache, loading it from the database on a miss"""
+        self._ensure_sweep_task()
+        experiment = self._experiments.get(experiment_id)
+        
+        if experiment is None:
+            try:
+                experiment_uuid = UUID(experiment_id)
+            except ValueError:
+                return None
+            
+            record = await self.campaign_repo.get_experiment(experiment_uuid)
+            if not record:
+                return None
+            
+            experiment = self._experiment_from_record(record)
+            self._experiments[experiment_id] = experiment
+        
+        return experiment
+    
+    def _experiment_from_record(self, record: Dict[str, Any]) -> ABTestExperiment:
+        """Rebuild an experiment (with its variant metrics) from a stored row"""
+        variants = []
+        for variant_data in record.get('variants') or []:
+            metrics = variant_data.get('metrics') or {}
+            if 'rating_sum' not in metrics and metrics.get('ratings'):
+                # Rows written before ratings were stored as sums
+                n, mean = metrics['ratings'], metrics.get('average_rating', 0)
+                metrics = {
+                    **metrics,
+                    'rating_sum': mean * n,
+                    'rating_sum_sq': metrics.get('rating_m2', 0) + n * mean ** 2
+                }
+            variants.append(ExperimentVariant(
+                id=variant_data['id'],
+                name=variant_data.get('name', variant_data['id']),
+                weight=variant_data.get('weight', 0.0),
+                template=variant_data.get('template', 'default'),
+                parameters=variant_data.get('parameters') or {},
+                metrics_row=np.array([float(metrics.get(c, 0)) for c in METRIC_COLUMNS])
+            ))
+        
+        return ABTestExperiment(
+            id=str(record['id']),
+            campaign_id=str(record.get('campaign_id')),
+            name=record.get('name', ''),
+            description=record.get('description') or '',
+            variants=variants,
+            status=ExperimentStatus(record.get('status', 'draft')),
+            assignment_strategy=VariantAssignmentStrategy(
+                record.get('assignment_strategy') or 'weighted'
+            ),
+            min_sample_size=record.get('min_sample_size') or 100,
+            confidence_level=float(record.get('confidence_level') or 0.95),
+            created_at=_parse_timestamp(record.get('created_at')),
+            started_at=_parse_timestamp(record.get('started_at')),
+            ended_at=_parse_timestamp(record.get('ended_at')),
+            winning_variant=record.get('winning_variant'),
+            statistical_significance=record.get('statistical_significance')
+        )
+    
     async def start_experiment(self, experiment_id: str) -> bool:
         """Start an A/B test experiment"""
-        if experiment_id not in self.experiments:
+        experiment = await self._get_experiment(experiment_id)
+        if experiment is None:
             return False
         
-        experiment = self.experiments[experiment_id]
-        
-        if experiment.status != ExperimentStatus.DRAFT:
+        if experiment.status is not _STATUS_DRAFT:
             return False
         
-        experiment.status = ExperimentStatus.RUNNING
+        experiment.status = _STATUS_RUNNING
         experiment.started_at = datetime.now()
         
         # Update in database
-        await self._update_experiment_in_db(experiment)
+        await self.campaign_repo.update_experiment_status(UUID(experiment_id), {
+            'status': _STATUS_VALUES[experiment.status],
+            'started_at': experiment.started_at.isoformat()
+        })
         
         return True
     
+    def _ensure_sweep_task(self):
+        """Start the analysis sweeper on this worker if it is not running"""
+        if self._sweep_task is None or self._sweep_task.done():
+            self._sweep_task = asyncio.create_task(self._analysis_sweep_loop())
+    
+    async def _analysis_sweep_loop(self):
+        """
+        Periodically analyze running experiments that have new participants
+        Running experiments are listed from the database, so ones whose cache
+        entry expired or that were started on another worker are included
+        """
+        while True:
+            await asyncio.sleep(ANALYSIS_SWEEP_INTERVAL)
+            
+            try:
+                experiment_ids = await self.campaign_repo.list_experiment_ids(
+                    _STATUS_VALUES[_STATUS_RUNNING]
+                )
+            except Exception:
+                logger.exception("Error listing running experiments")
+                continue
+            
+            for experiment_id in experiment_ids:
+                try:
+                    experiment = await self._get_experiment(str(experiment_id))
+                    if experiment is None or experiment.status is not _STATUS_RUNNING:
+                        continue
+                    if experiment.total_participants <= experiment._last_analyzed_n:
+                        continue
+                    
+                    if await self._check_experiment_completion(experiment, force=True):
+                        await self._update_experiment_in_db(experiment)
+                except Exception:
+                    logger.exception(
+                        "Error analyzing experiment",
+                        extra={'experiment_id': str(experiment_id)}
+                    )
+    
     async def assign_variant(
         self,
         experiment_id: str,
@@ -171,12 +437,11 @@ class ABTestingService:
         """
         Assign a variant to a customer for an experiment
         """
-        if experiment_id not in self.experiments:
+        experiment = await self._get_experiment(experiment_id)
+        if experiment is None:
             return None
         
-        experiment = self.experiments[experiment_id]
-        
-        if experiment.status != ExperimentStatus.RUNNING:
+        if experiment.status is not _STATUS_RUNNING:
             return None
         
         # Choose assignment strategy
@@ -198,9 +463,11 @@ class ABTestingService:
             campaign_id
         )
         
-        # Update participant count
-        variant.metrics["participants"] += 1
-        await self._update_experiment_in_db(experiment)
+        # Update participant count (in memory is authoritative; DB catches up on flush)
+        experiment.metrics[variant.idx, PARTICIPANTS] += 1
+        experiment.total_participants += 1
+        self._dirty_counts[experiment.id][variant.id] += 1
+        self._maybe_schedule_flush()
         
         return {
             'experiment_id': experiment_id,
@@ -210,6 +477,66 @@ class ABTestingService:
             'parameters': variant.parameters
         }
     
+    def _maybe_schedule_flush(self):
+        """Start a flush after the interval, or right away once the batch is full"""
+        self._pending_assignments += 1
+        
+        if self._pending_assignments >= PARTICIPANT_FLUSH_BATCH_SIZE:
+            self._flush_requested.set()
+        
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+    
+    async def _delayed_flush(self):
+        """Wait for the flush interval (or an early request), then flush"""
+        try:
+            await asyncio.wait_for(
+                self._flush_requested.wait(),
+                PARTICIPANT_FLUSH_INTERVAL
+            )
+        except asyncio.TimeoutError:
+            pass
+        
+        await self.flush_participant_counts()
+    
+    async def flush_participant_counts(self):
+        """Write coalesced participant increments to the database"""
+        self._flush_requested.clear()
+        self._pending_assignments = 0
+        dirty_counts, self._dirty_counts = self._dirty_counts, defaultdict(Counter)
+        
+        try:
+            while dirty_counts:
+                experiment_id, increments = next(iter(dirty_counts.items()))
+                try:
+                    await self.campaign_repo.bulk_increment_participants(
+                        UUID(experiment_id),
+                        dict(increments)
+                    )
+                except Exception:
+                    logger.exception(
+                        "Error flushing participant counts",
+                        extra={'experiment_id': experiment_id}
+                    )
+                    # Keep the deltas so the next flush retries them
+                    self._dirty_counts[experiment_id].update(increments)
+                del dirty_counts[experiment_id]
+        finally:
+            # A cancelled flush leaves its unwritten deltas for the next one
+            for experiment_id, increments in dirty_counts.items():
+                self._dirty_counts[experiment_id].update(increments)
+    
+    async def aclose(self):
+        """Stop the background tasks and write any buffered participant counts"""
+        tasks = [task for task in (self._flush_task, self._sweep_task) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._flush_task = None
+        self._sweep_task = None
+        
+        await self.flush_participant_counts()
+    
     def _assign_variant_hash_based(
         self,
         experiment: ABTestExperiment,
@@ -219,19 +546,12 @@ class ABTestingService:
         if not experiment.variants:
             return None
         
-        # Create a hash from phone number
-        hash_value = hash(customer_phone) % 1000000
-        normalized_hash = hash_value / 1000000.0  # 0.0 to 1.0
+        # Stable hash of the phone number (built-in hash() is salted per process)
+        normalized_hash = _stable_unit_hash(customer_phone)  # 0.0 to 1.0
         
         # Assign based on weight distribution
-        cumulative_weight = 0.0
-        for variant in experiment.variants:
-            cumulative_weight += variant.weight
-            if normalized_hash <= cumulative_weight:
-                return variant
-        
-        # Fallback to last variant
-        return experiment.variants[-1]
+        index = bisect.bisect_left(experiment.cum_weights, normalized_hash)
+        return experiment.variants[index]
     
     def _assign_variant_weighted(
         self,
@@ -241,15 +561,10 @@ class ABTestingService:
         if not experiment.variants:
             return None
         
-        random_value = random.random()
-        cumulative_weight = 0.0
-        
-        for variant in experiment.variants:
-            cumulative_weight += variant.weight
-            if random_value <= cumulative_weight:
-                return variant
-        
-        return experiment.variants[-1]
+        return experiment._rng.choices(
+            experiment.variants,
+            cum_weights=experiment.cum_weights
+        )[0]
     
     def _assign_variant_random(
         self,
@@ -259,7 +574,7 @@ class ABTestingService:
         if not experiment.variants:
             return None
         
-        return random.choice(experiment.variants)
+        return experiment._rng.choice(experiment.variants)
     
     async def record_variant_result(
         self,
@@ -270,11 +585,10 @@ class ABTestingService:
         """
         Record the result for a variant assignment
         """
-        if experiment_id not in self.experiments:
+        experiment = await self._get_experiment(experiment_id)
+        if experiment is None:
             return False
         
-        experiment = self.experiments[experiment_id]
-        
         # Get the variant assignment
         variant_id = await self._get_customer_variant_assignment(
             experiment_id,
@@ -293,65 +607,91 @@ class ABTestingService:
         if not variant:
             return False
         
-        # Update variant metrics
-        await self._update_variant_metrics(variant, result_data)
-        
-        # Check if experiment should be analyzed
-        await self._check_experiment_completion(experiment)
+        # Update variant metrics and persist only the increments
+        increments = await self._update_variant_metrics(experiment, variant, result_data)
+        if increments:
+            await self.campaign_repo.update_variant_result(
+                UUID(experiment_id),
+                variant.id,
+                increments
+            )
         
-        await self._update_experiment_in_db(experiment)
+        # Full write only when analysis may have changed the experiment state
+        if await self._check_experiment_completion(experiment):
+            await self._update_experiment_in_db(experiment)
         
         return True
     
     async def _update_variant_metrics(
         self,
+        experiment: ABTestExperiment,
         variant: ExperimentVariant,
         result_data: Dict[str, Any]
-    ):
-        """Update variant performance metrics"""
+    ) -> Dict[str, int]:
+        """
+        Update variant performance metrics
+        Returns the counter increments that were applied
+        """
+        m = experiment.metrics
+        i = variant.idx
+        increments = {}
+        
         # Response recorded
         if result_data.get('responded'):
-            variant.metrics["responses"] += 1
+            m[i, RESPONSES] += 1
+            experiment.total_responses += 1
+            increments['responses'] = 1
         
         # Rating data
         rating = result_data.get('rating')
         if rating:
-            current_avg = variant.metrics["average_rating"]
-            current_responses = variant.metrics["responses"]
-            if current_responses > 1:
-                variant.metrics["average_rating"] = (
-                    (current_avg * (current_responses - 1) + rating) / current_responses
-                )
-            else:
-                variant.metrics["average_rating"] = rating
+            # Count, sum and sum of squares; mean and variance are derived
+            m[i, RATINGS] += 1
+            m[i, RATING_SUM] += rating
+            m[i, RATING_SUM_SQ] += rating * rating
+            increments['ratings'] = 1
+            increments['rating_sum'] = rating
+            increments['rating_sum_sq'] = rating * rating
         
         # Sentiment data
         sentiment_score = result_data.get('sentiment_score')
         if sentiment_score is not None and sentiment_score > 0.3:
-            variant.metrics["positive_sentiment"] += 1
+            m[i, POSITIVE_SENTIMENT] += 1
+            increments['positive_sentiment'] = 1
         
         # Completion data
         if result_data.get('conversation_completed'):
-            variant.metrics["completion_rate"] = (
-                variant.metrics.get("completed_conversations", 0) + 1
-            ) / variant.metrics["participants"]
-        
-        # Update response rate
-        if variant.metrics["participants"] > 0:
-            variant.metrics["response_rate"] = (
-                variant.metrics["responses"] / variant.metrics["participants"]
-            )
+            m[i, COMPLETED] += 1
+            increments['completed_conversations'] = 1
+        
+        return increments
     
-    async def _check_experiment_completion(self, experiment: ABTestExperiment):
-        """Check if experiment has enough data for statistical analysis"""
-        total_participants = sum(v.metrics["participants"] for v in experiment.variants)
+    async def _check_experiment_completion(
+        self,
+        experiment: ABTestExperiment,
+        force: bool = False
+    ) -> bool:
+        """
+        Check if experiment has enough data for statistical analysis
+        Analysis only re-runs once enough new participants have arrived (or
+        when forced by the sweeper); returns whether it ran.
+        """
+        total_participants = experiment.total_participants
         
         # Check minimum sample size
         if total_participants < experiment.min_sample_size:
-            return
+            return False
+        
+        if not force and total_participants < experiment._next_analyze_at:
+            return False
         
         # Run statistical analysis
         significance_results = await self._analyze_statistical_significance(experiment)
+        experiment._last_analyzed_n = total_participants
+        experiment._next_analyze_at = max(
+            total_participants + ANALYSIS_MIN_NEW_PARTICIPANTS,
+            int(total_participants * ANALYSIS_GROWTH_FACTOR)
+        )
         
         if significance_results['is_significant']:
             experiment.statistical_significance = significance_results
@@ -361,6 +701,8 @@ class ABTestingService:
             if significance_results['confidence'] >= experiment.confidence_level:
                 experiment.status = ExperimentStatus.COMPLETED
                 experiment.ended_at = datetime.now()
+        
+        return True
     
     async def _analyze_statistical_significance(
         self,
@@ -372,26 +714,38 @@ class ABTestingService:
         if len(experiment.variants) < 2:
             return {'is_significant': False, 'reason': 'Need at least 2 variants'}
         
+        # Same inputs as the last run give the same answer
+        m = experiment.metrics
+        cache_key = m[:, ANALYSIS_INPUT_COLUMNS].tobytes()
+        if cache_key == experiment._analysis_cache_key:
+            return experiment._analysis_cache_value
+        
         # Prepare data for analysis
+        eligible = np.flatnonzero(m[:, PARTICIPANTS] >= 10)  # Minimum data requirement
+        response_rates = m[eligible, RESPONSES] / m[eligible, PARTICIPANTS]
+        
         variant_data = []
-        for variant in experiment.variants:
-            if variant.metrics["participants"] < 10:  # Minimum data requirement
-                continue
-            
+        for i, response_rate in zip(eligible, response_rates):
+            variant = experiment.variants[i]
             variant_data.append({
                 'id': variant.id,
                 'name': variant.name,
-                'participants': variant.metrics["participants"],
-                'responses': variant.metrics["responses"],
-                'response_rate': variant.metrics["response_rate"],
-                'average_rating': variant.metrics["average_rating"]
+                'participants': int(m[i, PARTICIPANTS]),
+                'responses': int(m[i, RESPONSES]),
+                'response_rate': float(response_rate),
+                'average_rating': variant.average_rating,
+                'ratings': int(m[i, RATINGS]),
+                'rating_variance': variant.rating_variance
             })
         
         if len(variant_data) < 2:
             return {'is_significant': False, 'reason': 'Insufficient data'}
         
         # Analyze response rates using Chi-square test
-        response_rate_analysis = self._analyze_response_rates(variant_data)
+        response_rate_analysis = self._analyze_response_rates(
+            m[eligible, PARTICIPANTS],
+            m[eligible, RESPONSES]
+        )
         
         # Analyze average ratings using t-test
         rating_analysis = self._analyze_ratings(variant_data)
@@ -406,19 +760,17 @@ class ABTestingService:
         winning_variant = None
         if is_significant:
             # Choose variant with best combined performance
-            best_score = -1
-            for variant_info in variant_data:
-                # Combined score: response_rate * 0.6 + rating_normalized * 0.4
-                normalized_rating = variant_info['average_rating'] / 5.0
-                combined_score = (
-                    variant_info['response_rate'] * 0.6 +
-                    normalized_rating * 0.4
-                )
-                if combined_score > best_score:
-                    best_score = combined_score
-                    winning_variant = variant_info['id']
+            # Combined score: response_rate * 0.6 + rating_normalized * 0.4
+            ratings = m[eligible, RATINGS]
+            average_ratings = np.divide(
+                m[eligible, RATING_SUM], ratings,
+                out=np.zeros_like(ratings), where=ratings > 0
+            )
+            scores = response_rates * 0.6 + average_ratings / 5.0 * 0.4
+            winner_idx = eligible[int(np.argmax(scores))]
+            winning_variant = experiment.variants[winner_idx].id
         
-        return {
+        results = {
             'is_significant': is_significant,
             'confidence': max(
                 response_rate_analysis.get('confidence', 0),
@@ -427,92 +779,120 @@ class ABTestingService:
             'winning_variant': winning_variant,
             'response_rate_analysis': response_rate_analysis,
             'rating_analysis': rating_analysis,
-            'analyzed_at': datetime.now().isoformat()
+            'analyzed_at': _iso_now()
         }
+        
+        experiment._analysis_cache_key = cache_key
+        experiment._analysis_cache_value = results
+        
+        return results
     
     def _analyze_response_rates(
         self,
-        variant_data: List[Dict[str, Any]]
+        participants: np.ndarray,
+        responses: np.ndarray
     ) -> Dict[str, Any]:
-        """Analyze response rate differences using Chi-square test"""
-        if len(variant_data) != 2:
-            return {'significant': False, 'reason': 'Only supports 2-variant comparison'}
-        
-        v1, v2 = variant_data
+        """Analyze response rate differences using a V x 2 chi-square test"""
+        if len(participants) < 2:
+            return {'significant': False, 'reason': 'Need at least 2 variants'}
+        
+        participants = participants.astype(np.int64)
+        responses = responses.astype(np.int64)
+        
+        if len(participants) == 2:
+            # 2x2 contingency table [[a, b], [c, d]]:
+            # [[responded_v1, not_responded_v1], [responded_v2, not_responded_v2]]
+            a, c = (int(x) for x in responses)
+            b, d = (int(x) for x in participants - responses)
+            n = a + b + c + d
+            denominator = (a + b) * (c + d) * (a + c) * (b + d)
+            
+            if denominator == 0:
+                return {'significant': False, 'reason': 'Contingency table has an empty margin'}
+            
+            # Closed-form Pearson chi-square with Yates' continuity correction
+            # (same statistic chi2_contingency reports for one degree of freedom)
+            corrected_diff = max(abs(a * d - b * c) - n / 2, 0)
+            chi2 = n * corrected_diff ** 2 / denominator
+        else:
+            observed = np.stack([responses, participants - responses], axis=1)
+            row_totals = observed.sum(axis=1)
+            col_totals = observed.sum(axis=0)
+            
+            if not (row_totals.all() and col_totals.all()):
+                return {'significant': False, 'reason': 'Contingency table has an empty margin'}
+            
+            expected = np.outer(row_totals, col_totals) / row_totals.sum()
+            chi2 = float(((observed - expected) ** 2 / expected).sum())
         
-        # Create contingency table
-        # [[responded_v1, not_responded_v1], [responded_v2, not_responded_v2]]
-        contingency_table = [
-            [v1['responses'], v1['participants'] - v1['responses']],
-            [v2['responses'], v2['participants'] - v2['responses']]
-        ]
+        dof = len(participants) - 1
+        p_value = float(stats.chi2.sf(chi2, dof))
+        response_rates = responses / participants
         
-        try:
-            chi2, p_value, dof, expected = stats.chi2_contingency(contingency_table)
-            
-            return {
-                'significant': p_value < 0.05,
-                'p_value': p_value,
-                'chi2_statistic': chi2,
-                'confidence': (1 - p_value) if p_value < 0.05 else 0,
-                'effect_size': abs(v1['response_rate'] - v2['response_rate'])
-            }
-        except Exception as e:
-            return {'significant': False, 'error': str(e)}
+        return {
+            'significant': p_value < 0.05,
+            'p_value': p_value,
+            'chi2_statistic': chi2,
+            'degrees_of_freedom': dof,
+            'confidence': 1 - p_value,
+            'effect_size': float(response_rates.max() - response_rates.min())
+        }
     
     def _analyze_ratings(
         self,
         variant_data: List[Dict[str, Any]]
     ) -> Dict[str, Any]:
-        """Analyze rating differences using t-test"""
+        """Analyze rating differences using Welch's t-test"""
         if len(variant_data) != 2:
             return {'significant': False, 'reason': 'Only supports 2-variant comparison'}
         
         v1, v2 = variant_data
+        n1, n2 = v1['ratings'], v2['ratings']
         
-        # For simplicity, assume normal distribution of ratings
-        # In production, you'd want actual rating distributions
+        if n1 < 2 or n2 < 2:
+            return {'significant': False, 'reason': 'Need at least 2 ratings per variant'}
         
-        try:
-            # Simplified t-test assuming equal variance
-            mean_diff = abs(v1['average_rating'] - v2['average_rating'])
-            
-            # Rough estimate of significance based on mean difference
-            # This is simplified - proper t-test would need individual rating data
-            if mean_diff > 0.5:  # Half star difference
-                return {
-                    'significant': True,
-                    'mean_difference': mean_diff,
-                    'confidence': 0.95,
-                    'better_variant': v1['id'] if v1['average_rating'] > v2['average_rating'] else v2['id']
-                }
-            else:
-                return {
-                    'significant': False,
-                    'mean_difference': mean_diff,
-                    'confidence': 0
-                }
-        except Exception as e:
-            return {'significant': False, 'error': str(e)}
+        mean_diff = v1['average_rating'] - v2['average_rating']
+        se1 = v1['rating_variance'] / n1
+        se2 = v2['rating_variance'] / n2
+        standard_error = np.sqrt(se1 + se2)
+        
+        if standard_error == 0:
+            return {'significant': False, 'reason': 'Ratings have zero variance'}
+        
+        t_statistic = mean_diff / standard_error
+        # Welch-Satterthwaite degrees of freedom
+        df = (se1 + se2) ** 2 / (se1 ** 2 / (n1 - 1) + se2 ** 2 / (n2 - 1))
+        p_value = float(2 * stats.t.sf(abs(t_statistic), df))
+        
+        return {
+            'significant': p_value < 0.05,
+            'p_value': p_value,
+            't_statistic': float(t_statistic),
+            'degrees_of_freedom': float(df),
+            'mean_difference': abs(mean_diff),
+            'confidence': 1 - p_value,
+            'better_variant': v1['id'] if mean_diff > 0 else v2['id']
+        }
     
     async def get_experiment_results(
         self,
         experiment_id: str
     ) -> Optional[Dict[str, Any]]:
         """Get comprehensive experiment results"""
-        if experiment_id not in self.experiments:
+        experiment = await self._get_experiment(experiment_id)
+        if experiment is None:
             return None
         
-        experiment = self.experiments[experiment_id]
-        
         # Calculate summary statistics
-        total_participants = sum(v.metrics["participants"] for v in experiment.variants)
-        total_responses = sum(v.metrics["responses"] for v in experiment.variants)
+        participants = experiment.metrics[:, PARTICIPANTS]
+        total_participants = experiment.total_participants
+        total_responses = experiment.total_responses
         
         results = {
             'experiment_id': experiment_id,
             'name': experiment.name,
-            'status': experiment.status.value,
+            'status': _STATUS_VALUES[experiment.status],
             'created_at': experiment.created_at.isoformat(),
             'started_at': experiment.started_at.isoformat() if experiment.started_at else None,
             'ended_at': experiment.ended_at.isoformat() if experiment.ended_at else None,
@@ -530,13 +910,13 @@ class ABTestingService:
                 'name': variant.name,
                 'weight': variant.weight,
                 'template': variant.template,
-                'metrics': variant.metrics.copy()
+                'metrics': variant.metrics
             }
             
             # Add percentage of total participants
             if total_participants > 0:
-                variant_result['participant_share'] = (
-                    variant.metrics["participants"] / total_participants * 100
+                variant_result['participant_share'] = float(
+                    participants[variant.idx] / total_participants * 100
                 )
             
             results['variants'].append(variant_result)
@@ -551,17 +931,18 @@ class ABTestingService:
         campaign_id: Optional[UUID]
     ):
         """Record variant assignment for tracking"""
-        # This would be stored in database for persistent tracking
+        # Prime the cache so the results that follow the assignment skip the DB
+        self._assignment_cache[(experiment_id, customer_phone)] = variant_id
+        
         assignment_record = {
             'experiment_id': experiment_id,
             'customer_phone': customer_phone,
             'variant_id': variant_id,
             'campaign_id': str(campaign_id) if campaign_id else None,
-            'assigned_at': datetime.now().isoformat()
+            'assigned_at': _iso_now()
         }
         
-        # Store in assignments table (implementation needed)
-        pass
+        await self.campaign_repo.create_variant_assignment(assignment_record)
     
     async def _get_customer_variant_assignment(
         self,
@@ -569,34 +950,39 @@ class ABTestingService:
         customer_phone: str
     ) -> Optional[str]:
         """Get customer's variant assignment"""
-        # This would query the assignments table
-        # For now, return None (implementation needed)
-        return None
+        key = (experiment_id, customer_phone)
+        variant_id = self._assignment_cache.get(key)
+        
+        if variant_id is None:
+            variant_id = await self.campaign_repo.get_variant_assignment(
+                UUID(experiment_id),
+                customer_phone
+            )
+            if variant_id is not None:
+                self._assignment_cache[key] = variant_id
+        
+        return variant_id
     
     async def _update_experiment_in_db(self, experiment: ABTestExperiment):
-        """Update experiment in database"""
-        experiment_data = {
-            'status': experiment.status.value,
-            'started_at': experiment.started_at.isoformat() if experiment.started_at else None,
-            'ended_at': experiment.ended_at.isoformat() if experiment.ended_at else None,
+        """
+        Update experiment state (status, timestamps, winner) in database
+        Variant metrics are not written here; they only change through the
+        atomic increments, so other workers' counts are never overwritten
+        """
+        # orjson formats datetimes itself and handles numpy scalars in the analysis
+        payload = orjson.dumps({
+            'status': _STATUS_VALUES[experiment.status],
+            'started_at': experiment.started_at,
+            'ended_at': experiment.ended_at,
             'winning_variant': experiment.winning_variant,
-            'statistical_significance': experiment.statistical_significance,
-            'variants': [self._variant_to_dict(v) for v in experiment.variants],
-            'updated_at': datetime.now().isoformat()
-        }
+            'statistical_significance': experiment.statistical_significance
+        }, option=orjson.OPT_SERIALIZE_NUMPY)
         
-        await self.campaign_repo.update_experiment_metrics(
+        await self.campaign_repo.update_experiment_state(
             UUID(experiment.id),
-            experiment_data
+            payload
         )
     
     def _variant_to_dict(self, variant: ExperimentVariant) -> Dict[str, Any]:
         """Convert variant to dictionary for storage"""
-        return {
-            'id': variant.id,
-            'name': variant.name,
-            'weight': variant.weight,
-            'template': variant.template,
-            'parameters': variant.parameters,
-            'metrics': variant.metrics
-        }
\ No newline at end of file
+        return dict(zip(_VARIANT_KEYS, _VARIANT_GET(variant)))
\ No newline at end of file
@@ -4,15 +4,75 @@ Handles negative feedback alerts and notifications
 """
 
 from typing import Dict, List, Any, Optional
-from datetime import datetime
+from collections import Counter
+from datetime import datetime, timezone
 from uuid import UUID
 import asyncio
 import json
+import logging
+import time
 from enum import Enum
 
+from cachetools import TTLCache
+import orjson
 from supabase import create_client, Client
 import httpx
 
+from ..utils.circuit_breaker import circuit_registry, CommonConfigs, CircuitBreakerException
+
+logger = logging.getLogger(__name__)
+
+
+# Outgoing webhooks are batched: flushed WEBHOOK_BATCH_INTERVAL after the first
+# queued event, or as soon as WEBHOOK_BATCH_SIZE events are waiting
+WEBHOOK_BATCH_INTERVAL = 0.2  # seconds
+WEBHOOK_BATCH_SIZE = 50
+
+# Notification fan-out runs on a bounded queue drained by a worker pool, so
+# alert ingestion only waits for the alert insert
+NOTIFICATION_QUEUE_SIZE = 1000
+NOTIFICATION_WORKERS = 8
+
+# Webhook delivery retries transport errors and 5xx with capped exponential
+# backoff; exhausted or circuit-rejected batches go to webhook_dead_letters
+WEBHOOK_MAX_ATTEMPTS = 3
+WEBHOOK_BACKOFF_BASE = 0.2  # seconds, doubled per retry
+WEBHOOK_BACKOFF_MAX = 2.0
+
+# Column lists for alert reads; avoids shipping unused fields over PostgREST
+ACTIVE_ALERT_COLUMNS = (
+    'id,restaurant_id,feedback_id,conversation_id,rule_id,'
+    'priority,title,details,status,created_at'
+)
+ALERT_STATS_COLUMNS = 'priority,status,created_at,acknowledged_at,rule_id'
+
+# Owner device tokens are reused across an alert burst for one restaurant
+OWNER_TOKENS_CACHE_SIZE = 10_000
+OWNER_TOKENS_CACHE_TTL = 60  # seconds
+
+# After notifying for a (restaurant, rule), repeats within the window are stored
+# but not pushed again, so a burst of bad reviews produces one notification
+NOTIFICATION_SUPPRESSION_WINDOWS = {
+    'immediate': 60,  # seconds
+    'high': 300,
+    'medium': 900,
+    'low': 1800
+}
+NOTIFICATION_SUPPRESSION_CACHE_SIZE = 100_000
+
+
+def _utc_now_iso() -> str:
+    """UTC timestamp in ISO format (skips the local timezone lookup)"""
+    return datetime.utcnow().isoformat() + 'Z'
+
+
+def _parse_utc(value: str) -> datetime:
+    """Parse an ISO timestamp as naive UTC so stored aware and naive values compare"""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
 
 class AlertPriority(Enum):
     """Alert priority levels"""
@@ -22,6 +82,13 @@ class AlertPriority(Enum):
     LOW = "low"            # General feedback
 
 
+# Lower rank = more urgent (declaration order of AlertPriority)
+_PRIORITY_RANK = {priority.value: rank for rank, priority in enumerate(AlertPriority)}
+_ALL_PRIORITY_VALUES = tuple(priority.value for priority in AlertPriority)
+_HIGH_PRIORITY_VALUES = frozenset({AlertPriority.IMMEDIATE.value, AlertPriority.HIGH.value})
+_STAT_STATUSES = ('pending', 'acknowledged', 'resolved')
+
+
 class AlertService:
     """Manage real-time alerts for feedback"""
     
@@ -29,50 +96,137 @@ class AlertService:
         self.supabase: Client = create_client(supabase_url, supabase_key)
         self.webhook_url = None  # Optional webhook for external alerts
         self.alert_rules = self._initialize_alert_rules()
+        self._rules_by_id = {rule['id']: rule for rule in self.alert_rules}
+        self._owner_tokens_cache: TTLCache = TTLCache(
+            maxsize=OWNER_TOKENS_CACHE_SIZE,
+            ttl=OWNER_TOKENS_CACHE_TTL
+        )
+        self._last_notified: TTLCache = TTLCache(
+            maxsize=NOTIFICATION_SUPPRESSION_CACHE_SIZE,
+            ttl=max(NOTIFICATION_SUPPRESSION_WINDOWS.values())
+        )
+        self._http: Optional[httpx.AsyncClient] = None
+        self._http_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._webhook_queue: Optional[asyncio.Queue] = None
+        self._flusher_task: Optional[asyncio.Task] = None
+        self._notification_queue: Optional[asyncio.Queue] = None
+        self._notification_workers: List[asyncio.Task] = []
+        
+        # Delivery metrics, reported by get_stats()
+        self._stats: Counter = Counter()
+        self._notification_latency_total = 0.0
+    
+    def _get_http_client(self) -> httpx.AsyncClient:
+        """
+        Shared keep-alive client for outgoing webhooks
+        Celery tasks share the worker's persistent loop, so this is built
+        once; it is only recreated if the running loop changes, since a
+        pool can't outlive its loop
+        """
+        loop = asyncio.get_running_loop()
+        if self._http is None or self._http_loop is not loop:
+            self._http = httpx.AsyncClient(
+                timeout=10.0,
+                limits=httpx.Limits(max_keepalive_connections=20)
+            )
+            self._http_loop = loop
+        return self._http
+    
+    async def _sb(self, query):
+        """Run a Supabase query off the event loop (the client is synchronous)"""
+        return await asyncio.to_thread(query.execute)
+    
+    async def aclose(self):
+        """Deliver queued notifications and webhooks and close the shared HTTP client"""
+        await self.flush_notifications()
+        
+        for worker in self._notification_workers:
+            worker.cancel()
+        self._notification_workers = []
+        self._notification_queue = None
+        
+        if self._flusher_task is not None:
+            self._flusher_task.cancel()
+            self._flusher_task = None
+            self._webhook_queue = None
+        
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+            self._http_loop = None
         
     def _initialize_alert_rules(self) -> List[Dict[str, Any]]:
-        """Define alert trigger rules"""
+        """Define alert trigger rules (conditions live in _match_rules)"""
         return [
             {
                 'id': 'low_rating_immediate',
-                'condition': lambda feedback: feedback.get('rating', 5) <= 2,
                 'priority': AlertPriority.IMMEDIATE,
                 'description': 'Very low rating (1-2 stars)'
             },
             {
                 'id': 'medium_rating',
-                'condition': lambda feedback: feedback.get('rating', 5) == 3,
                 'priority': AlertPriority.MEDIUM,
                 'description': 'Medium rating (3 stars)'
             },
             {
                 'id': 'negative_sentiment',
-                'condition': lambda feedback: feedback.get('sentiment_score', 0) < -0.5,
                 'priority': AlertPriority.HIGH,
                 'description': 'Strong negative sentiment detected'
             },
             {
                 'id': 'food_quality_issue',
-                'condition': lambda feedback: 'food quality' in feedback.get('topics', []) 
-                                            and feedback.get('sentiment_score', 0) < 0,
                 'priority': AlertPriority.HIGH,
                 'description': 'Food quality complaint'
             },
             {
                 'id': 'service_complaint',
-                'condition': lambda feedback: 'service' in feedback.get('topics', []) 
-                                            and feedback.get('sentiment_score', 0) < 0,
                 'priority': AlertPriority.HIGH,
                 'description': 'Service complaint'
             },
             {
                 'id': 'repeated_issue',
-                'condition': lambda feedback: feedback.get('is_repeated_issue', False),
                 'priority': AlertPriority.HIGH,
                 'description': 'Repeated customer complaint'
             }
         ]
     
+    def _match_rules(self, feedback: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Decision table: read each field once, return matching rules in rule order"""
+        rules = self._rules_by_id
+        rating = feedback.get('rating', 5)
+        sentiment_score = feedback.get('sentiment_score', 0)
+        repeated = feedback.get('is_repeated_issue', False)
+        matched = []
+        
+        if rating <= 2:
+            matched.append(rules['low_rating_immediate'])
+        elif rating == 3:
+            matched.append(rules['medium_rating'])
+        
+        if sentiment_score < -0.5:
+            matched.append(rules['negative_sentiment'])
+        
+        if sentiment_score < 0:
+            topics = set(feedback.get('topics') or ())
+            if 'food quality' in topics:
+                matched.append(rules['food_quality_issue'])
+            if 'service' in topics:
+                matched.append(rules['service_complaint'])
+        
+        if repeated:
+            matched.append(rules['repeated_issue'])
+        
+        return matched
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Alert creation and delivery counters for monitoring"""
+        stats = dict(self._stats)
+        sent = self._stats['notifications_sent']
+        stats['average_notification_latency'] = (
+            self._notification_latency_total / sent if sent else None
+        )
+        return stats
+    
     async def process_feedback_for_alerts(
         self,
         feedback: Dict[str, Any]
@@ -81,31 +235,49 @@ class AlertService:
         Process feedback and generate alerts if needed
         Returns list of generated alerts
         """
-        generated_alerts = []
+        if self._no_alert_possible(feedback):
+            return []
+        
+        matching_rules = self._match_rules(feedback)
         
-        for rule in self.alert_rules:
-            if rule['condition'](feedback):
-                alert = await self._create_alert(feedback, rule)
-                generated_alerts.append(alert)
+        if not matching_rules:
+            return []
+        
+        # One timestamp per feedback event so alert and realtime rows line up
+        now_iso = _utc_now_iso()
+        generated_alerts = await self._create_alerts(feedback, matching_rules, now_iso)
         
         # Send notifications for high priority alerts
         high_priority_alerts = [
             a for a in generated_alerts 
-            if a['priority'] in [AlertPriority.IMMEDIATE.value, AlertPriority.HIGH.value]
+            if a['priority'] in _HIGH_PRIORITY_VALUES
         ]
         
         if high_priority_alerts:
-            await self._send_notifications(high_priority_alerts, feedback)
+            await self._enqueue_notification(high_priority_alerts, feedback, now_iso)
         
         return generated_alerts
     
-    async def _create_alert(
+    @staticmethod
+    def _no_alert_possible(feedback: Dict[str, Any]) -> bool:
+        """
+        Cheap triage for the common happy case: every rule needs a rating of
+        3 or below, negative sentiment, or a repeated issue
+        """
+        return (
+            feedback.get('rating', 5) >= 4 and
+            feedback.get('sentiment_score', 0) >= 0 and
+            not feedback.get('is_repeated_issue', False)
+        )
+    
+    def _build_alert_payload(
         self,
         feedback: Dict[str, Any],
-        rule: Dict[str, Any]
+        rule: Dict[str, Any],
+        now_iso: Optional[str] = None
     ) -> Dict[str, Any]:
-        """Create an alert record"""
-        alert_data = {
+        """Build an alert record for a matched rule"""
+        return {
             'restaurant_id': feedback.get('restaurant_id'),
             'feedback_id': feedback.get('id'),
             'conversation_id': feedback.get('conversation_id'),
@@ -120,32 +292,161 @@ class AlertService:
                 'topics': feedback.get('topics', [])
             },
             'status': 'pending',
-            'created_at': datetime.now().isoformat()
+            'created_at': now_iso or _utc_now_iso()
         }
+    
+    async def _create_alerts(
+        self,
+        feedback: Dict[str, Any],
+        rules: List[Dict[str, Any]],
+        now_iso: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Store alerts for all matched rules in one insert"""
+        now_iso = now_iso or _utc_now_iso()
+        payloads = [self._build_alert_payload(feedback, rule, now_iso) for rule in rules]
         
-        # Store in database
-        result = self.supabase.table('feedback_alerts').insert(alert_data).execute()
+        try:
+            result = await self._sb(
+                self.supabase.table('feedback_alerts').insert(payloads)
+            )
+        except Exception:
+            self._stats['alert_insert_failures'] += 1
+            logger.exception(
+                "Error creating alerts",
+                extra={'restaurant_id': feedback.get('restaurant_id')}
+            )
+            return []
+        
+        for payload in payloads:
+            self._stats[f"alerts_created.{payload['priority']}"] += 1
         
-        return result.data[0] if result.data else alert_data
+        if not result.data or len(result.data) != len(payloads):
+            return payloads
+        
+        # Rows come back in insert order; keep payload fields the row may omit
+        return [{**payload, **row} for payload, row in zip(payloads, result.data)]
+    
+    async def _enqueue_notification(
+        self,
+        alerts: List[Dict[str, Any]],
+        feedback: Dict[str, Any],
+        now_iso: Optional[str] = None
+    ):
+        """Hand alerts to the notification workers (waits only when the queue is full)"""
+        loop = asyncio.get_running_loop()
+        if (
+            not self._notification_workers or
+            self._notification_workers[0].get_loop() is not loop
+        ):
+            self._notification_queue = asyncio.Queue(maxsize=NOTIFICATION_QUEUE_SIZE)
+            self._notification_workers = [
+                asyncio.create_task(self._notification_worker())
+                for _ in range(NOTIFICATION_WORKERS)
+            ]
+        
+        await self._notification_queue.put((alerts, feedback, now_iso))
+    
+    async def _notification_worker(self):
+        """Consume queued alerts and run the notification fan-out"""
+        queue = self._notification_queue
+        
+        while True:
+            alerts, feedback, now_iso = await queue.get()
+            try:
+                await self._send_notifications(alerts, feedback, now_iso)
+            except Exception:
+                self._stats['notification_failures'] += 1
+                logger.exception(
+                    "Error sending notification",
+                    extra={'restaurant_id': feedback.get('restaurant_id')}
+                )
+            finally:
+                queue.task_done()
+    
+    async def flush_notifications(self):
+        """Wait for queued notifications, then post pending webhooks"""
+        if self._notification_queue is not None:
+            await self._notification_queue.join()
+        
+        await self.flush_webhooks()
     
     async def _send_notifications(
         self,
         alerts: List[Dict[str, Any]],
-        feedback: Dict[str, Any]
+        feedback: Dict[str, Any],
+        now_iso: Optional[str] = None
     ):
         """Send real-time notifications for alerts"""
+        alerts = self._filter_suppressed(alerts)
+        if not alerts:
+            return
         
-        # 1. Send via Supabase Realtime
-        await self._broadcast_realtime_alert(alerts[0])  # Send highest priority
+        # One notification per incident, listing every rule it triggered
+        merged = self._merge_alerts(alerts)
+        started = time.monotonic()
         
-        # 2. Send push notification (if configured)
-        await self._send_push_notification(alerts[0], feedback)
+        channels = [
+            # 1. Send via Supabase Realtime
+            self._broadcast_realtime_alert(merged, now_iso),
+            # 2. Send push notification (if configured)
+            self._send_push_notification(merged, feedback)
+        ]
         
         # 3. Send webhook (if configured)
         if self.webhook_url:
-            await self._send_webhook_notification(alerts, feedback)
+            channels.append(self._send_webhook_notification(alerts, feedback))
+        
+        # Channels are independent, so latency is the slowest one, not the sum
+        results = await asyncio.gather(*channels, return_exceptions=True)
+        
+        self._stats['notifications_sent'] += 1
+        self._notification_latency_total += time.monotonic() - started
+        
+        for result in results:
+            if isinstance(result, Exception):
+                self._stats['notification_failures'] += 1
+                logger.error(
+                    "Error sending notification",
+                    exc_info=result,
+                    extra={'restaurant_id': merged.get('restaurant_id')}
+                )
+    
+    @staticmethod
+    def _merge_alerts(alerts: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Combine alerts from one feedback into the most urgent alert plus related rules"""
+        top = min(
+            alerts,
+            key=lambda a: _PRIORITY_RANK.get(a.get('priority'), len(_PRIORITY_RANK))
+        )
+        return {
+            **top,
+            'related_rules': [a.get('rule_id') for a in alerts],
+            'max_priority': top.get('priority')
+        }
+    
+    def _filter_suppressed(self, alerts: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Drop alerts whose rule already notified this restaurant within its window"""
+        now = time.monotonic()
+        unsuppressed = []
+        
+        for alert in alerts:
+            key = (alert.get('restaurant_id'), alert.get('rule_id'))
+            window = NOTIFICATION_SUPPRESSION_WINDOWS.get(alert.get('priority'), 0)
+            last = self._last_notified.get(key)
+            
+            if last is not None and now - last < window:
+                continue
+            
+            self._last_notified[key] = now
+            unsuppressed.append(alert)
+        
+        return unsuppressed
     
-    async def _broadcast_realtime_alert(self, alert: Dict[str, Any]):
+    async def _broadcast_realtime_alert(
+        self,
+        alert: Dict[str, Any],
+        now_iso: Optional[str] = None
+    ):
         """Broadcast alert via Supabase Realtime"""
         try:
             # Publish to realtime channel
@@ -153,15 +454,19 @@ class AlertService:
             
             # Note: In production, this would use Supabase Realtime client
             # For now, we'll insert into a special table that triggers realtime
-            self.supabase.table('realtime_alerts').insert({
+            await self._sb(self.supabase.table('realtime_alerts').insert({
                 'channel': channel_name,
                 'type': 'feedback_alert',
                 'data': alert,
-                'created_at': datetime.now().isoformat()
-            }).execute()
+                'created_at': now_iso or _utc_now_iso()
+            }))
             
-        except Exception as e:
-            print(f"Error broadcasting realtime alert: {e}")
+        except Exception:
+            self._stats['notification_failures'] += 1
+            logger.exception(
+                "Error broadcasting realtime alert",
+                extra={'restaurant_id': alert.get('restaurant_id')}
+            )
     
     async def _send_push_notification(
         self,
@@ -171,33 +476,67 @@ class AlertService:
         """Send push notification to restaurant owner's mobile"""
         try:
             # Get restaurant owner's device tokens
-            owner_data = self.supabase.table('restaurant_owners').select(
-                'device_tokens'
-            ).eq('restaurant_id', alert['restaurant_id']).execute()
+            device_tokens = await self._get_owner_device_tokens(alert['restaurant_id'])
             
-            if not owner_data.data:
+            if not device_tokens:
                 return
             
-            device_tokens = owner_data.data[0].get('device_tokens', [])
+            title = f"⚠️ {alert['title']}"
+            body = f"Customer rated {feedback.get('rating', 'N/A')} stars"
+            data = {
+                'alert_id': alert.get('id'),
+                'feedback_id': feedback.get('id'),
+                'priority': alert['priority']
+            }
+            
+            # Send via push notification service (FCM/APNS), all devices at once
+            results = await asyncio.gather(
+                *(
+                    self._send_fcm_notification({
+                        'token': token,
+                        'title': title,
+                        'body': body,
+                        'data': data
+                    })
+                    for token in device_tokens
+                ),
+                return_exceptions=True
+            )
             
-            for token in device_tokens:
-                # Send via push notification service (FCM/APNS)
-                notification_data = {
-                    'token': token,
-                    'title': f"⚠️ {alert['title']}",
-                    'body': f"Customer rated {feedback.get('rating', 'N/A')} stars",
-                    'data': {
-                        'alert_id': alert.get('id'),
-                        'feedback_id': feedback.get('id'),
-                        'priority': alert['priority']
-                    }
-                }
-                
-                # This would integrate with FCM/APNS
-                await self._send_fcm_notification(notification_data)
+            for result in results:
+                if isinstance(result, Exception):
+                    self._stats['notification_failures'] += 1
+                    logger.error(
+                        "Error sending push notification",
+                        exc_info=result,
+                        extra={'restaurant_id': alert.get('restaurant_id')}
+                    )
                 
-        except Exception as e:
-            print(f"Error sending push notification: {e}")
+        except Exception:
+            self._stats['notification_failures'] += 1
+            logger.exception(
+                "Error sending push notification",
+                extra={'restaurant_id': alert.get('restaurant_id')}
+            )
+    
+    async def _get_owner_device_tokens(self, restaurant_id: str) -> List[str]:
+        """Owner device tokens for a restaurant, cached for OWNER_TOKENS_CACHE_TTL"""
+        restaurant_id = str(restaurant_id)
+        tokens = self._owner_tokens_cache.get(restaurant_id)
+        if tokens is not None:
+            return tokens
+        
+        owner_data = await self._sb(self.supabase.table('restaurant_owners').select(
+            'device_tokens'
+        ).eq('restaurant_id', restaurant_id))
+        
+        tokens = (owner_data.data[0].get('device_tokens') or []) if owner_data.data else []
+        self._owner_tokens_cache[restaurant_id] = tokens
+        return tokens
+    
+    def invalidate_owner(self, restaurant_id: UUID):
+        """Drop cached device tokens after the owner's tokens change"""
+        self._owner_tokens_cache.pop(str(restaurant_id), None)
     
     async def _send_fcm_notification(self, notification_data: Dict[str, Any]):
         """Send notification via Firebase Cloud Messaging"""
@@ -209,24 +548,113 @@ class AlertService:
         alerts: List[Dict[str, Any]],
         feedback: Dict[str, Any]
     ):
-        """Send alert via webhook"""
+        """Queue alert for batched webhook delivery"""
         if not self.webhook_url:
             return
         
+        loop = asyncio.get_running_loop()
+        if self._flusher_task is None or self._flusher_task.get_loop() is not loop:
+            self._webhook_queue = asyncio.Queue()
+            self._flusher_task = asyncio.create_task(self._flush_webhooks())
+        
+        self._webhook_queue.put_nowait((alerts, feedback))
+    
+    async def _flush_webhooks(self):
+        """Background flusher: post queued webhooks in batches"""
+        queue = self._webhook_queue
+        loop = asyncio.get_running_loop()
+        
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + WEBHOOK_BATCH_INTERVAL
+            
+            while len(batch) < WEBHOOK_BATCH_SIZE:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            
+            await self._post_webhook_batch(batch)
+    
+    async def flush_webhooks(self):
+        """Post any queued webhooks now (call before the event loop goes away)"""
+        queue = self._webhook_queue
+        if queue is None:
+            return
+        
+        while not queue.empty():
+            batch = []
+            while not queue.empty() and len(batch) < WEBHOOK_BATCH_SIZE:
+                batch.append(queue.get_nowait())
+            await self._post_webhook_batch(batch)
+    
+    async def _post_webhook_batch(self, batch: List[tuple]):
+        """Send one webhook carrying every queued alert event"""
+        payload = {
+            'type': 'feedback_alert',
+            'events': [
+                {'alerts': alerts, 'feedback': feedback}
+                for alerts, feedback in batch
+            ],
+            'timestamp': _utc_now_iso()
+        }
+        
+        # A dead endpoint fails fast instead of costing a timeout per batch
+        breaker = circuit_registry.get_breaker(
+            f"alert_webhook:{self.webhook_url}",
+            CommonConfigs.EXTERNAL_API
+        )
+        
         try:
-            async with httpx.AsyncClient() as client:
-                await client.post(
+            await breaker.call(self._post_with_retry, orjson.dumps(payload))
+        except CircuitBreakerException as e:
+            self._stats['webhook_failures'] += 1
+            logger.warning(f"Webhook circuit open: {e}")
+            await self._dead_letter_webhook(payload, str(e))
+        except Exception as e:
+            self._stats['webhook_failures'] += 1
+            logger.exception("Error sending webhook")
+            await self._dead_letter_webhook(payload, str(e))
+    
+    async def _post_with_retry(self, body: bytes) -> httpx.Response:
+        """POST the webhook body, retrying transport errors and 5xx responses"""
+        for attempt in range(1, WEBHOOK_MAX_ATTEMPTS + 1):
+            try:
+                response = await self._get_http_client().post(
                     self.webhook_url,
-                    json={
-                        'type': 'feedback_alert',
-                        'alerts': alerts,
-                        'feedback': feedback,
-                        'timestamp': datetime.now().isoformat()
-                    },
-                    timeout=10.0
+                    content=body,
+                    headers={'Content-Type': 'application/json'}
                 )
-        except Exception as e:
-            print(f"Error sending webhook: {e}")
+                response.raise_for_status()
+                return response
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code < 500 or attempt == WEBHOOK_MAX_ATTEMPTS:
+                    raise
+            except httpx.TransportError:
+                if attempt == WEBHOOK_MAX_ATTEMPTS:
+                    raise
+            
+            await asyncio.sleep(
+                min(WEBHOOK_BACKOFF_MAX, WEBHOOK_BACKOFF_BASE * 2 ** (attempt - 1))
+            )
+    
+    async def _dead_letter_webhook(self, payload: Dict[str, Any], error: str):
+        """Keep an undeliverable webhook batch for later replay"""
+        self._stats['webhooks_dead_lettered'] += 1
+        
+        # Round-trip through orjson so UUID/datetime values are JSON-safe for the insert
+        try:
+            await self._sb(self.supabase.table('webhook_dead_letters').insert({
+                'webhook_url': self.webhook_url,
+                'payload': orjson.loads(orjson.dumps(payload)),
+                'error': error[:1000],
+                'created_at': _utc_now_iso()
+            }))
+        except Exception:
+            logger.exception("Error storing dead-lettered webhook")
     
     async def acknowledge_alert(
         self,
@@ -238,37 +666,38 @@ class AlertService:
         try:
             update_data = {
                 'status': 'acknowledged',
-                'acknowledged_at': datetime.now().isoformat(),
+                'acknowledged_at': _utc_now_iso(),
                 'acknowledged_by': str(acknowledged_by)
             }
             
             if notes:
                 update_data['acknowledgment_notes'] = notes
             
-            result = self.supabase.table('feedback_alerts').update(
+            result = await self._sb(self.supabase.table('feedback_alerts').update(
                 update_data
-            ).eq('id', str(alert_id)).execute()
+            ).eq('id', str(alert_id)))
             
             return bool(result.data)
             
-        except Exception as e:
-            print(f"Error acknowledging alert: {e}")
+        except Exception:
+            logger.exception("Error acknowledging alert", extra={'alert_id': str(alert_id)})
             return False
     
     async def get_active_alerts(
         self,
         restaurant_id: UUID,
-        priority: Optional[AlertPriority] = None
+        priority: Optional[AlertPriority] = None,
+        columns: str = ACTIVE_ALERT_COLUMNS
     ) -> List[Dict[str, Any]]:
-        """Get active (unacknowledged) alerts for a restaurant"""
-        query = self.supabase.table('feedback_alerts').select('*').eq(
+        """Get active (unacknowledged) alerts for a restaurant; pass columns='*' for full rows"""
+        query = self.supabase.table('feedback_alerts').select(columns).eq(
             'restaurant_id', str(restaurant_id)
         ).eq('status', 'pending')
         
         if priority:
             query = query.eq('priority', priority.value)
         
-        result = query.order('created_at', desc=True).execute()
+        result = await self._sb(query.order('created_at', desc=True))
         
         return result.data if result.data else []
     
@@ -279,56 +708,74 @@ class AlertService:
         date_to: datetime
     ) -> Dict[str, Any]:
         """Get alert statistics for a restaurant"""
-        # Query alerts within date range
-        result = self.supabase.table('feedback_alerts').select('*').eq(
+        # Aggregate in Postgres so only the summary crosses the wire; response
+        # times come back as epoch seconds, so no timestamps are parsed here
+        try:
+            result = await self._sb(self.supabase.rpc('alert_stats', {
+                'rid': str(restaurant_id),
+                'd_from': date_from.isoformat(),
+                'd_to': date_to.isoformat()
+            }))
+            
+            if isinstance(result.data, dict):
+                stats = result.data
+                stats['top_issues'] = [tuple(issue) for issue in stats.get('top_issues') or []]
+                return stats
+        except Exception:
+            logger.exception(
+                "Error fetching alert stats via RPC",
+                extra={'restaurant_id': str(restaurant_id)}
+            )
+        
+        # Fallback when the alert_stats function is not deployed
+        result = await self._sb(self.supabase.table('feedback_alerts').select(ALERT_STATS_COLUMNS).eq(
             'restaurant_id', str(restaurant_id)
         ).gte('created_at', date_from.isoformat()).lte(
             'created_at', date_to.isoformat()
-        ).execute()
+        ))
         
-        alerts = result.data if result.data else []
+        return self._aggregate_alert_stats(result.data if result.data else [])
+    
+    @staticmethod
+    def _aggregate_alert_stats(alerts: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Compute alert statistics from raw alert rows"""
+        # Calculate statistics in a single pass over the alerts
+        priority_counts = Counter()
+        status_counts = Counter()
+        issue_counts = Counter()
+        response_times = []
+        
+        for alert in alerts:
+            priority_counts[alert['priority']] += 1
+            status_counts[alert.get('status')] += 1
+            
+            rule_id = alert.get('rule_id')
+            if rule_id:
+                issue_counts[rule_id] += 1
+            
+            acknowledged_at = alert.get('acknowledged_at')
+            if acknowledged_at:
+                created = _parse_utc(alert['created_at'])
+                acknowledged = _parse_utc(acknowledged_at)
+                response_times.append((acknowledged - created).total_seconds())
         
-        # Calculate statistics
         stats = {
             'total_alerts': len(alerts),
-            'by_priority': {},
-            'by_status': {},
+            'by_priority': {
+                priority: priority_counts[priority]
+                for priority in _ALL_PRIORITY_VALUES
+            },
+            'by_status': {
+                status: status_counts[status]
+                for status in _STAT_STATUSES
+            },
             'average_response_time': None,
             'top_issues': []
         }
         
-        # Count by priority
-        for priority in AlertPriority:
-            count = len([a for a in alerts if a['priority'] == priority.value])
-            stats['by_priority'][priority.value] = count
-        
-        # Count by status
-        for status in ['pending', 'acknowledged', 'resolved']:
-            count = len([a for a in alerts if a.get('status') == status])
-            stats['by_status'][status] = count
-        
-        # Calculate average response time for acknowledged alerts
-        response_times = []
-        for alert in alerts:
-            if alert.get('acknowledged_at'):
-                created = datetime.fromisoformat(alert['created_at'])
-                acknowledged = datetime.fromisoformat(alert['acknowledged_at'])
-                response_times.append((acknowledged - created).total_seconds())
-        
         if response_times:
             stats['average_response_time'] = sum(response_times) / len(response_times)
         
-        # Find top issues
-        issue_counts = {}
-        for alert in alerts:
-            rule_id = alert.get('rule_id')
-            if rule_id:
-                issue_counts[rule_id] = issue_counts.get(rule_id, 0) + 1
-        
-        stats['top_issues'] = sorted(
-            issue_counts.items(),
-            key=lambda x: x[1],
-            reverse=True
-        )[:5]
+        stats['top_issues'] = issue_counts.most_common(5)
         
         return stats
\ No newline at end of file
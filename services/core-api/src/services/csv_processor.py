@@ -4,17 +4,152 @@ Handles validation and processing of customer data uploads
 Optimized for large files with streaming processing
 """
 
+import numpy as np
 import pandas as pd
 import re
-from typing import Dict, List, Any, Optional, Iterator, AsyncIterator
+from typing import Dict, List, Any, Optional, Iterator, AsyncIterator, Tuple, Union
 from datetime import datetime
 import phonenumbers
 from phonenumbers import NumberParseException
 import asyncio
 import io
-import csv
 from functools import lru_cache
 
+from ..utils.bloom_filter import BloomFilter
+
+
+_SEPARATOR_PATTERN = re.compile(r'[\s\-\.\(\)]+')
+_NON_PHONE_PATTERN = re.compile(r'[^\d+]')
+
+# Byte delete sets for the same cleanup on ASCII input (bytes.translate is far
+# cheaper than re.sub); non-ASCII input keeps the regexes, since \s and \d
+# are Unicode-aware there
+_ASCII_SEPARATORS = bytes(c for c in range(128) if chr(c).isspace() or chr(c) in '-.()')
+_ASCII_NON_PHONE = bytes(c for c in range(128) if chr(c) not in '0123456789+')
+
+# Saudi mobile national number pattern from the phonenumbers metadata itself,
+# so the fast path stays in step with library updates (ASCII so that \d does
+# not accept digits phonenumbers would normalize first)
+_SAUDI_MOBILE_PATTERN = re.compile(
+    phonenumbers.PhoneMetadata.metadata_for_region('SA').mobile.national_number_pattern,
+    re.ASCII
+)
+
+
+def _clean_phone_text(phone_str: str) -> str:
+    """Strip separators, map a leading 00 to +, keep only digits and +"""
+    if phone_str.isascii():
+        phone_bytes = phone_str.encode('ascii').translate(None, _ASCII_SEPARATORS)
+        if phone_bytes.startswith(b'00'):
+            phone_bytes = b'+' + phone_bytes[2:]
+        return phone_bytes.translate(None, _ASCII_NON_PHONE).decode('ascii')
+    
+    phone_str = _SEPARATOR_PATTERN.sub('', phone_str)
+    if phone_str.startswith('00'):
+        phone_str = '+' + phone_str[2:]
+    return _NON_PHONE_PATTERN.sub('', phone_str)
+
+
+@lru_cache(maxsize=100_000)
+def _validate_phone_number(phone: str) -> Optional[str]:
+    """
+    Validate and format phone number for WhatsApp
+    Module-level so the LRU cache is shared by every CSVProcessor
+    """
+    if not phone:
+        return None
+    
+    # Remove separators, handle 00 international prefix, keep digits and +
+    cleaned_phone = _clean_phone_text(str(phone).strip())
+    
+    # Handle Saudi numbers
+    if cleaned_phone.startswith('05'):  # Local Saudi format
+        cleaned_phone = '+966' + cleaned_phone[1:]
+    elif cleaned_phone.startswith('5') and len(cleaned_phone) == 9:  # Missing leading 0
+        cleaned_phone = '+966' + cleaned_phone
+    elif cleaned_phone.startswith('966'):  # Country code without +
+        cleaned_phone = '+' + cleaned_phone
+    elif not cleaned_phone.startswith('+'):  # Assume Saudi if no country code
+        if len(cleaned_phone) == 10 and cleaned_phone[0] == '0':
+            cleaned_phone = '+966' + cleaned_phone[1:]
+        elif len(cleaned_phone) == 9:
+            cleaned_phone = '+966' + cleaned_phone
+    
+    # Additional validation: Saudi numbers should be +966 followed by 9 digits
+    if not (cleaned_phone.startswith('+966') and len(cleaned_phone) == 13):
+        return None
+        
+    # Valid Saudi mobile prefixes are 50-59: a 5 right after +966, then an
+    # ASCII digit (a range compare, so Unicode digits are still rejected)
+    if cleaned_phone[4] != '5' or not '0' <= cleaned_phone[5] <= '9':
+        return None
+    
+    return _confirm_saudi_mobile(cleaned_phone)
+
+
+@lru_cache(maxsize=100_000)
+def _confirm_saudi_mobile(cleaned_phone: str) -> Optional[str]:
+    """Final phonenumbers check for a +9665XXXXXXXX candidate; returns E164 or None"""
+    # A metadata mobile pattern match is a valid Saudi number already in E164,
+    # so the full parse is only needed for the rest
+    if _SAUDI_MOBILE_PATTERN.fullmatch(cleaned_phone, 4):
+        return cleaned_phone
+    
+    # Validate using phonenumbers library
+    try:
+        parsed = phonenumbers.parse(cleaned_phone, None)
+        if not phonenumbers.is_valid_number(parsed):
+            return None
+        
+        # Ensure it's a Saudi number
+        if parsed.country_code != 966:
+            return None
+        
+        # Format in international format for WhatsApp
+        return phonenumbers.format_number(
+            parsed,
+            phonenumbers.PhoneNumberFormat.E164
+        )
+        
+    except NumberParseException:
+        return None
+
+
+def _cell_text(value: Any) -> str:
+    """Stripped text of a CSV cell; missing cells read as ''"""
+    if isinstance(value, str):
+        return value.strip()
+    if value is None or pd.isna(value):
+        return ''
+    return str(value).strip()
+
+
+def _isoformat_timestamps(timestamps: pd.Series) -> List[str]:
+    """isoformat() strings for a timestamp column"""
+    # Naive whole-second timestamps format in one numpy call; isoformat()
+    # adds fractions and UTC offsets, so anything else goes row by row
+    is_naive = isinstance(timestamps.dtype, np.dtype) and timestamps.dtype.kind == 'M'
+    if is_naive and not (timestamps.dt.microsecond.any() or timestamps.dt.nanosecond.any()):
+        return np.datetime_as_string(timestamps.to_numpy(), unit='s').tolist()
+    return [timestamp.isoformat() for timestamp in timestamps]
+
+
+def _parse_timestamps(values: List[str]) -> List[Any]:
+    """Parse timestamp cells in one pass; unparseable cells come back as NaT"""
+    try:
+        return pd.to_datetime(
+            pd.Series(values, dtype=object), errors='coerce', format='mixed'
+        ).tolist()
+    except (ValueError, TypeError):
+        # Mixed UTC offsets cannot share one column; parse them one by one
+        parsed = []
+        for value in values:
+            try:
+                parsed.append(pd.to_datetime(value))
+            except (ValueError, pd.errors.ParserError):
+                parsed.append(pd.NaT)
+        return parsed
+
 
 class CSVProcessor:
     """Process and validate CSV uploads for feedback campaigns"""
@@ -22,14 +157,9 @@ class CSVProcessor:
     REQUIRED_COLUMNS = ['phone_number', 'visit_timestamp']
     MAX_ROWS = 10000
     SAUDI_COUNTRY_CODE = 'SA'
-    CHUNK_SIZE = 1000  # Process in chunks for large files
+    CHUNK_SIZE = 5000  # Rows per read_csv chunk for large files (MAX_ROWS // 2)
     LARGE_FILE_THRESHOLD = 1024 * 1024  # 1MB threshold for streaming
     
-    def __init__(self):
-        # Cache for phone number validation to improve performance
-        self._phone_cache = {}
-        self._validation_pattern = re.compile(r'[^\d+]')
-    
     def validate_csv(self, df: pd.DataFrame) -> Dict[str, Any]:
         """
         Validate CSV structure and content
@@ -74,119 +204,70 @@ class CSVProcessor:
             'row_count': len(df)
         }
     
-    @lru_cache(maxsize=10000)
     def validate_phone_number(self, phone: str) -> Optional[str]:
         """
         Validate and format phone number for WhatsApp
         Returns formatted number or None if invalid
-        Uses LRU cache to improve performance for duplicate numbers
         """
-        if not phone:
-            return None
-        
-        # Fast pre-validation using compiled regex
-        phone_str = str(phone).strip()
-        
-        # Remove common separators and formatting
-        phone_str = re.sub(r'[\s\-\.\(\)]+', '', phone_str)
-        
-        # Handle international prefix format (00 instead of +)
-        if phone_str.startswith('00'):
-            phone_str = '+' + phone_str[2:]
-        
-        # Extract only digits and plus sign
-        cleaned_phone = self._validation_pattern.sub('', phone_str)
-        
-        # Handle Saudi numbers
-        if cleaned_phone.startswith('05'):  # Local Saudi format
-            cleaned_phone = '+966' + cleaned_phone[1:]
-        elif cleaned_phone.startswith('5') and len(cleaned_phone) == 9:  # Missing leading 0
-            cleaned_phone = '+966' + cleaned_phone
-        elif cleaned_phone.startswith('966'):  # Country code without +
-            cleaned_phone = '+' + cleaned_phone
-        elif not cleaned_phone.startswith('+'):  # Assume Saudi if no country code
-            if len(cleaned_phone) == 10 and cleaned_phone[0] == '0':
-                cleaned_phone = '+966' + cleaned_phone[1:]
-            elif len(cleaned_phone) == 9:
-                cleaned_phone = '+966' + cleaned_phone
-        
-        # Additional validation: Saudi numbers should be +966 followed by 9 digits
-        if not (cleaned_phone.startswith('+966') and len(cleaned_phone) == 13):
-            return None
-            
-        # Validate Saudi mobile number prefixes (should start with 5)
-        if not cleaned_phone[4] == '5':  # Position after +966
-            return None
-        
-        # Valid Saudi mobile prefixes: 50, 51, 52, 53, 54, 55, 56, 57, 58, 59
-        mobile_prefix = cleaned_phone[4:6]  # Extract the two digits after +966
-        valid_prefixes = ['50', '51', '52', '53', '54', '55', '56', '57', '58', '59']
-        
-        if mobile_prefix not in valid_prefixes:
-            return None
-        
-        # Validate using phonenumbers library (cached result)
-        try:
-            parsed = phonenumbers.parse(cleaned_phone, None)
-            if not phonenumbers.is_valid_number(parsed):
-                return None
-            
-            # Ensure it's a Saudi number
-            if parsed.country_code != 966:
-                return None
-            
-            # Format in international format for WhatsApp
-            formatted = phonenumbers.format_number(
-                parsed,
-                phonenumbers.PhoneNumberFormat.E164
-            )
-            return formatted
-            
-        except NumberParseException:
-            return None
+        return _validate_phone_number(phone)
+    
+    def normalize_phone_series(self, phones: pd.Series) -> pd.Series:
+        """
+        Column-wise equivalent of validate_phone_number
+        Returns formatted numbers, with None where the number is invalid
+        """
+        # pandas string methods on object columns loop in Python per element
+        # anyway; the scalar validator (bytes.translate cleanup, shared LRU
+        # cache) does less work per value and skips repeats entirely
+        return pd.Series(
+            [_validate_phone_number(phone) for phone in phones.tolist()],
+            index=phones.index,
+            dtype=object
+        )
     
     def process_recipients(self, df: pd.DataFrame) -> Dict[str, Any]:
         """
         Process CSV data and prepare recipient list
         Returns processed data with statistics
         """
-        recipients = []
-        seen_numbers = set()
-        duplicates_count = 0
-        invalid_count = 0
-        
-        # Convert timestamps
-        df['visit_timestamp'] = pd.to_datetime(df['visit_timestamp'])
-        
-        for _, row in df.iterrows():
-            # Validate and format phone number
-            formatted_number = self.validate_phone_number(row['phone_number'])
-            
-            if not formatted_number:
-                invalid_count += 1
-                continue
-            
-            # Check for duplicates within campaign
-            if formatted_number in seen_numbers:
-                duplicates_count += 1
-                continue
-            
-            seen_numbers.add(formatted_number)
-            
-            # Prepare recipient data
-            recipient = {
-                'phone_number': formatted_number,
-                'visit_timestamp': row['visit_timestamp'].isoformat(),
-                'metadata': {}
+        # Convert timestamps; unparseable cells become NaT
+        df['visit_timestamp'] = pd.to_datetime(
+            df['visit_timestamp'], errors='coerce', format='mixed'
+        )
+        
+        # Validate and format phone numbers column-wise, then drop invalid
+        # phones and timestamps with one combined mask
+        formatted = self.normalize_phone_series(df['phone_number'])
+        valid = formatted.notna() & df['visit_timestamp'].notna()
+        invalid_count = int((~valid).sum())
+        
+        # Check for duplicates within campaign (first occurrence wins)
+        formatted = formatted[valid]
+        duplicated = formatted.duplicated()
+        duplicates_count = int(duplicated.sum())
+        formatted = formatted[~duplicated]
+        kept = df.loc[formatted.index]
+        
+        # Add any additional columns as metadata
+        extra_columns = [col for col in df.columns if col not in self.REQUIRED_COLUMNS]
+        extras = kept[extra_columns]
+        present = extras.notna().to_numpy().tolist()
+        values = extras.astype(str).to_numpy().tolist()
+        
+        recipients = [
+            {
+                'phone_number': phone,
+                'visit_timestamp': visit_timestamp,
+                'metadata': {
+                    col: value
+                    for col, value, has_value in zip(extra_columns, row_values, row_present)
+                    if has_value
+                }
             }
-            
-            # Add any additional columns as metadata
-            extra_columns = set(df.columns) - set(self.REQUIRED_COLUMNS)
-            for col in extra_columns:
-                if pd.notna(row[col]):
-                    recipient['metadata'][col] = str(row[col])
-            
-            recipients.append(recipient)
+            for phone, visit_timestamp, row_values, row_present in zip(
+                formatted.tolist(), _isoformat_timestamps(kept['visit_timestamp']), values, present
+            )
+        ]
         
         return {
             'recipients': recipients,
@@ -201,17 +282,21 @@ class CSVProcessor:
         """Generate processing warnings"""
         warnings = []
         
+        # Parse the column once (a no-op after process_recipients) and count
+        # straight off the boolean masks
+        visit_timestamps = pd.to_datetime(df['visit_timestamp'], errors='coerce')
+        
         # Check for future timestamps
         now = datetime.now()
-        future_visits = df[pd.to_datetime(df['visit_timestamp']) > now]
-        if not future_visits.empty:
-            warnings.append(f"{len(future_visits)} visits have future timestamps")
+        future_count = int((visit_timestamps > now).sum())
+        if future_count:
+            warnings.append(f"{future_count} visits have future timestamps")
         
         # Check for very old timestamps (> 30 days)
         old_threshold = pd.Timestamp.now() - pd.Timedelta(days=30)
-        old_visits = df[pd.to_datetime(df['visit_timestamp']) < old_threshold]
-        if not old_visits.empty:
-            warnings.append(f"{len(old_visits)} visits are older than 30 days")
+        old_count = int((visit_timestamps < old_threshold).sum())
+        if old_count:
+            warnings.append(f"{old_count} visits are older than 30 days")
         
         # Check success rate
         success_rate = len(recipients) / len(df) * 100 if len(df) > 0 else 0
@@ -255,14 +340,13 @@ class CSVProcessor:
         """
         try:
             # Read just the first few lines to validate structure
-            text_content = file_content[:4096].decode('utf-8', errors='ignore')
-            lines = text_content.split('\n')
+            head = file_content[:4096]
             
-            if len(lines) < 2:
+            if b'\n' not in head:
                 return {'valid': False, 'errors': ['File appears to be empty']}
             
             # Parse header
-            header = lines[0].strip()
+            header = head.split(b'\n', 1)[0].decode('utf-8', errors='ignore').strip()
             if not header:
                 return {'valid': False, 'errors': ['Missing header row']}
             
@@ -277,9 +361,10 @@ class CSVProcessor:
                     'errors': [f"Missing required columns: {', '.join(missing_columns)}"]
                 }
             
-            # Estimate row count (rough approximation)
-            avg_line_length = len(file_content) / max(len(lines), 1)
-            estimated_rows = len(file_content) / max(avg_line_length, 50) - 1  # -1 for header
+            # Count rows from the newlines (a C scan over the bytes, no decode
+            # or line list); an unterminated last line still counts
+            line_count = file_content.count(b'\n') + (not file_content.endswith(b'\n'))
+            estimated_rows = line_count - 1  # -1 for header
             
             if estimated_rows > self.MAX_ROWS:
                 return {
@@ -302,25 +387,32 @@ class CSVProcessor:
     async def process_recipients_streaming(
         self, 
         file_content: bytes,
-        progress_callback: Optional[callable] = None
+        progress_callback: Optional[callable] = None,
+        dedup_filter: Optional[BloomFilter] = None
     ) -> AsyncIterator[Dict[str, Any]]:
         """
         Process CSV data using streaming approach for large files
-        Yields progress updates and final results
+        Yields each chunk's recipients ('recipients_chunk'), progress updates and
+        a final 'completed' summary; pass a shared dedup_filter to also skip
+        numbers seen in earlier uploads
         """
-        recipients = []
+        valid_count = 0
+        future_count = 0
+        old_count = 0
         seen_numbers = set()
         duplicates_count = 0
         invalid_count = 0
         total_processed = 0
         
         try:
-            # Decode content and create CSV reader
-            text_content = file_content.decode('utf-8')
-            csv_reader = csv.DictReader(io.StringIO(text_content))
+            buffer = io.BytesIO(file_content)
+            
+            # Read just the header to find the required columns
+            try:
+                fieldnames = list(pd.read_csv(buffer, nrows=0, encoding='utf-8').columns)
+            except pd.errors.EmptyDataError:
+                fieldnames = []
             
-            # Get column names and validate
-            fieldnames = csv_reader.fieldnames
             if not fieldnames:
                 yield {
                     'type': 'error',
@@ -329,8 +421,7 @@ class CSVProcessor:
                 return
             
             # Convert to lowercase for matching
-            fieldnames_lower = [name.lower().strip() for name in fieldnames]
-            required_lower = [col.lower() for col in self.REQUIRED_COLUMNS]
+            fieldnames_lower = [str(name).lower().strip() for name in fieldnames]
             
             # Find column indices
             try:
@@ -345,68 +436,65 @@ class CSVProcessor:
                 }
                 return
             
-            # Process rows in chunks
-            current_chunk = []
+            # Progress is measured against the line count (counted in C, no decode)
+            estimated_rows = max(1, file_content.count(b'\n') - 1)
             
-            for row in csv_reader:
-                total_processed += 1
-                
-                # Add to current chunk
-                current_chunk.append(row)
-                
-                # Process chunk when it reaches CHUNK_SIZE
-                if len(current_chunk) >= self.CHUNK_SIZE:
-                    chunk_results = await self._process_chunk(
-                        current_chunk, 
-                        phone_col, 
-                        timestamp_col, 
-                        seen_numbers
-                    )
-                    
-                    # Update counters
-                    recipients.extend(chunk_results['recipients'])
-                    duplicates_count += chunk_results['duplicates']
-                    invalid_count += chunk_results['invalid']
-                    
-                    # Send progress update
-                    if progress_callback:
-                        progress_info = {
-                            'type': 'progress',
-                            'processed': total_processed,
-                            'valid': len(recipients),
-                            'duplicates': duplicates_count,
-                            'invalid': invalid_count,
-                            'percentage': min(95, (total_processed / max(1, len(text_content.split('\n')) - 1)) * 100)
-                        }
-                        yield progress_info
-                    
-                    # Clear chunk
-                    current_chunk = []
-                    
-                    # Allow other tasks to run
-                    await asyncio.sleep(0.001)
+            # Parse in chunks with the C reader; every cell stays a string and
+            # usecols pins the header width so rows with extra fields still parse
+            buffer.seek(0)
+            reader = pd.read_csv(
+                buffer,
+                chunksize=self.CHUNK_SIZE,
+                dtype=str,
+                keep_default_na=False,
+                encoding='utf-8',
+                usecols=range(len(fieldnames))
+            )
             
-            # Process remaining chunk
-            if current_chunk:
+            for chunk_df in reader:
+                total_processed += len(chunk_df)
+                
                 chunk_results = await self._process_chunk(
-                    current_chunk, 
-                    phone_col, 
-                    timestamp_col, 
-                    seen_numbers
+                    chunk_df, phone_col, timestamp_col, seen_numbers, dedup_filter
                 )
-                recipients.extend(chunk_results['recipients'])
+                
+                # Update counters; recipients are handed off, not kept
+                chunk_recipients = chunk_results['recipients']
+                valid_count += len(chunk_recipients)
                 duplicates_count += chunk_results['duplicates']
                 invalid_count += chunk_results['invalid']
+                chunk_future, chunk_old = self._count_visit_ages(chunk_recipients)
+                future_count += chunk_future
+                old_count += chunk_old
+                
+                if chunk_recipients:
+                    yield {'type': 'recipients_chunk', 'data': chunk_recipients}
+                
+                # Send progress update
+                if progress_callback:
+                    progress_info = {
+                        'type': 'progress',
+                        'processed': total_processed,
+                        'valid': valid_count,
+                        'duplicates': duplicates_count,
+                        'invalid': invalid_count,
+                        'percentage': min(95, (total_processed / estimated_rows) * 100)
+                    }
+                    yield progress_info
+                
+                # Yield to the event loop between chunks
+                await asyncio.sleep(0)
             
             # Generate warnings
-            warnings = self._generate_warnings_from_recipients(recipients, total_processed)
+            warnings = self._generate_warnings_from_counts(
+                future_count, old_count, valid_count, total_processed
+            )
             
-            # Final result
+            # Final summary (recipients were yielded chunk by chunk)
             yield {
                 'type': 'completed',
-                'recipients': recipients,
                 'total_rows': total_processed,
-                'valid_count': len(recipients),
+                'valid_count': valid_count,
                 'duplicates_count': duplicates_count,
                 'invalid_count': invalid_count,
                 'warnings': warnings
@@ -425,48 +513,75 @@ class CSVProcessor:
     
     async def _process_chunk(
         self, 
-        chunk: List[Dict], 
+        chunk: Union[List[Dict], pd.DataFrame], 
         phone_col: str, 
         timestamp_col: str,
-        seen_numbers: set
+        seen_numbers: set,
+        dedup_filter: Optional[BloomFilter] = None
     ) -> Dict[str, Any]:
-        """Process a chunk of CSV rows"""
-        chunk_recipients = []
-        chunk_duplicates = 0
-        chunk_invalid = 0
+        """
+        Process a chunk of CSV rows (DictReader rows or a DataFrame)
+        Numbers already in dedup_filter (e.g. from earlier uploads) count as duplicates
+        """
+        prepared = self._prepare_chunk(chunk, phone_col, timestamp_col)
+        return self._dedupe_chunk(prepared, seen_numbers, dedup_filter)
+    
+    def _prepare_chunk(
+        self, 
+        chunk: Union[List[Dict], pd.DataFrame], 
+        phone_col: str, 
+        timestamp_col: str
+    ) -> Tuple[List[Optional[str]], List[Optional[Dict]]]:
+        """
+        Validate a chunk's rows without any cross-chunk state; returns per-row
+        formatted numbers and recipients (None where the number or the rest of
+        the row is invalid)
+        """
+        if isinstance(chunk, pd.DataFrame):
+            columns = list(chunk.columns)
+            rows = chunk.itertuples(index=False, name=None)
+            phones = chunk[phone_col]
+            raw_timestamps = chunk[timestamp_col].tolist()
+        else:
+            # Pull each column out once; short rows read as empty cells and
+            # overflow fields (DictReader's None key) are ignored
+            columns = [col for col in chunk[0] if col is not None] if chunk else []
+            column_values = [[row.get(col) for row in chunk] for col in columns]
+            rows = zip(*column_values)
+            phones = pd.Series(
+                column_values[columns.index(phone_col)] if columns else [],
+                dtype=object
+            )
+            raw_timestamps = column_values[columns.index(timestamp_col)] if columns else []
+        
+        if not columns:
+            return [], []
+        
+        phone_idx = columns.index(phone_col)
+        timestamp_idx = columns.index(timestamp_col)
+        
+        # Validate and format the whole phone column at once, then parse
+        # the timestamp column in a single pass
+        formatted_numbers = [
+            number if isinstance(number, str) else None
+            for number in self.normalize_phone_series(phones).tolist()
+        ]
+        raw_timestamps = [_cell_text(value) for value in raw_timestamps]
+        visit_timestamps = _parse_timestamps(raw_timestamps)
+        # Metadata columns are fixed for the chunk; resolve them once
+        extra_columns = tuple(
+            (idx, col) for idx, col in enumerate(columns)
+            if idx not in (phone_idx, timestamp_idx)
+        )
         
-        for row in chunk:
+        recipients = []
+        for row, formatted_number, raw_timestamp, visit_timestamp in zip(
+            rows, formatted_numbers, raw_timestamps, visit_timestamps
+        ):
             try:
-                # Validate and format phone number
-                raw_phone = row.get(phone_col, '').strip()
-                if not raw_phone:
-                    chunk_invalid += 1
-                    continue
-                
-                formatted_number = self.validate_phone_number(raw_phone)
-                
-                if not formatted_number:
-                    chunk_invalid += 1
-                    continue
-                
-                # Check for duplicates within campaign
-                if formatted_number in seen_numbers:
-                    chunk_duplicates += 1
-                    continue
-                
-                seen_numbers.add(formatted_number)
-                
-                # Validate timestamp
-                raw_timestamp = row.get(timestamp_col, '').strip()
-                if not raw_timestamp:
-                    chunk_invalid += 1
-                    continue
-                
-                try:
-                    # Parse timestamp
-                    visit_timestamp = pd.to_datetime(raw_timestamp)
-                except (ValueError, pd.errors.ParserError):
-                    chunk_invalid += 1
+                # Invalid numbers and timestamps leave no recipient
+                if formatted_number is None or not raw_timestamp or visit_timestamp is pd.NaT:
+                    recipients.append(None)
                     continue
                 
                 # Prepare recipient data
@@ -477,47 +592,108 @@ class CSVProcessor:
                 }
                 
                 # Add any additional columns as metadata
-                extra_columns = set(row.keys()) - {phone_col, timestamp_col}
-                for col in extra_columns:
-                    value = row.get(col, '').strip()
+                for idx, col in extra_columns:
+                    value = _cell_text(row[idx])
                     if value:
                         recipient['metadata'][col] = value
                 
-                chunk_recipients.append(recipient)
+                recipients.append(recipient)
                 
             except Exception as e:
                 # Skip problematic rows but continue processing
-                chunk_invalid += 1
+                recipients.append(None)
                 continue
         
+        return formatted_numbers, recipients
+    
+    def _dedupe_chunk(
+        self, 
+        prepared: Tuple[List[Optional[str]], List[Optional[Dict]]], 
+        seen_numbers: set,
+        dedup_filter: Optional[BloomFilter] = None
+    ) -> Dict[str, Any]:
+        """Apply campaign-wide deduplication to a prepared chunk, in row order"""
+        formatted_numbers, recipients = prepared
+        chunk_recipients = []
+        chunk_duplicates = 0
+        chunk_invalid = 0
+        
+        # Flag duplicates within the chunk and against earlier chunks in one
+        # pass (first occurrence wins)
+        formatted = pd.Series(formatted_numbers, dtype=object)
+        valid_numbers = formatted.dropna()
+        duplicated = valid_numbers.duplicated() | valid_numbers.isin(seen_numbers)
+        is_duplicate = duplicated.reindex(formatted.index, fill_value=False).tolist()
+        seen_numbers.update(valid_numbers.tolist())
+        
+        for formatted_number, recipient, duplicate in zip(
+            formatted_numbers, recipients, is_duplicate
+        ):
+            if formatted_number is None:
+                chunk_invalid += 1
+            elif duplicate:
+                # Check for duplicates within campaign
+                chunk_duplicates += 1
+            elif dedup_filter is not None and dedup_filter.add(formatted_number):
+                # Check against numbers remembered across uploads
+                chunk_duplicates += 1
+            elif recipient is None:
+                chunk_invalid += 1
+            else:
+                chunk_recipients.append(recipient)
+        
         return {
             'recipients': chunk_recipients,
             'duplicates': chunk_duplicates,
             'invalid': chunk_invalid
         }
     
-    def _generate_warnings_from_recipients(self, recipients: List[Dict], total_rows: int) -> List[str]:
-        """Generate warnings from processed recipients"""
-        warnings = []
+    def _count_visit_ages(self, recipients: List[Dict]) -> Tuple[int, int]:
+        """Count recipients with future visits and visits older than 30 days"""
+        future_count = 0
+        old_count = 0
         
         if not recipients:
-            return warnings
+            return future_count, old_count
         
-        # Check for future timestamps
         now = datetime.now()
-        future_count = 0
-        old_count = 0
         old_threshold = now - pd.Timedelta(days=30)
         
-        for recipient in recipients:
-            try:
-                visit_time = pd.to_datetime(recipient['visit_timestamp'])
-                if visit_time > now:
-                    future_count += 1
-                elif visit_time < old_threshold:
-                    old_count += 1
-            except:
-                continue
+        visit_times = [recipient['visit_timestamp'] for recipient in recipients]
+        try:
+            # Recipients carry isoformat() strings, so one ISO8601 parse covers them
+            parsed = pd.to_datetime(
+                pd.Series(visit_times, dtype=object), errors='coerce', format='ISO8601'
+            )
+            future_count = int((parsed > now).sum())
+            old_count = int((parsed < old_threshold).sum())
+        except (ValueError, TypeError):
+            # tz-aware timestamps don't compare with the naive now; count the
+            # rest row by row
+            for visit_time in visit_times:
+                try:
+                    visit_time = pd.to_datetime(visit_time)
+                    if visit_time > now:
+                        future_count += 1
+                    elif visit_time < old_threshold:
+                        old_count += 1
+                except:
+                    continue
+        
+        return future_count, old_count
+    
+    def _generate_warnings_from_counts(
+        self, 
+        future_count: int, 
+        old_count: int, 
+        valid_count: int, 
+        total_rows: int
+    ) -> List[str]:
+        """Generate warnings from running streaming counters"""
+        warnings = []
+        
+        if not valid_count:
+            return warnings
         
         if future_count > 0:
             warnings.append(f"{future_count} visits have future timestamps")
@@ -527,12 +703,19 @@ class CSVProcessor:
         
         # Check success rate
         if total_rows > 0:
-            success_rate = len(recipients) / total_rows * 100
+            success_rate = valid_count / total_rows * 100
             if success_rate < 80:
                 warnings.append(f"Low success rate: {success_rate:.1f}% of rows were valid")
         
         return warnings
     
+    def _generate_warnings_from_recipients(self, recipients: List[Dict], total_rows: int) -> List[str]:
+        """Generate warnings from processed recipients"""
+        future_count, old_count = self._count_visit_ages(recipients)
+        return self._generate_warnings_from_counts(
+            future_count, old_count, len(recipients), total_rows
+        )
+    
     async def should_use_streaming(self, file_size: int) -> bool:
         """Determine if streaming processing should be used"""
         return file_size > self.LARGE_FILE_THRESHOLD
\ No newline at end of file
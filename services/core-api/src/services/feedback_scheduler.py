@@ -5,19 +5,36 @@ Enhanced with circuit breaker for external API resilience
 """
 
 from datetime import datetime, timedelta
-from typing import Dict, List, Any, Optional
-from uuid import UUID
+from typing import Dict, List, Any, Optional, Tuple
+from uuid import UUID, uuid4
 import asyncio
-from celery import Celery
+import bisect
+from celery import Celery, group
 import httpx
 import json
 import logging
+import redis
+import redis.asyncio
 
 from ..repositories.campaign_repository import CampaignRepository
-from ..utils.circuit_breaker import circuit_registry, CommonConfigs, CircuitBreakerException
+from ..utils.circuit_breaker import circuit_registry, CommonConfigs, CircuitBreakerException, CircuitState
 
 logger = logging.getLogger(__name__)
 
+# Connection pool shared by all prayer API calls from a scheduler
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=50, max_connections=200)
+
+# Fallback rules: avoid common prayer hours (approximate for Riyadh)
+_FALLBACK_PRAYER_HOURS = frozenset({5, 12, 15, 18, 19})  # Fajr, Dhuhr, Asr, Maghrib, Isha
+# Next hour (mod 24) that is not a prayer hour, for every hour of the day
+_NEXT_SAFE_HOUR = tuple(
+    next(
+        (hour + step) % 24 for step in range(1, 25)
+        if (hour + step) % 24 not in _FALLBACK_PRAYER_HOURS
+    )
+    for hour in range(24)
+)
+
 
 class FeedbackScheduler:
     """Schedule and manage feedback message sending"""
@@ -25,7 +42,8 @@ class FeedbackScheduler:
     def __init__(self):
         self.campaign_repo = CampaignRepository()
         self.celery_app = self._setup_celery()
-        self.prayer_api_url = "http://ai-processor:8001/api/prayer-times"
+        self.prayer_schedule_url = "http://ai-processor:8001/api/prayer-schedule"
+        self.recipient_page_size = 1000  # Recipients scheduled per insert/dispatch
         self.min_delay_hours = 2
         self.max_delay_hours = 4
         
@@ -35,9 +53,13 @@ class FeedbackScheduler:
             CommonConfigs.EXTERNAL_API
         )
         
-        # Cache for prayer time data to reduce API calls
-        self._prayer_cache = {}
+        # Prayer time data is cached in Redis so all workers share it
+        self._redis = redis.asyncio.Redis.from_url('redis://redis:6379/1', decode_responses=True)
         self._cache_ttl = 3600  # 1 hour cache
+        self._breaker_open_key = 'prayer:circuit_open'
+        
+        # Pooled HTTP client, created on first use
+        self._http_client: Optional[httpx.AsyncClient] = None
         
     def _setup_celery(self) -> Celery:
         """Initialize Celery app with Redis backend"""
@@ -67,6 +89,22 @@ class FeedbackScheduler:
         
         return app
     
+    def _get_http_client(self) -> httpx.AsyncClient:
+        """Get the shared HTTP client, keeping connections alive between calls"""
+        if self._http_client is None or self._http_client.is_closed:
+            self._http_client = httpx.AsyncClient(
+                timeout=httpx.Timeout(10.0, connect=5.0),
+                limits=HTTP_LIMITS
+            )
+        return self._http_client
+    
+    async def aclose(self):
+        """Close the shared HTTP client and Redis connections"""
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
+        await self._redis.aclose()
+    
     async def schedule_campaign(
         self,
         campaign_id: UUID,
@@ -74,17 +112,52 @@ class FeedbackScheduler:
     ) -> List[Dict[str, Any]]:
         """
         Schedule all messages for a campaign
+        Recipients are streamed and scheduled one page at a time, so large
+        campaigns are never held in memory at once
         Returns list of scheduled job details
         """
-        # Get campaign recipients
-        recipients = await self.campaign_repo.get_campaign_recipients(campaign_id)
         scheduled_jobs = []
+        page = []
+        
+        async for recipient in self.campaign_repo.iter_campaign_recipients(
+            campaign_id,
+            page_size=self.recipient_page_size
+        ):
+            page.append(recipient)
+            if len(page) >= self.recipient_page_size:
+                scheduled_jobs.extend(
+                    await self._schedule_recipients(campaign_id, page, schedule_params)
+                )
+                page = []
+        
+        if page:
+            scheduled_jobs.extend(
+                await self._schedule_recipients(campaign_id, page, schedule_params)
+            )
+        
+        return scheduled_jobs
+    
+    async def _schedule_recipients(
+        self,
+        campaign_id: UUID,
+        recipients: List[Dict[str, Any]],
+        schedule_params: Dict[str, Any]
+    ) -> List[Dict[str, Any]]:
+        """Insert and dispatch the messages for one page of recipients"""
+        message_rows = []
+        
+        # Fetch prayer windows for every candidate send date in one call
+        send_dates = {
+            (recipient['visit_timestamp'] + timedelta(hours=3)).date()
+            for recipient in recipients
+        }
+        prayer_schedule = await self._prefetch_prayer_schedule(send_dates) if send_dates else None
         
         for recipient in recipients:
             # Calculate optimal send time
-            send_time = await self._calculate_send_time(
+            send_time = self._resolve_send_time_local(
                 recipient['visit_timestamp'],
-                recipient['phone_number']
+                prayer_schedule
             )
             
             # Check if send time is within campaign window
@@ -93,192 +166,211 @@ class FeedbackScheduler:
             if schedule_params.get('end_time') and send_time > schedule_params['end_time']:
                 continue  # Skip if outside window
             
-            # Create scheduled message
-            message_data = {
+            # Create scheduled message; the task id is assigned up front so it
+            # is stored with the row and the message can be revoked later
+            message_rows.append({
                 'campaign_id': campaign_id,
                 'recipient_id': recipient['id'],
                 'phone_number': recipient['phone_number'],
                 'scheduled_send_time': send_time,
                 'status': 'scheduled',
                 'message_template': schedule_params.get('template', 'default'),
-                'variant_id': None  # Will be assigned if A/B test active
-            }
-            
-            # Store in database
-            message = await self.campaign_repo.create_campaign_message(message_data)
-            
-            # Schedule Celery task
-            task = self.celery_app.send_task(
+                'variant_id': None,  # Will be assigned if A/B test active
+                'task_id': str(uuid4())
+            })
+        
+        if not message_rows:
+            return []
+        
+        # Store in database with one bulk insert
+        messages = await self.campaign_repo.bulk_create_campaign_messages(message_rows)
+        send_times = {row['task_id']: row['scheduled_send_time'] for row in message_rows}
+        
+        # Schedule all Celery tasks as one group (one broker connection)
+        group([
+            self.celery_app.signature(
                 'feedback_tasks.send_feedback_message',
                 args=[str(message['id'])],
-                eta=send_time
+                eta=send_times[message['task_id']],
+                task_id=message['task_id']
             )
-            
-            scheduled_jobs.append({
+            for message in messages
+        ]).apply_async()
+        
+        return [
+            {
                 'message_id': message['id'],
-                'task_id': task.id,
-                'scheduled_time': send_time.isoformat(),
-                'phone_number': recipient['phone_number']
-            })
+                'task_id': message['task_id'],
+                'scheduled_time': send_times[message['task_id']].isoformat(),
+                'phone_number': message['phone_number']
+            }
+            for message in messages
+        ]
+    
+    def _clamp_to_delay_window(self, visit_timestamp: datetime, send_time: datetime) -> datetime:
+        """Ensure send time is within the min/max delay window after the visit"""
+        min_time = visit_timestamp + timedelta(hours=self.min_delay_hours)
+        max_time = visit_timestamp + timedelta(hours=self.max_delay_hours)
         
-        return scheduled_jobs
+        if send_time < min_time:
+            return min_time
+        elif send_time > max_time:
+            return max_time
+        
+        return send_time
     
-    async def _calculate_send_time(
+    def _resolve_send_time_local(
         self,
         visit_timestamp: datetime,
-        phone_number: str
+        prayer_schedule: Optional[Tuple[List[datetime], List[Tuple[datetime, datetime, str]]]]
     ) -> datetime:
         """
-        Calculate optimal send time considering prayer times
-        Default: 2-4 hours after visit
+        Calculate send time against a prefetched prayer schedule
+        Default: 3 hours after the visit, moved past any prayer window and
+        kept within the 2-4 hour delay window; falls back to basic rules
+        when no schedule could be fetched
         """
-        # Base calculation: 3 hours after visit
         base_send_time = visit_timestamp + timedelta(hours=3)
         
-        # Check prayer times
-        prayer_check = await self._check_prayer_time_conflict(base_send_time)
-        
-        if prayer_check['is_prayer_time']:
-            # Adjust to after prayer time
-            base_send_time = prayer_check['next_available_time']
-        
-        # Ensure within min/max delay window
-        min_time = visit_timestamp + timedelta(hours=self.min_delay_hours)
-        max_time = visit_timestamp + timedelta(hours=self.max_delay_hours)
-        
-        if base_send_time < min_time:
-            return min_time
-        elif base_send_time > max_time:
-            return max_time
+        if prayer_schedule is None:
+            prayer_check = self._fallback_prayer_check(base_send_time, 'Riyadh')
+            if prayer_check['is_prayer_time']:
+                base_send_time = prayer_check['next_available_time']
+        else:
+            # Latest window starting at or before the base time
+            starts, windows = prayer_schedule
+            index = bisect.bisect_right(starts, base_send_time) - 1
+            if index >= 0 and base_send_time < windows[index][1]:
+                # Add 30 minutes buffer after prayer time
+                base_send_time = windows[index][1] + timedelta(minutes=30)
         
-        return base_send_time
+        return self._clamp_to_delay_window(visit_timestamp, base_send_time)
     
-    async def _check_prayer_time_conflict(
+    async def _prefetch_prayer_schedule(
         self,
-        proposed_time: datetime,
+        dates,
         location: str = 'Riyadh'
-    ) -> Dict[str, Any]:
+    ) -> Optional[Tuple[List[datetime], List[Tuple[datetime, datetime, str]]]]:
         """
-        Check if proposed time conflicts with prayer time
-        Returns adjusted time if needed
-        Uses circuit breaker and caching for resilience
+        Fetch prayer windows for a set of dates in one API call
+        Dates already cached are not fetched again
+        Returns sorted window start times with their (start, end, name) windows,
+        or None when the API is unavailable so callers use the fallback rules
         """
-        # Check cache first
-        cache_key = f"{location}_{proposed_time.date().isoformat()}"
-        cached_data = self._get_cached_prayer_times(cache_key)
+        dates = sorted(dates)
+        cache_keys = [f"prayer_schedule:{location}:{day.isoformat()}" for day in dates]
+        schedule = await self._get_cached_prayer_schedule(cache_keys)
+        missing = [day for day, key in zip(dates, cache_keys) if key not in schedule]
         
-        if cached_data:
-            return self._check_prayer_conflict_from_cache(proposed_time, cached_data)
+        if missing:
+            try:
+                # Use circuit breaker for API call
+                schedule_data = await self._call_prayer_api(
+                    self._fetch_prayer_schedule,
+                    missing,
+                    location
+                )
+            except CircuitBreakerException as e:
+                logger.warning(f"Prayer time API circuit breaker open: {e}")
+                return None
+            except Exception as e:
+                logger.error(f"Prayer schedule fetch failed: {e}")
+                return None
+            
+            if not schedule_data:
+                return None
+            
+            fetched = {
+                f"prayer_schedule:{location}:{day}": day_windows
+                for day, day_windows in schedule_data.get('schedule', {}).items()
+            }
+            await self._cache_prayer_schedule(fetched)
+            schedule.update(fetched)
         
         try:
-            # Use circuit breaker for API call
-            prayer_data = await self.prayer_api_breaker.call(
-                self._fetch_prayer_times,
-                proposed_time,
-                location
+            windows = sorted(
+                (
+                    datetime.fromisoformat(window['start']),
+                    datetime.fromisoformat(window['end']),
+                    window.get('name', 'Unknown')
+                )
+                for day_windows in schedule.values()
+                for window in day_windows
             )
-            
-            # Cache the result
-            self._cache_prayer_times(cache_key, prayer_data)
-            
-            if prayer_data and prayer_data.get('is_prayer_time'):
-                # Add 30 minutes buffer after prayer time
-                next_available = datetime.fromisoformat(
-                    prayer_data['prayer_end_time']
-                ) + timedelta(minutes=30)
-                
-                return {
-                    'is_prayer_time': True,
-                    'next_available_time': next_available,
-                    'prayer_name': prayer_data.get('prayer_name', 'Unknown'),
-                    'source': 'api'
-                }
-                
-        except CircuitBreakerException as e:
-            logger.warning(f"Prayer time API circuit breaker open: {e}")
-            return self._fallback_prayer_check(proposed_time, location)
         except Exception as e:
-            logger.error(f"Prayer time check failed: {e}")
-            return self._fallback_prayer_check(proposed_time, location)
+            logger.warning(f"Prayer schedule parsing failed: {e}")
+            return None
         
-        return {
-            'is_prayer_time': False,
-            'next_available_time': proposed_time,
-            'source': 'api'
-        }
+        return [window[0] for window in windows], windows
     
-    async def _fetch_prayer_times(self, proposed_time: datetime, location: str) -> Optional[Dict]:
-        """Fetch prayer times from API (wrapped by circuit breaker)"""
-        timeout_config = httpx.Timeout(connect=5.0, read=10.0)
+    async def _fetch_prayer_schedule(self, dates: List, location: str) -> Optional[Dict]:
+        """Fetch prayer windows for several dates from API (wrapped by circuit breaker)"""
+        response = await self._get_http_client().post(
+            self.prayer_schedule_url,
+            json={
+                'dates': [day.isoformat() for day in dates],
+                'location': location
+            }
+        )
         
-        async with httpx.AsyncClient(timeout=timeout_config) as client:
-            response = await client.post(
-                self.prayer_api_url,
-                json={
-                    'timestamp': proposed_time.isoformat(),
-                    'location': location
-                }
-            )
-            
-            if response.status_code == 200:
-                return response.json()
-            else:
-                logger.warning(f"Prayer API returned status {response.status_code}")
-                return None
-    
-    def _get_cached_prayer_times(self, cache_key: str) -> Optional[Dict]:
-        """Get cached prayer time data"""
-        if cache_key in self._prayer_cache:
-            cached_entry = self._prayer_cache[cache_key]
-            if cached_entry['expires'] > datetime.now().timestamp():
-                return cached_entry['data']
-            else:
-                # Remove expired entry
-                del self._prayer_cache[cache_key]
-        return None
+        if response.status_code == 200:
+            return response.json()
+        else:
+            logger.warning(f"Prayer API returned status {response.status_code}")
+            return None
     
-    def _cache_prayer_times(self, cache_key: str, data: Dict):
-        """Cache prayer time data"""
-        self._prayer_cache[cache_key] = {
-            'data': data,
-            'expires': datetime.now().timestamp() + self._cache_ttl
-        }
+    async def _call_prayer_api(self, func, *args) -> Any:
+        """
+        Call the prayer API through the circuit breaker
+        An open circuit is flagged in Redis so other workers fail fast too
+        """
+        try:
+            if await self._redis.exists(self._breaker_open_key):
+                raise CircuitBreakerException(
+                    f"Circuit breaker '{self.prayer_api_breaker.name}' is open on another worker"
+                )
+        except redis.RedisError as e:
+            logger.warning(f"Prayer circuit state lookup failed: {e}")
         
-        # Clean up old cache entries (keep cache size manageable)
-        if len(self._prayer_cache) > 100:
-            oldest_key = min(
-                self._prayer_cache.keys(),
-                key=lambda k: self._prayer_cache[k]['expires']
-            )
-            del self._prayer_cache[oldest_key]
+        try:
+            return await self.prayer_api_breaker.call(func, *args)
+        finally:
+            if self.prayer_api_breaker.state == CircuitState.OPEN:
+                try:
+                    await self._redis.set(
+                        self._breaker_open_key,
+                        1,
+                        ex=self.prayer_api_breaker.config.timeout,
+                        nx=True
+                    )
+                except redis.RedisError as e:
+                    logger.warning(f"Prayer circuit state update failed: {e}")
     
-    def _check_prayer_conflict_from_cache(
-        self,
-        proposed_time: datetime,
-        cached_data: Dict
-    ) -> Dict[str, Any]:
-        """Check prayer conflict using cached data"""
+    async def _get_cached_prayer_schedule(self, cache_keys: List[str]) -> Dict[str, List[Dict]]:
+        """Get cached prayer windows for several dates in one round trip"""
         try:
-            if cached_data and cached_data.get('is_prayer_time'):
-                next_available = datetime.fromisoformat(
-                    cached_data['prayer_end_time']
-                ) + timedelta(minutes=30)
-                
-                return {
-                    'is_prayer_time': True,
-                    'next_available_time': next_available,
-                    'prayer_name': cached_data.get('prayer_name', 'Unknown'),
-                    'source': 'cache'
-                }
-        except Exception as e:
-            logger.warning(f"Cache data parsing failed: {e}")
-        
+            values = await self._redis.mget(cache_keys)
+        except redis.RedisError as e:
+            logger.warning(f"Prayer cache read failed: {e}")
+            return {}
         return {
-            'is_prayer_time': False,
-            'next_available_time': proposed_time,
-            'source': 'cache'
+            key: json.loads(raw)
+            for key, raw in zip(cache_keys, values)
+            if raw is not None
         }
     
+    async def _cache_prayer_schedule(self, schedule: Dict[str, List[Dict]]):
+        """Cache prayer windows per date (Redis expires them after the cache TTL)"""
+        if not schedule:
+            return
+        try:
+            pipe = self._redis.pipeline()
+            for cache_key, day_windows in schedule.items():
+                pipe.set(cache_key, json.dumps(day_windows), ex=self._cache_ttl)
+            await pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"Prayer cache write failed: {e}")
+    
     def _fallback_prayer_check(self, proposed_time: datetime, location: str) -> Dict[str, Any]:
         """
         Fallback prayer time checking using basic rules
@@ -286,36 +378,26 @@ class FeedbackScheduler:
         """
         hour = proposed_time.hour
         
-        # Basic fallback: avoid common prayer times (approximate for Riyadh)
-        prayer_hours = [5, 12, 15, 18, 19]  # Fajr, Dhuhr, Asr, Maghrib, Isha (approximate)
-        
-        if hour in prayer_hours:
-            # Move to next safe hour
-            safe_hour = hour + 1
-            if safe_hour >= 24:
-                safe_hour = 6  # Move to next day, 6 AM
-            
-            next_available = proposed_time.replace(
-                hour=safe_hour,
-                minute=0,
-                second=0,
-                microsecond=0
-            )
-            
-            # If we moved to next day, adjust date
-            if safe_hour == 6 and hour >= 19:
-                next_available += timedelta(days=1)
-            
+        if hour not in _FALLBACK_PRAYER_HOURS:
             return {
-                'is_prayer_time': True,
-                'next_available_time': next_available,
-                'prayer_name': 'Estimated',
+                'is_prayer_time': False,
+                'next_available_time': proposed_time,
                 'source': 'fallback'
             }
         
+        # Move to next safe hour (next day if it wraps past midnight)
+        safe_hour = _NEXT_SAFE_HOUR[hour]
+        next_available = proposed_time.replace(
+            hour=safe_hour,
+            minute=0,
+            second=0,
+            microsecond=0
+        ) + timedelta(days=safe_hour <= hour)
+        
         return {
-            'is_prayer_time': False,
-            'next_available_time': proposed_time,
+            'is_prayer_time': True,
+            'next_available_time': next_available,
+            'prayer_name': 'Estimated',
             'source': 'fallback'
         }
     
@@ -323,9 +405,13 @@ class FeedbackScheduler:
         """Get circuit breaker statistics for monitoring"""
         return self.prayer_api_breaker.get_stats()
     
-    def reset_circuit_breaker(self):
-        """Manually reset the prayer time API circuit breaker"""
+    async def reset_circuit_breaker(self):
+        """Manually reset the prayer time API circuit breaker on all workers"""
         self.prayer_api_breaker.reset()
+        try:
+            await self._redis.delete(self._breaker_open_key)
+        except redis.RedisError as e:
+            logger.warning(f"Prayer circuit state reset failed: {e}")
         logger.info("Prayer time API circuit breaker manually reset")
     
     async def cancel_campaign(self, campaign_id: UUID) -> bool:
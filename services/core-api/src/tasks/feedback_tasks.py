@@ -4,14 +4,16 @@ Handles scheduled sending and metrics updates
 """
 
 from celery import Celery, Task
+from celery.signals import worker_process_init, worker_process_shutdown
 from datetime import datetime, timedelta
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 import httpx
 import json
 import asyncio
+import threading
 from uuid import UUID
 
-from ..repositories.campaign_repository import CampaignRepository
+from ..repositories.campaign_repository import CampaignRepository, close_pg_pool
 from ..services.alert_service import AlertService
 import os
 
@@ -31,6 +33,94 @@ app.conf.update(
     enable_utc=True,
 )
 
+# Persistent event loop per worker process, run on a background thread
+ASYNC_TASK_TIMEOUT = 300  # Seconds a task waits for its coroutine
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+# Pooled HTTP client shared by tasks running on the same event loop
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=50, max_connections=200)
+_http_client: Optional[httpx.AsyncClient] = None
+_http_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _get_http_client() -> httpx.AsyncClient:
+    """
+    Get the pooled HTTP client, creating it on first use
+    Connections are bound to an event loop, so a new loop gets a new client
+    """
+    global _http_client, _http_client_loop
+    loop = asyncio.get_running_loop()
+    if _http_client is None or _http_client.is_closed or _http_client_loop is not loop:
+        _http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(30.0, connect=5.0),
+            limits=HTTP_LIMITS
+        )
+        _http_client_loop = loop
+    return _http_client
+
+
+def _get_event_loop() -> asyncio.AbstractEventLoop:
+    """Get the worker's event loop, starting its thread on first use"""
+    global _loop
+    with _loop_lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_loop.run_forever,
+                name='feedback-tasks-loop',
+                daemon=True
+            ).start()
+    return _loop
+
+
+def _run_async(coro, timeout: float = ASYNC_TASK_TIMEOUT):
+    """Run a coroutine on the worker's event loop and wait for its result"""
+    future = asyncio.run_coroutine_threadsafe(coro, _get_event_loop())
+    try:
+        return future.result(timeout=timeout)
+    except Exception:
+        future.cancel()
+        raise
+
+
+@worker_process_init.connect
+def _start_event_loop(**kwargs):
+    """Start a fresh event loop in each forked worker process"""
+    global _loop, _http_client, _http_client_loop
+    # The parent's loop thread does not exist in the child
+    _loop = None
+    _http_client = None
+    _http_client_loop = None
+    _get_event_loop()
+
+
+@worker_process_shutdown.connect
+def _stop_event_loop(**kwargs):
+    """Close pooled clients and stop the event loop when the worker process exits"""
+    global _loop, _http_client, _http_client_loop
+    if _loop is None or not _loop.is_running():
+        return
+    
+    async def close_clients():
+        if _http_client is not None:
+            await _http_client.aclose()
+        for task in app.tasks.values():
+            alert_service = getattr(task, '_alert_service', None)
+            if alert_service is not None:
+                await alert_service.aclose()
+        await close_pg_pool()
+    
+    try:
+        asyncio.run_coroutine_threadsafe(close_clients(), _loop).result(timeout=10)
+    except Exception as e:
+        print(f"Error closing clients on worker shutdown: {e}")
+    
+    _loop.call_soon_threadsafe(_loop.stop)
+    _loop = None
+    _http_client = None
+    _http_client_loop = None
+
 
 class FeedbackTask(Task):
     """Base task with shared resources"""
@@ -60,13 +150,8 @@ def send_feedback_message(self, message_id: str):
     Called by scheduler when message time arrives
     """
     try:
-        # Run async function in sync context
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        result = loop.run_until_complete(
-            _send_feedback_message_async(self, message_id)
-        )
-        return result
+        # Run async function on the worker's event loop
+        return _run_async(_send_feedback_message_async(self, message_id))
     except Exception as e:
         # Retry on failure
         raise self.retry(exc=e, countdown=60, max_retries=3)
@@ -114,37 +199,33 @@ async def _send_feedback_message_async(task: FeedbackTask, message_id: str):
     
     # Send via WhatsApp API
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                'http://whatsapp-gateway:8002/api/messages/send',
-                json=whatsapp_payload,
-                timeout=30.0
+        response = await _get_http_client().post(
+            'http://whatsapp-gateway:8002/api/messages/send',
+            json=whatsapp_payload,
+            timeout=30.0
+        )
+        
+        if response.status_code == 200:
+            # Update message status
+            await task.campaign_repo.mark_sent(UUID(message_id))
+            
+            # Update recipient status
+            await task.campaign_repo.update_recipient_status(
+                UUID(message['recipient_id']),
+                'sent'
             )
             
-            if response.status_code == 200:
-                # Update message status
-                await task.campaign_repo.update_message_status(
-                    UUID(message_id),
-                    'sent'
-                )
-                
-                # Update recipient status
-                await task.campaign_repo.update_recipient_status(
-                    UUID(message['recipient_id']),
-                    'sent'
-                )
-                
-                return {
-                    'success': True,
-                    'message_id': message_id,
-                    'whatsapp_id': response.json().get('message_id')
-                }
-            else:
-                return {
-                    'error': f"WhatsApp API error: {response.status_code}",
-                    'details': response.text
-                }
-                
+            return {
+                'success': True,
+                'message_id': message_id,
+                'whatsapp_id': response.json().get('message_id')
+            }
+        else:
+            return {
+                'error': f"WhatsApp API error: {response.status_code}",
+                'details': response.text
+            }
+            
     except Exception as e:
         return {'error': f"Failed to send message: {str(e)}"}
 
@@ -155,12 +236,7 @@ def send_scheduled_feedback(self):
     Process scheduled feedback messages
     Runs every 5 minutes to check for messages due to be sent
     """
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    result = loop.run_until_complete(
-        _process_scheduled_feedback_async(self)
-    )
-    return result
+    return _run_async(_process_scheduled_feedback_async(self))
 
 
 async def _process_scheduled_feedback_async(task: FeedbackTask):
@@ -212,12 +288,7 @@ def update_campaign_metrics(self):
     Update metrics for active campaigns
     Runs every 10 minutes
     """
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    result = loop.run_until_complete(
-        _update_campaign_metrics_async(self)
-    )
-    return result
+    return _run_async(_update_campaign_metrics_async(self))
 
 
 async def _update_campaign_metrics_async(task: FeedbackTask):
@@ -264,12 +335,7 @@ def generate_daily_reports(self):
     Generate daily summary reports
     Scheduled to run daily at 6 AM
     """
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    result = loop.run_until_complete(
-        _generate_daily_reports_async(self)
-    )
-    return result
+    return _run_async(_generate_daily_reports_async(self))
 
 
 async def _generate_daily_reports_async(task: FeedbackTask):
@@ -290,19 +356,18 @@ async def _generate_daily_reports_async(task: FeedbackTask):
     for restaurant_id in restaurant_ids:
         try:
             # Call analytics service to generate report
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    'http://analytics-service:8003/api/reports/daily-summary',
-                    json={
-                        'restaurant_id': restaurant_id,
-                        'date': yesterday.date().isoformat()
-                    },
-                    timeout=60.0
-                )
+            response = await _get_http_client().post(
+                'http://analytics-service:8003/api/reports/daily-summary',
+                json={
+                    'restaurant_id': restaurant_id,
+                    'date': yesterday.date().isoformat()
+                },
+                timeout=60.0
+            )
+            
+            if response.status_code == 200:
+                reports_generated += 1
                 
-                if response.status_code == 200:
-                    reports_generated += 1
-                    
         except Exception as e:
             print(f"Error generating report for restaurant {restaurant_id}: {e}")
     
@@ -315,12 +380,7 @@ def process_feedback_response(self, conversation_id: str, feedback_data: Dict[st
     Process a feedback response from a customer
     Triggers alerts if needed
     """
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    result = loop.run_until_complete(
-        _process_feedback_response_async(self, conversation_id, feedback_data)
-    )
-    return result
+    return _run_async(_process_feedback_response_async(self, conversation_id, feedback_data))
 
 
 async def _process_feedback_response_async(
@@ -331,6 +391,8 @@ async def _process_feedback_response_async(
     """Process feedback and generate alerts"""
     # Check for alert conditions
     alerts = await task.alert_service.process_feedback_for_alerts(feedback_data)
+    # Deliver queued notifications before the task reports completion
+    await task.alert_service.flush_notifications()
     
     # Update recipient status
     if feedback_data.get('campaign_recipient_id'):
@@ -0,0 +1,59 @@
+"""
+Bloom filter for space-efficient membership checks
+Used to remember phone numbers across uploads without keeping every number
+"""
+
+import hashlib
+import math
+
+
+class BloomFilter:
+    """
+    Fixed-capacity Bloom filter over strings
+    Membership checks may return false positives (at roughly error_rate once
+    capacity items are added) but never false negatives
+    """
+    
+    def __init__(self, capacity: int = 10_000, error_rate: float = 0.001):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        if not 0 < error_rate < 1:
+            raise ValueError("error_rate must be between 0 and 1")
+        
+        self.capacity = capacity
+        self.error_rate = error_rate
+        
+        # Optimal bit count and hash count for the target false positive rate
+        self.num_bits = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self._bits = bytearray((self.num_bits + 7) // 8)
+        self._count = 0
+    
+    def _positions(self, item: str):
+        """Bit positions for an item (double hashing over one blake2b digest)"""
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+    
+    def add(self, item: str) -> bool:
+        """Add an item; returns True if it was (probably) already present"""
+        present = True
+        for pos in self._positions(item):
+            mask = 1 << (pos & 7)
+            if not self._bits[pos >> 3] & mask:
+                present = False
+                self._bits[pos >> 3] |= mask
+        if not present:
+            self._count += 1
+        return present
+    
+    def __contains__(self, item: str) -> bool:
+        return all(
+            self._bits[pos >> 3] & (1 << (pos & 7))
+            for pos in self._positions(item)
+        )
+    
+    def __len__(self) -> int:
+        """Approximate number of distinct items added"""
+        return self._count
@@ -3,12 +3,26 @@ Unit tests for A/B Testing Service
 Tests variant assignment logic, statistical analysis, and experiment management
 """
 
+import asyncio
 import pytest
 import uuid
 from datetime import datetime, timedelta
 from unittest.mock import Mock, patch, AsyncMock
+import numpy as np
+import orjson
+from scipy import stats
 
-from src.services.ab_testing_service import ABTestingService
+from src.services.ab_testing_service import (
+    ABTestingService,
+    ABTestExperiment,
+    ExperimentStatus,
+    ExperimentVariant,
+    VariantAssignmentStrategy,
+    PARTICIPANTS,
+    RESPONSES,
+    _iso_now,
+    _stable_unit_hash
+)
 from src.repositories.campaign_repository import CampaignRepository
 
 
@@ -479,4 +493,464 @@ class TestABTestingService:
         # Check roughly equal distribution (25% each with tolerance)
         for variant_id in ['a', 'b', 'c', 'd']:
             ratio = assignments.get(variant_id, 0) / 1000
-            assert abs(ratio - 0.25) < 0.05  # 5% tolerance
\ No newline at end of file
+            assert abs(ratio - 0.25) < 0.05  # 5% tolerance
+
+
+class TestStableUnitHash:
+    
+    def test_same_phone_maps_to_same_value(self):
+        """Test hash is deterministic (independent of PYTHONHASHSEED)"""
+        assert _stable_unit_hash('+966501234567') == _stable_unit_hash('+966501234567')
+        assert _stable_unit_hash('+966501234567') == 0.3904653506267075
+    
+    def test_values_are_uniform_in_unit_interval(self):
+        """Test hash values spread evenly over [0, 1)"""
+        buckets = [0] * 10
+        for i in range(10000):
+            value = _stable_unit_hash(f'+9665{i:08d}')
+            assert 0.0 <= value < 1.0
+            buckets[int(value * 10)] += 1
+        
+        for count in buckets:
+            assert abs(count - 1000) < 150
+
+
+class TestIsoNow:
+    
+    def test_formats_once_per_second(self):
+        """Test the cached timestamp only changes when the second changes"""
+        with patch('src.services.ab_testing_service.time.time', side_effect=[1700000000.1, 1700000000.9, 1700000001.2]):
+            first, second, third = _iso_now(), _iso_now(), _iso_now()
+        
+        assert first is second
+        assert first == datetime.fromtimestamp(1700000000).isoformat()
+        assert third == datetime.fromtimestamp(1700000001).isoformat()
+
+
+@pytest.fixture
+def service():
+    with patch('src.services.ab_testing_service.CampaignRepository'):
+        service = ABTestingService()
+    # Tests drive the analysis sweep directly instead of a background task
+    service._ensure_sweep_task = Mock()
+    repo = service.campaign_repo
+    repo.get_experiment = AsyncMock(return_value=None)
+    repo.list_experiment_ids = AsyncMock(return_value=[])
+    repo.create_variant_assignment = AsyncMock(return_value=True)
+    repo.get_variant_assignment = AsyncMock(return_value='b')
+    repo.bulk_increment_participants = AsyncMock(return_value=True)
+    repo.update_variant_result = AsyncMock(return_value=True)
+    repo.update_experiment_state = AsyncMock(return_value=True)
+    return service
+
+
+def _experiment(
+    *variant_ids,
+    assignment_strategy=VariantAssignmentStrategy.WEIGHTED,
+    min_sample_size=10,
+    experiment_id=None
+):
+    return ABTestExperiment(
+        id=experiment_id or str(uuid.uuid4()),
+        campaign_id=str(uuid.uuid4()),
+        name='Rating Test',
+        description='',
+        variants=[
+            ExperimentVariant(id=v, name=v, weight=1.0 / len(variant_ids), template='t', parameters={})
+            for v in variant_ids
+        ],
+        status=ExperimentStatus.RUNNING,
+        assignment_strategy=assignment_strategy,
+        min_sample_size=min_sample_size
+    )
+
+
+class TestResponseRateAnalysis:
+    
+    def test_matches_chi2_contingency(self, service):
+        """Test closed-form 2x2 statistic matches scipy's chi2_contingency"""
+        result = service._analyze_response_rates(np.array([1000, 1000]), np.array([120, 180]))
+        chi2, p_value, _, _ = stats.chi2_contingency([[120, 880], [180, 820]])
+        
+        assert result['chi2_statistic'] == pytest.approx(chi2)
+        assert result['p_value'] == pytest.approx(p_value)
+        assert result['significant'] is True
+        assert result['confidence'] == pytest.approx(1 - p_value)
+    
+    def test_reports_confidence_when_not_significant(self, service):
+        """Test confidence is reported even without significance"""
+        result = service._analyze_response_rates(np.array([100, 100]), np.array([50, 52]))
+        
+        assert result['significant'] is False
+        assert result['confidence'] == pytest.approx(1 - result['p_value'])
+    
+    def test_multi_variant_matches_chi2_contingency(self, service):
+        """Test V x 2 statistic matches scipy for more than two variants"""
+        participants = np.array([500, 480, 510, 495])
+        responses = np.array([60, 75, 58, 90])
+        result = service._analyze_response_rates(participants, responses)
+        chi2, p_value, dof, _ = stats.chi2_contingency(
+            np.stack([responses, participants - responses], axis=1)
+        )
+        
+        assert result['chi2_statistic'] == pytest.approx(chi2)
+        assert result['p_value'] == pytest.approx(p_value)
+        assert result['degrees_of_freedom'] == dof
+        assert result['significant'] is True
+
+
+class TestRatingStatistics:
+    
+    @staticmethod
+    async def _record_ratings(service, experiment, variant, ratings):
+        experiment.metrics[variant.idx, PARTICIPANTS] += len(ratings)
+        experiment.total_participants += len(ratings)
+        for rating in ratings:
+            await service._update_variant_metrics(experiment, variant, {'responded': True, 'rating': rating})
+    
+    @pytest.mark.asyncio
+    async def test_running_mean_and_variance_match_numpy(self, service):
+        """Test rating sums give the batch mean and sample variance"""
+        ratings = [5, 4, 4, 3, 5, 1, 2, 5, 4, 4]
+        experiment = _experiment('a')
+        variant = experiment.variants[0]
+        
+        await self._record_ratings(service, experiment, variant, ratings)
+        
+        assert variant.metrics["ratings"] == len(ratings)
+        assert variant.metrics["responses"] == len(ratings)
+        assert variant.metrics["average_rating"] == pytest.approx(np.mean(ratings))
+        assert variant.rating_variance == pytest.approx(np.var(ratings, ddof=1))
+        assert experiment.totals_consistent()
+    
+    @pytest.mark.asyncio
+    async def test_welch_t_test_matches_scipy(self, service):
+        """Test rating analysis matches scipy's unequal-variance t-test"""
+        ratings_a = [5, 4, 5, 4, 5, 5, 3, 4, 5, 4, 5, 5]
+        ratings_b = [3, 2, 4, 3, 1, 3, 4, 2, 3, 3]
+        experiment = _experiment('a', 'b')
+        variant_data = []
+        for variant, ratings in zip(experiment.variants, (ratings_a, ratings_b)):
+            await self._record_ratings(service, experiment, variant, ratings)
+            variant_data.append({
+                'id': variant.id,
+                'average_rating': variant.metrics["average_rating"],
+                'ratings': variant.metrics["ratings"],
+                'rating_variance': variant.rating_variance
+            })
+        
+        result = service._analyze_ratings(variant_data)
+        expected = stats.ttest_ind(ratings_a, ratings_b, equal_var=False)
+        
+        assert result['t_statistic'] == pytest.approx(expected.statistic)
+        assert result['p_value'] == pytest.approx(expected.pvalue)
+        assert result['significant'] is True
+        assert result['better_variant'] == 'a'
+    
+    @pytest.mark.asyncio
+    async def test_completion_rate_counts_every_completed_conversation(self, service):
+        """Test completed conversations accumulate instead of sticking at one"""
+        experiment = _experiment('a')
+        variant = experiment.variants[0]
+        experiment.metrics[variant.idx, PARTICIPANTS] = 10
+        
+        for _ in range(4):
+            await service._update_variant_metrics(experiment, variant, {'conversation_completed': True})
+        
+        assert variant.metrics["completion_rate"] == pytest.approx(0.4)
+    
+    def test_variant_rows_are_views_into_experiment_metrics(self):
+        """Test per-variant metrics read through the shared (V, M) array"""
+        experiment = _experiment('a', 'b')
+        experiment.metrics[1, PARTICIPANTS] = 4
+        experiment.metrics[1, RESPONSES] = 3
+        
+        assert experiment.variants[1].idx == 1
+        assert experiment.variants[1].metrics["participants"] == 4
+        assert experiment.variants[1].metrics["response_rate"] == pytest.approx(0.75)
+        assert experiment.variants[0].metrics["participants"] == 0
+        assert not hasattr(experiment.variants[0], '__dict__')
+
+
+class TestAnalysisSchedule:
+    
+    @pytest.mark.asyncio
+    async def test_analysis_backs_off_until_enough_new_participants(self, service):
+        """Test significance analysis is not re-run on every result"""
+        experiment = _experiment('a', 'b')
+        experiment.metrics[:, PARTICIPANTS] = 100
+        experiment.total_participants = 200
+        service._analyze_statistical_significance = AsyncMock(
+            return_value={'is_significant': False}
+        )
+        
+        assert await service._check_experiment_completion(experiment) is True
+        assert experiment._next_analyze_at == 250
+        
+        experiment.metrics[0, PARTICIPANTS] += 49
+        experiment.total_participants += 49
+        assert await service._check_experiment_completion(experiment) is False
+        assert await service._check_experiment_completion(experiment, force=True) is True
+        assert service._analyze_statistical_significance.await_count == 2
+
+    
+    @pytest.mark.asyncio
+    async def test_sweep_keeps_running_and_analyzes_experiments_from_database(self, service):
+        """Test the sweeper survives idle rounds and covers experiments listed in the DB"""
+        experiment = _experiment('a', 'b')
+        experiment.metrics[:, PARTICIPANTS] = 100
+        experiment.total_participants = 200
+        service._experiments[experiment.id] = experiment
+        service.campaign_repo.list_experiment_ids.side_effect = [[], [experiment.id]]
+        service._check_experiment_completion = AsyncMock(return_value=True)
+        
+        with patch(
+            'src.services.ab_testing_service.asyncio.sleep',
+            AsyncMock(side_effect=[None, None, asyncio.CancelledError()])
+        ):
+            with pytest.raises(asyncio.CancelledError):
+                await service._analysis_sweep_loop()
+        
+        assert service.campaign_repo.list_experiment_ids.await_count == 2
+        service._check_experiment_completion.assert_awaited_once_with(experiment, force=True)
+        service.campaign_repo.update_experiment_state.assert_awaited_once()
+    
+    @pytest.mark.asyncio
+    async def test_unchanged_inputs_reuse_previous_analysis(self, service):
+        """Test analysis is memoized on the per-variant input counts"""
+        experiment = _experiment('a', 'b')
+        experiment.metrics[:, PARTICIPANTS] = 200
+        experiment.metrics[:, RESPONSES] = [20, 60]
+        
+        with patch.object(service, '_analyze_response_rates', wraps=service._analyze_response_rates) as analyze:
+            first = await service._analyze_statistical_significance(experiment)
+            second = await service._analyze_statistical_significance(experiment)
+            experiment.metrics[0, RESPONSES] += 1
+            third = await service._analyze_statistical_significance(experiment)
+        
+        assert second is first
+        assert third is not first
+        assert analyze.call_count == 2
+
+    
+    @pytest.mark.asyncio
+    async def test_winner_has_best_combined_score(self, service):
+        """Test the winner maximizes 0.6 * response rate + 0.4 * rating / 5"""
+        experiment = _experiment('a', 'b', 'c')
+        experiment.metrics[:, PARTICIPANTS] = [5, 400, 400]
+        experiment.metrics[:, RESPONSES] = [5, 40, 120]
+        
+        result = await service._analyze_statistical_significance(experiment)
+        
+        assert result['is_significant'] is True
+        assert result['winning_variant'] == 'c'
+
+
+class TestVariantSampling:
+    
+    def test_reloaded_experiment_does_not_replay_draws(self, service):
+        """Test a rebuilt experiment gets a fresh generator, not the same sequence"""
+        first = _experiment('a', 'b', 'c')
+        second = _experiment('a', 'b', 'c', experiment_id=first.id)
+        
+        draws = [service._assign_variant_weighted(first).id for _ in range(50)]
+        
+        assert draws != [service._assign_variant_weighted(second).id for _ in range(50)]
+        assert set(draws) == {'a', 'b', 'c'}
+
+
+class TestResultPersistence:
+    
+    @pytest.mark.asyncio
+    async def test_result_writes_only_variant_deltas(self, service):
+        """Test recording a result sends increments instead of the full experiment"""
+        experiment = _experiment('a', 'b')
+        experiment.metrics[:, PARTICIPANTS] = 5
+        experiment.total_participants = 10
+        experiment.min_sample_size = 1000
+        service._experiments[experiment.id] = experiment
+        service._get_customer_variant_assignment = AsyncMock(return_value='b')
+        
+        recorded = await service.record_variant_result(
+            experiment.id,
+            '+966501234567',
+            {'responded': True, 'rating': 4}
+        )
+        
+        assert recorded is True
+        service.campaign_repo.update_experiment_state.assert_not_called()
+        _, variant_id, increments = service.campaign_repo.update_variant_result.call_args.args
+        assert variant_id == 'b'
+        # Only additive values are written, so concurrent workers' writes commute
+        assert increments == {'responses': 1, 'ratings': 1, 'rating_sum': 4, 'rating_sum_sq': 16}
+    
+    @pytest.mark.asyncio
+    async def test_full_write_sends_serialized_state(self, service):
+        """Test state transitions hand the repository one orjson payload"""
+        experiment = _experiment('a', 'b')
+        experiment.metrics[0, PARTICIPANTS] = 3
+        experiment.started_at = datetime(2024, 1, 1, 12, 0, 0)
+        service._dirty_counts[experiment.id]['a'] += 3
+        
+        await service._update_experiment_in_db(experiment)
+        
+        experiment_id, payload = service.campaign_repo.update_experiment_state.call_args.args
+        state = orjson.loads(payload)
+        assert str(experiment_id) == experiment.id
+        assert state['status'] == 'running'
+        assert state['started_at'] == '2024-01-01T12:00:00'
+        # Variant metrics stay on the delta path, so pending increments are kept
+        assert 'variants' not in state
+        assert service._dirty_counts[experiment.id] == {'a': 3}
+
+
+class TestAssignmentCache:
+    
+    @pytest.mark.asyncio
+    async def test_recorded_assignment_is_served_from_cache(self, service):
+        """Test lookups right after assignment do not hit the database"""
+        experiment_id = str(uuid.uuid4())
+        await service._record_variant_assignment(experiment_id, '+966501234567', 'a', None)
+        
+        assert await service._get_customer_variant_assignment(experiment_id, '+966501234567') == 'a'
+        service.campaign_repo.create_variant_assignment.assert_awaited_once()
+        service.campaign_repo.get_variant_assignment.assert_not_called()
+    
+    @pytest.mark.asyncio
+    async def test_cache_miss_queries_once(self, service):
+        """Test a miss loads the assignment from the database and caches it"""
+        experiment_id = str(uuid.uuid4())
+        
+        for _ in range(4):
+            assert await service._get_customer_variant_assignment(experiment_id, '+966500000000') == 'b'
+        
+        service.campaign_repo.get_variant_assignment.assert_awaited_once()
+
+
+class TestExperimentCache:
+    
+    @pytest.mark.asyncio
+    async def test_miss_rehydrates_experiment_from_database(self, service):
+        """Test an uncached experiment is rebuilt from its stored row"""
+        experiment_id = str(uuid.uuid4())
+        service.campaign_repo.get_experiment.return_value = {
+            'id': experiment_id,
+            'campaign_id': str(uuid.uuid4()),
+            'name': 'Greeting Style Test',
+            'description': None,
+            'variants': [
+                {'id': 'a', 'name': 'A', 'weight': 0.5, 'template': 't', 'parameters': {},
+                 'metrics': {'participants': 12, 'responses': 3}},
+                {'id': 'b', 'name': 'B', 'weight': 0.5, 'template': 't', 'parameters': {},
+                 'metrics': {'participants': 8, 'responses': 4}}
+            ],
+            'assignment_strategy': 'hash_based',
+            'min_sample_size': 100,
+            'confidence_level': 0.95,
+            'status': 'running',
+            'created_at': '2024-01-01T10:00:00+00:00',
+            'started_at': '2024-01-01T11:00:00+00:00',
+            'ended_at': None
+        }
+        
+        experiment = await service._get_experiment(experiment_id)
+        
+        assert experiment.status is ExperimentStatus.RUNNING
+        assert experiment.assignment_strategy is VariantAssignmentStrategy.HASH_BASED
+        assert experiment.total_participants == 20
+        assert experiment.variants[1].metrics["response_rate"] == pytest.approx(0.5)
+        assert await service._get_experiment(experiment_id) is experiment
+        service.campaign_repo.get_experiment.assert_awaited_once()
+    
+    def test_legacy_rating_metrics_convert_to_sums(self, service):
+        """Test rows stored with mean and M2 rebuild the same rating statistics"""
+        ratings = [5, 4, 2, 5, 3]
+        record = {
+            'id': str(uuid.uuid4()),
+            'variants': [{'id': 'a', 'metrics': {
+                'participants': 5,
+                'ratings': len(ratings),
+                'average_rating': np.mean(ratings),
+                'rating_m2': np.var(ratings) * len(ratings)
+            }}]
+        }
+        
+        variant = service._experiment_from_record(record).variants[0]
+        
+        assert variant.average_rating == pytest.approx(np.mean(ratings))
+        assert variant.rating_variance == pytest.approx(np.var(ratings, ddof=1))
+        assert variant.counters['rating_sum'] == pytest.approx(sum(ratings))
+    
+    @pytest.mark.asyncio
+    async def test_unknown_experiment_returns_none(self, service):
+        """Test missing experiments are reported rather than cached"""
+        assert await service.assign_variant(str(uuid.uuid4()), '+966501234567') is None
+    
+    @pytest.mark.asyncio
+    async def test_malformed_experiment_id_returns_none(self, service):
+        """Test a non-UUID experiment id is treated as unknown"""
+        assert await service.assign_variant('not-a-uuid', '+966501234567') is None
+        assert await service.record_variant_result('not-a-uuid', '+966501234567', {}) is False
+        service.campaign_repo.get_experiment.assert_not_called()
+
+
+class TestParticipantFlush:
+    
+    @pytest.mark.asyncio
+    async def test_assignments_are_coalesced_into_one_increment(self, service):
+        """Test participant writes are batched instead of written per assignment"""
+        experiment = _experiment(
+            'a', 'b',
+            assignment_strategy=VariantAssignmentStrategy.HASH_BASED,
+            min_sample_size=100
+        )
+        service._experiments[experiment.id] = experiment
+        
+        for i in range(20):
+            await service.assign_variant(experiment.id, f'+9665{i:08d}')
+        
+        service.campaign_repo.update_experiment_state.assert_not_called()
+        service.campaign_repo.bulk_increment_participants.assert_not_called()
+        
+        await service.flush_participant_counts()
+        
+        service.campaign_repo.bulk_increment_participants.assert_called_once()
+        experiment_id, increments = service.campaign_repo.bulk_increment_participants.call_args.args
+        assert str(experiment_id) == experiment.id
+        assert increments == {v.id: v.metrics["participants"] for v in experiment.variants}
+        assert sum(increments.values()) == 20
+        assert experiment.total_participants == 20
+        assert experiment.totals_consistent()
+        service._flush_task.cancel()
+    
+    @pytest.mark.asyncio
+    async def test_close_writes_pending_counts(self, service):
+        """Test counts buffered behind a delayed flush are written on close"""
+        experiment = _experiment('a', 'b', min_sample_size=100)
+        service._experiments[experiment.id] = experiment
+        
+        for i in range(3):
+            await service.assign_variant(experiment.id, f'+9665{i:08d}')
+        flush_task = service._flush_task
+        
+        await service.aclose()
+        
+        assert flush_task.cancelled()
+        service.campaign_repo.bulk_increment_participants.assert_called_once()
+        _, increments = service.campaign_repo.bulk_increment_participants.call_args.args
+        assert sum(increments.values()) == 3
+        assert not service._dirty_counts
+        assert service._flush_task is None
+    
+    @pytest.mark.asyncio
+    async def test_cancelled_flush_keeps_unwritten_counts(self, service):
+        """Test a flush cancelled mid-write leaves its deltas for the next flush"""
+        service._dirty_counts['00000000-0000-0000-0000-000000000001']['a'] += 2
+        service.campaign_repo.bulk_increment_participants = AsyncMock(
+            side_effect=asyncio.CancelledError()
+        )
+        
+        with pytest.raises(asyncio.CancelledError):
+            await service.flush_participant_counts()
+        
+        assert service._dirty_counts['00000000-0000-0000-0000-000000000001'] == {'a': 2}
@@ -2,6 +2,10 @@
 Unit tests for alert service
 """
 
+import asyncio
+import json
+import time
+import httpx
 import pytest
 from unittest.mock import Mock, patch, AsyncMock
 from datetime import datetime, timedelta
@@ -30,7 +34,8 @@ class TestAlertService:
     
     @pytest.fixture
     def alert_service(self, mock_supabase):
-        service = AlertService("test_url", "test_key")
+        with patch('src.services.alert_service.create_client'):
+            service = AlertService("test_url", "test_key")
         service.supabase = mock_supabase
         return service
     
@@ -95,10 +100,12 @@ class TestAlertService:
         # Verify rule structure
         for rule in rules:
             assert 'id' in rule
-            assert 'condition' in rule
             assert 'priority' in rule
             assert 'description' in rule
-            assert callable(rule['condition'])
+    
+    @staticmethod
+    def _matches(alert_service, rule, feedback):
+        return rule in alert_service._match_rules(feedback)
     
     def test_low_rating_immediate_rule(self, alert_service, negative_feedback):
         """Test immediate alert rule for very low ratings"""
@@ -106,12 +113,12 @@ class TestAlertService:
         low_rating_rule = next(r for r in rules if r['id'] == 'low_rating_immediate')
         
         # Test with 1-star rating
-        assert low_rating_rule['condition'](negative_feedback) is True
+        assert self._matches(alert_service, low_rating_rule, negative_feedback) is True
         assert low_rating_rule['priority'] == AlertPriority.IMMEDIATE
         
         # Test with higher rating
         feedback_3_stars = {**negative_feedback, 'rating': 3}
-        assert low_rating_rule['condition'](feedback_3_stars) is False
+        assert self._matches(alert_service, low_rating_rule, feedback_3_stars) is False
     
     def test_negative_sentiment_rule(self, alert_service, negative_feedback):
         """Test negative sentiment alert rule"""
@@ -119,12 +126,12 @@ class TestAlertService:
         sentiment_rule = next(r for r in rules if r['id'] == 'negative_sentiment')
         
         # Test with strong negative sentiment
-        assert sentiment_rule['condition'](negative_feedback) is True
+        assert self._matches(alert_service, sentiment_rule, negative_feedback) is True
         assert sentiment_rule['priority'] == AlertPriority.HIGH
         
         # Test with neutral sentiment
         neutral_feedback = {**negative_feedback, 'sentiment_score': 0.1}
-        assert sentiment_rule['condition'](neutral_feedback) is False
+        assert self._matches(alert_service, sentiment_rule, neutral_feedback) is False
     
     def test_food_quality_issue_rule(self, alert_service, food_quality_issue_feedback):
         """Test food quality issue detection rule"""
@@ -132,7 +139,7 @@ class TestAlertService:
         food_rule = next(r for r in rules if r['id'] == 'food_quality_issue')
         
         # Test with food quality issue
-        assert food_rule['condition'](food_quality_issue_feedback) is True
+        assert self._matches(alert_service, food_rule, food_quality_issue_feedback) is True
         assert food_rule['priority'] == AlertPriority.HIGH
         
         # Test without food quality topic
@@ -140,14 +147,14 @@ class TestAlertService:
             **food_quality_issue_feedback, 
             'topics': ['service', 'staff']
         }
-        assert food_rule['condition'](no_food_feedback) is False
+        assert self._matches(alert_service, food_rule, no_food_feedback) is False
         
         # Test with food quality but positive sentiment
         positive_food_feedback = {
             **food_quality_issue_feedback,
             'sentiment_score': 0.5
         }
-        assert food_rule['condition'](positive_food_feedback) is False
+        assert self._matches(alert_service, food_rule, positive_food_feedback) is False
     
     @pytest.mark.asyncio
     async def test_process_feedback_for_alerts_negative(
@@ -177,7 +184,8 @@ class TestAlertService:
                 assert 'title' in alert
                 assert 'details' in alert
             
-            # Should send notifications for high priority alerts
+            # Notifications are delivered by the background workers
+            await alert_service.aclose()
             mock_send.assert_called_once()
     
     @pytest.mark.asyncio
@@ -197,32 +205,53 @@ class TestAlertService:
             # Should not send notifications
             mock_send.assert_not_called()
     
-    @pytest.mark.asyncio
-    async def test_create_alert(self, alert_service, negative_feedback, mock_supabase):
-        """Test alert creation"""
+    def test_build_alert_payload(self, alert_service, negative_feedback):
+        """Test alert payload construction"""
         rules = alert_service.alert_rules
         low_rating_rule = next(r for r in rules if r['id'] == 'low_rating_immediate')
         
-        # Mock successful database insertion
-        alert_id = str(uuid4())
+        payload = alert_service._build_alert_payload(negative_feedback, low_rating_rule)
+        
+        assert payload['restaurant_id'] == negative_feedback['restaurant_id']
+        assert payload['feedback_id'] == negative_feedback['id']
+        assert payload['rule_id'] == low_rating_rule['id']
+        assert payload['priority'] == low_rating_rule['priority'].value
+        assert payload['status'] == 'pending'
+    
+    @pytest.mark.asyncio
+    async def test_alert_and_realtime_share_timestamp(self, alert_service, negative_feedback, mock_supabase):
+        """Test one feedback event stamps alert and realtime rows identically"""
+        mock_supabase.table.return_value.insert.return_value.execute.return_value.data = []
+        
+        alerts = await alert_service.process_feedback_for_alerts(negative_feedback)
+        await alert_service.aclose()
+        
+        inserts = [c[0][0] for c in mock_supabase.table.return_value.insert.call_args_list]
+        realtime_row = next(row for row in inserts if isinstance(row, dict))
+        timestamps = {a['created_at'] for a in alerts} | {realtime_row['created_at']}
+        assert len(timestamps) == 1
+        assert timestamps.pop().endswith('Z')
+    
+    @pytest.mark.asyncio
+    async def test_create_alerts_single_insert(self, alert_service, negative_feedback, mock_supabase):
+        """Test all matched alerts are stored with one insert"""
+        rules = alert_service._match_rules(negative_feedback)
+        alert_ids = [str(uuid4()) for _ in rules]
         mock_supabase.table.return_value.insert.return_value.execute.return_value.data = [
-            {'id': alert_id}
+            {'id': alert_id} for alert_id in alert_ids
         ]
         
-        alert = await alert_service._create_alert(negative_feedback, low_rating_rule)
+        alerts = await alert_service._create_alerts(negative_feedback, rules)
         
-        assert alert['id'] == alert_id
+        assert [a['id'] for a in alerts] == alert_ids
+        assert [a['rule_id'] for a in alerts] == [r['id'] for r in rules]
+        assert alert_service.get_stats()['alerts_created.immediate'] == 1
         
         # Verify database call
         mock_supabase.table.assert_called_with('feedback_alerts')
-        
-        # Verify alert data structure
+        mock_supabase.table.return_value.insert.assert_called_once()
         insert_call = mock_supabase.table.return_value.insert.call_args[0][0]
-        assert insert_call['restaurant_id'] == negative_feedback['restaurant_id']
-        assert insert_call['feedback_id'] == negative_feedback['id']
-        assert insert_call['rule_id'] == low_rating_rule['id']
-        assert insert_call['priority'] == low_rating_rule['priority'].value
-        assert insert_call['status'] == 'pending'
+        assert len(insert_call) == len(rules)
     
     @pytest.mark.asyncio
     async def test_broadcast_realtime_alert(self, alert_service, mock_supabase):
@@ -282,6 +311,23 @@ class TestAlertService:
             assert 'Customer rated' in call_args['body']
             assert call_args['data']['alert_id'] == alert['id']
     
+    @pytest.mark.asyncio
+    async def test_owner_device_tokens_cached(self, alert_service, mock_supabase):
+        """Test owner tokens are fetched once per restaurant until invalidated"""
+        restaurant_id = str(uuid4())
+        owner_query = mock_supabase.table.return_value.select.return_value.eq.return_value
+        owner_query.execute.return_value.data = [{'device_tokens': ['device_token_1']}]
+        
+        assert await alert_service._get_owner_device_tokens(restaurant_id) == ['device_token_1']
+        assert await alert_service._get_owner_device_tokens(restaurant_id) == ['device_token_1']
+        assert owner_query.execute.call_count == 1
+        
+        owner_query.execute.return_value.data = [{'device_tokens': ['device_token_2']}]
+        alert_service.invalidate_owner(restaurant_id)
+        
+        assert await alert_service._get_owner_device_tokens(restaurant_id) == ['device_token_2']
+        assert owner_query.execute.call_count == 2
+    
     @pytest.mark.asyncio
     async def test_acknowledge_alert(self, alert_service, mock_supabase):
         """Test alert acknowledgment"""
@@ -339,6 +385,9 @@ class TestAlertService:
         
         # Verify database query
         mock_supabase.table.assert_called_with('feedback_alerts')
+        selected = mock_supabase.table.return_value.select.call_args[0][0]
+        assert selected != '*'
+        assert 'details' in selected.split(',')
     
     @pytest.mark.asyncio
     async def test_get_active_alerts_with_priority_filter(self, alert_service, mock_supabase):
@@ -400,12 +449,17 @@ class TestAlertService:
             }
         ]
         
+        # alert_stats RPC not deployed: falls back to aggregating rows
+        mock_supabase.rpc.side_effect = Exception("function alert_stats does not exist")
         mock_supabase.table.return_value.select.return_value.eq.return_value.gte.return_value.lte.return_value.execute.return_value.data = mock_alerts
         
         stats = await alert_service.get_alert_statistics(
             restaurant_id, start_date, end_date
         )
         
+        mock_supabase.table.return_value.select.assert_called_with(
+            'priority,status,created_at,acknowledged_at,rule_id'
+        )
         assert stats['total_alerts'] == 3
         assert stats['by_priority']['immediate'] == 1
         assert stats['by_priority']['high'] == 1
@@ -421,6 +475,61 @@ class TestAlertService:
         assert stats['average_response_time'] is not None
         assert stats['average_response_time'] > 0
     
+    @pytest.mark.asyncio
+    async def test_alert_statistics_mixed_timestamp_formats(self, alert_service, mock_supabase):
+        """Test response time handles UTC 'Z' and naive timestamps together"""
+        mock_supabase.rpc.return_value.execute.return_value.data = None
+        mock_supabase.table.return_value.select.return_value.eq.return_value.gte.return_value.lte.return_value.execute.return_value.data = [
+            {
+                'priority': 'immediate',
+                'status': 'acknowledged',
+                'rule_id': 'low_rating_immediate',
+                'created_at': '2024-01-01T10:00:00Z',
+                'acknowledged_at': '2024-01-01T10:30:00'
+            },
+            {
+                'priority': 'high',
+                'status': 'acknowledged',
+                'rule_id': 'service_complaint',
+                'created_at': '2024-01-01T10:00:00',
+                'acknowledged_at': '2024-01-01T11:30:00+00:00'
+            }
+        ]
+        
+        stats = await alert_service.get_alert_statistics(
+            uuid4(), datetime(2024, 1, 1), datetime(2024, 1, 2)
+        )
+        
+        assert stats['average_response_time'] == 3600
+        assert stats['by_priority']['low'] == 0
+        assert stats['by_status']['resolved'] == 0
+    
+    @pytest.mark.asyncio
+    async def test_alert_statistics_uses_rpc(self, alert_service, mock_supabase):
+        """Test statistics are aggregated by the alert_stats database function"""
+        restaurant_id = uuid4()
+        mock_supabase.rpc.return_value.execute.return_value.data = {
+            'total_alerts': 3,
+            'by_priority': {'immediate': 1, 'high': 1, 'medium': 1, 'low': 0},
+            'by_status': {'pending': 1, 'acknowledged': 2, 'resolved': 0},
+            'average_response_time': 5400.0,
+            'top_issues': [['food_quality_issue', 2], ['low_rating_immediate', 1]]
+        }
+        
+        # Response times are computed by Postgres, never parsed row by row
+        with patch('src.services.alert_service._parse_utc', side_effect=AssertionError):
+            stats = await alert_service.get_alert_statistics(
+                restaurant_id, datetime(2024, 1, 1), datetime(2024, 1, 8)
+            )
+        
+        rpc_name, rpc_params = mock_supabase.rpc.call_args[0]
+        assert rpc_name == 'alert_stats'
+        assert rpc_params['rid'] == str(restaurant_id)
+        assert stats['total_alerts'] == 3
+        assert stats['top_issues'][0] == ('food_quality_issue', 2)
+        assert stats['average_response_time'] == 5400.0
+        mock_supabase.table.assert_not_called()
+    
     def test_alert_priority_enum_values(self):
         """Test AlertPriority enum values"""
         assert AlertPriority.IMMEDIATE.value == "immediate"
@@ -442,16 +551,170 @@ class TestAlertService:
         mock_response.status_code = 200
         mock_client = Mock()
         mock_client.post = AsyncMock(return_value=mock_response)
-        mock_httpx.return_value.__aenter__.return_value = mock_client
+        mock_client.aclose = AsyncMock()
+        mock_httpx.return_value = mock_client
         
         await alert_service._send_webhook_notification(alerts, feedback)
+        await alert_service._send_webhook_notification(alerts, feedback)
+        await asyncio.sleep(0.3)
         
-        # Verify webhook was called
+        # Both events go out in one batched POST on the pooled client
+        mock_httpx.assert_called_once()
         mock_client.post.assert_called_once()
         call_args = mock_client.post.call_args
         
         assert call_args[0][0] == "https://example.com/webhook"
-        webhook_data = call_args[1]['json']
+        assert call_args[1]['headers']['Content-Type'] == 'application/json'
+        webhook_data = json.loads(call_args[1]['content'])
         assert webhook_data['type'] == 'feedback_alert'
-        assert webhook_data['alerts'] == alerts
-        assert webhook_data['feedback'] == feedback
\ No newline at end of file
+        assert webhook_data['events'] == [
+            {'alerts': alerts, 'feedback': feedback},
+            {'alerts': alerts, 'feedback': feedback}
+        ]
+        
+        await alert_service.aclose()
+    
+    @pytest.mark.asyncio
+    async def test_webhook_retries_then_dead_letters(self, alert_service, mock_supabase):
+        """Test failed webhooks retry, open the circuit, and land in the DLQ"""
+        alert_service.webhook_url = f"https://example.com/webhook/{uuid4()}"
+        mock_client = Mock()
+        mock_client.post = AsyncMock(side_effect=httpx.ConnectError("connection refused"))
+        alert_service._http = mock_client
+        alert_service._http_loop = asyncio.get_running_loop()
+        batch = [([{'id': 'a'}], {'rating': 1})]
+        
+        with patch('src.services.alert_service.WEBHOOK_BACKOFF_BASE', 0):
+            await alert_service._post_webhook_batch(batch)
+            assert mock_client.post.call_count == 3
+            
+            # Two more exhausted batches open the circuit (3 failures)
+            await alert_service._post_webhook_batch(batch)
+            await alert_service._post_webhook_batch(batch)
+            await alert_service._post_webhook_batch(batch)
+        
+        # The last batch is rejected without touching the endpoint
+        assert mock_client.post.call_count == 9
+        dead_letters = [
+            c for c in mock_supabase.table.call_args_list if c[0][0] == 'webhook_dead_letters'
+        ]
+        assert len(dead_letters) == 4
+        stored = mock_supabase.table.return_value.insert.call_args[0][0]
+        assert stored['payload']['events'][0]['alerts'] == [{'id': 'a'}]
+        
+        stats = alert_service.get_stats()
+        assert stats['webhook_failures'] == 4
+        assert stats['webhooks_dead_lettered'] == 4
+    
+    @pytest.mark.asyncio
+    async def test_flush_webhooks_delivers_queued_events(self, alert_service):
+        """Test pending webhook batches can be drained before the loop ends"""
+        alert_service.webhook_url = "https://example.com/webhook"
+        
+        with patch.object(alert_service, '_post_webhook_batch', new=AsyncMock()) as mock_post:
+            await alert_service._send_webhook_notification([{'id': 'a'}], {'rating': 1})
+            await alert_service.flush_webhooks()
+            
+            mock_post.assert_awaited_once_with([([{'id': 'a'}], {'rating': 1})])
+            await alert_service.aclose()
+    
+    @pytest.mark.asyncio
+    async def test_send_notifications_runs_channels_concurrently(self, alert_service):
+        """Test notification channels are dispatched together"""
+        alert_service.webhook_url = "https://example.com/webhook"
+        started = []
+        
+        def channel(name):
+            async def send(*args):
+                started.append(name)
+                await asyncio.sleep(0.05)
+            return send
+        
+        with patch.object(alert_service, '_broadcast_realtime_alert', new=channel('realtime')), \
+                patch.object(alert_service, '_send_push_notification', new=channel('push')), \
+                patch.object(alert_service, '_send_webhook_notification', new=channel('webhook')):
+            start = asyncio.get_running_loop().time()
+            await alert_service._send_notifications([{'restaurant_id': 'r'}], {})
+            elapsed = asyncio.get_running_loop().time() - start
+        
+        assert sorted(started) == ['push', 'realtime', 'webhook']
+        assert elapsed < 0.12
+    
+    @pytest.mark.asyncio
+    async def test_related_alerts_merged_into_one_notification(self, alert_service):
+        """Test all rules from one feedback go out as a single push"""
+        alerts = [
+            {'id': 'a1', 'restaurant_id': 'r', 'rule_id': 'negative_sentiment', 'priority': 'high', 'title': 'Negative'},
+            {'id': 'a2', 'restaurant_id': 'r', 'rule_id': 'low_rating_immediate', 'priority': 'immediate', 'title': 'Low rating'},
+            {'id': 'a3', 'restaurant_id': 'r', 'rule_id': 'service_complaint', 'priority': 'high', 'title': 'Service'}
+        ]
+        
+        with patch.object(alert_service, '_broadcast_realtime_alert', new=AsyncMock()), \
+                patch.object(alert_service, '_send_push_notification', new=AsyncMock()) as mock_push:
+            await alert_service._send_notifications(alerts, {'rating': 1})
+        
+        mock_push.assert_called_once()
+        assert alert_service.get_stats()['notifications_sent'] == 1
+        assert alert_service.get_stats()['average_notification_latency'] is not None
+        merged = mock_push.call_args[0][0]
+        assert merged['id'] == 'a2'
+        assert merged['max_priority'] == 'immediate'
+        assert merged['related_rules'] == [
+            'negative_sentiment', 'low_rating_immediate', 'service_complaint'
+        ]
+    
+    @pytest.mark.asyncio
+    async def test_notifications_do_not_block_ingestion(self, alert_service, negative_feedback, mock_supabase):
+        """Test process_feedback_for_alerts returns before the fan-out finishes"""
+        mock_supabase.table.return_value.insert.return_value.execute.return_value.data = []
+        delivered = asyncio.Event()
+        
+        async def slow_send(alerts, feedback, now_iso=None):
+            await asyncio.sleep(0.05)
+            delivered.set()
+        
+        with patch.object(alert_service, '_send_notifications', new=slow_send):
+            alerts = await alert_service.process_feedback_for_alerts(negative_feedback)
+            
+            assert alerts
+            assert not delivered.is_set()
+            
+            await alert_service.flush_notifications()
+            assert delivered.is_set()
+        
+        await alert_service.aclose()
+    
+    @pytest.mark.asyncio
+    async def test_repeat_alerts_suppressed_within_window(self, alert_service):
+        """Test a burst of the same rule notifies once per suppression window"""
+        alert = {'restaurant_id': 'r', 'rule_id': 'low_rating_immediate', 'priority': 'immediate'}
+        other_rule = {**alert, 'rule_id': 'repeated_issue', 'priority': 'high'}
+        
+        with patch.object(alert_service, '_broadcast_realtime_alert', new=AsyncMock()) as mock_realtime, \
+                patch.object(alert_service, '_send_push_notification', new=AsyncMock()):
+            await alert_service._send_notifications([alert], {})
+            await alert_service._send_notifications([alert], {})
+            await alert_service._send_notifications([alert, other_rule], {})
+            
+            assert mock_realtime.call_count == 2
+            assert mock_realtime.call_args_list[1][0][0]['related_rules'] == ['repeated_issue']
+            
+            with patch('src.services.alert_service.time.monotonic', return_value=time.monotonic() + 61):
+                await alert_service._send_notifications([alert], {})
+            
+            assert mock_realtime.call_count == 3
+    
+    def test_no_alert_possible_matches_rules(self, alert_service, negative_feedback, positive_feedback):
+        """Test the triage shortcut only skips feedback no rule can match"""
+        samples = [
+            negative_feedback,
+            positive_feedback,
+            {'rating': 4, 'sentiment_score': -0.1, 'topics': ['service']},
+            {'rating': 5, 'sentiment_score': 0.2, 'is_repeated_issue': True},
+            {'rating': 3, 'sentiment_score': 0.5},
+            {'rating': 4, 'sentiment_score': 0.0, 'topics': ['food quality']}
+        ]
+        
+        for feedback in samples:
+            any_rule = bool(alert_service._match_rules(feedback))
+            assert alert_service._no_alert_possible(feedback) is not any_rule
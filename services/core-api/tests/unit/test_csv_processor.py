@@ -99,6 +99,30 @@ class TestCSVProcessor:
         
         assert result is None
     
+    def test_validate_phone_number_cache_shared_across_instances(self):
+        """Test phone validation results are cached across processor instances"""
+        from src.services.csv_processor import _validate_phone_number
+        
+        self.processor.validate_phone_number('0551112233')
+        hits = _validate_phone_number.cache_info().hits
+        
+        CSVProcessor().validate_phone_number('0551112233')
+        
+        assert _validate_phone_number.cache_info().hits == hits + 1
+    
+    def test_confirm_saudi_mobile_fast_path(self, monkeypatch):
+        """Test metadata-pattern matches skip phonenumbers.parse; unallocated ranges still fail"""
+        from src.services import csv_processor
+        confirm = csv_processor._confirm_saudi_mobile.__wrapped__
+        
+        assert confirm('+966521234567') is None  # 52 is not an allocated mobile range
+        
+        def fail_parse(*args, **kwargs):
+            raise AssertionError('phonenumbers.parse should not be called')
+        
+        monkeypatch.setattr(csv_processor.phonenumbers, 'parse', fail_parse)
+        assert confirm('+966571234567') == '+966571234567'
+    
     def test_validate_phone_number_empty(self):
         """Test empty phone number"""
         result = self.processor.validate_phone_number('')
@@ -167,6 +191,234 @@ class TestCSVProcessor:
         assert result['invalid_count'] == 2
         assert len(result['recipients']) == 1
     
+    def test_normalize_phone_series_matches_scalar_validation(self):
+        """Test column-wise phone normalization agrees with validate_phone_number"""
+        phones = pd.Series([
+            '0501234567', '+966501234567', '966-50-123-4567', '501234567',
+            '00966501234567', '+966051234567', '966401234567', '123', '', None
+        ])
+        
+        result = self.processor.normalize_phone_series(phones)
+        
+        expected = [self.processor.validate_phone_number(phone) for phone in phones]
+        assert [None if pd.isna(value) else value for value in result] == expected
+    
+    @pytest.mark.parametrize("phone,expected", [
+        ('\t0501234567\n', '+966501234567'),  # ASCII whitespace
+        ('050\u00a0123\u30004567', '+966501234567'),  # Unicode spaces
+        ('05\u0665123\u0664567', None),  # Arabic-Indic digits are kept, then rejected
+    ])
+    def test_phone_cleanup_ascii_and_unicode_paths(self, phone, expected):
+        """Test the byte-level and regex cleanup paths agree on separators"""
+        assert self.processor.validate_phone_number(phone) == expected
+        result = self.processor.normalize_phone_series(pd.Series([phone]))[0]
+        assert (None if pd.isna(result) else result) == expected
+    
+    def test_process_recipients_skips_empty_metadata(self):
+        """Test missing extra column values are left out of metadata"""
+        df = pd.DataFrame({
+            'phone_number': ['0501234567', '0502345678'],
+            'visit_timestamp': ['2025-01-08 14:30:00', '2025-01-08 15:45:00'],
+            'customer_name': ['Ahmad Ali', None],
+            'table_number': [5, 12]
+        })
+        
+        result = self.processor.process_recipients(df)
+        
+        assert result['recipients'][0]['metadata'] == {'customer_name': 'Ahmad Ali', 'table_number': '5'}
+        assert result['recipients'][1]['metadata'] == {'table_number': '12'}
+        assert result['recipients'][1]['visit_timestamp'] == '2025-01-08T15:45:00'
+    
+    @pytest.mark.parametrize("timestamps", [
+        ['2025-01-08 14:30:00', '2025-01-09'],
+        ['2025-01-08 14:30:00.250', '2025-01-09'],
+    ])
+    def test_process_recipients_timestamp_isoformat(self, timestamps):
+        """Test recipient timestamps match Timestamp.isoformat on every formatting path"""
+        df = pd.DataFrame({
+            'phone_number': ['0501234567', '0502345678'],
+            'visit_timestamp': timestamps
+        })
+        
+        result = self.processor.process_recipients(df)
+        
+        assert [r['visit_timestamp'] for r in result['recipients']] == [
+            pd.Timestamp(timestamp).isoformat() for timestamp in timestamps
+        ]
+    
+    def test_process_recipients_counts_bad_timestamps_as_invalid(self):
+        """Test rows with unparseable timestamps are dropped before deduplication"""
+        df = pd.DataFrame({
+            'phone_number': ['0501234567', '0501234567', '0502345678', 'invalid'],
+            'visit_timestamp': ['not a date', '2025-01-08 15:45:00', '2025-01-08', '2025-01-08 19:20:00']
+        })
+        
+        result = self.processor.process_recipients(df)
+        
+        assert result['invalid_count'] == 2
+        assert result['duplicates_count'] == 0
+        assert [r['visit_timestamp'] for r in result['recipients']] == [
+            '2025-01-08T15:45:00', '2025-01-08T00:00:00'
+        ]
+    
+    @pytest.mark.asyncio
+    async def test_process_chunk_dict_rows_and_dataframe_agree(self):
+        """Test the DictReader and DataFrame chunk paths produce the same recipients"""
+        rows = [
+            {'phone_number': '0501234567', 'visit_timestamp': '2025-01-08 14:30:00', 'customer_name': ' Ahmad '},
+            {'phone_number': '0501234567', 'visit_timestamp': '2025-01-08 15:45:00', 'customer_name': ''},
+            {'phone_number': 'invalid', 'visit_timestamp': '2025-01-08 19:20:00', 'customer_name': 'X'},
+            {'phone_number': '0502345678', 'visit_timestamp': '2025-01-08 20:30:00', 'customer_name': None}
+        ]
+        
+        from_dicts = await self.processor._process_chunk(
+            rows, 'phone_number', 'visit_timestamp', set()
+        )
+        from_frame = await self.processor._process_chunk(
+            pd.DataFrame(rows), 'phone_number', 'visit_timestamp', set()
+        )
+        
+        assert from_dicts == from_frame
+        assert from_dicts['duplicates'] == 1
+        assert from_dicts['invalid'] == 1
+        assert [r['metadata'] for r in from_dicts['recipients']] == [{'customer_name': 'Ahmad'}, {}]
+        
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("offsets", [('', ''), ('+03:00', '+00:00')])
+    async def test_process_chunk_parses_timestamps_per_chunk(self, offsets):
+        """Test chunk timestamps parse in one pass, including mixed UTC offsets"""
+        rows = [
+            {'phone_number': '0501234567', 'visit_timestamp': f'2025-01-08T14:30:00{offsets[0]}'},
+            {'phone_number': '0502345678', 'visit_timestamp': 'not a date'},
+            {'phone_number': '0503456789', 'visit_timestamp': '  '},
+            {'phone_number': '0504567890', 'visit_timestamp': f'2025-01-09T09:15:00{offsets[1]}'}
+        ]
+        
+        result = await self.processor._process_chunk(
+            rows, 'phone_number', 'visit_timestamp', set()
+        )
+        
+        assert result['invalid'] == 2
+        assert [r['visit_timestamp'] for r in result['recipients']] == [
+            pd.Timestamp(rows[0]['visit_timestamp']).isoformat(),
+            pd.Timestamp(rows[3]['visit_timestamp']).isoformat()
+        ]
+    
+    @pytest.mark.asyncio
+    async def test_process_recipients_streaming(self):
+        """Test streaming processing reads chunks and tolerates ragged rows"""
+        content = (
+            "Phone_Number,visit_timestamp,customer_name\n"
+            "0501234567,2025-01-08 14:30:00,Ahmad\n"
+            "0502345678,2025-01-08 15:45:00\n"
+            "0503456789,2025-01-08 19:20:00,Fatima,extra\n"
+            "0501234567,2025-01-08 20:30:00,Ahmad\n"
+            "invalid,2025-01-08 21:00:00,\n"
+        ).encode('utf-8')
+        self.processor.CHUNK_SIZE = 2
+        
+        updates = [
+            update async for update in self.processor.process_recipients_streaming(
+                content, progress_callback=lambda info: None
+            )
+        ]
+        
+        assert [u['type'] for u in updates] == [
+            'recipients_chunk', 'progress', 'recipients_chunk', 'progress', 'progress', 'completed'
+        ]
+        assert updates[-2]['percentage'] <= 95
+        final = updates[-1]
+        assert 'recipients' not in final
+        assert final['total_rows'] == 5
+        assert final['valid_count'] == 3
+        assert final['duplicates_count'] == 1
+        assert final['invalid_count'] == 1
+        recipients = [r for u in updates if u['type'] == 'recipients_chunk' for r in u['data']]
+        assert [r['metadata'] for r in recipients] == [
+            {'customer_name': 'Ahmad'}, {}, {'customer_name': 'Fatima'}
+        ]
+    
+    @pytest.mark.asyncio
+    async def test_process_recipients_streaming_counts_across_chunks(self):
+        """Test duplicates are caught across chunk boundaries"""
+        content = (
+            "phone_number,visit_timestamp,customer_name\n"
+            "0501234567,2025-01-08 14:30:00,Ahmad\n"
+            "0502345678,not a date,\n"
+            "0501234567,2025-01-08 20:30:00,Ahmad\n"
+            "0503456789,2025-01-08 19:20:00,Fatima\n"
+            "invalid,2025-01-08 21:00:00,\n"
+        ).encode('utf-8')
+        self.processor.CHUNK_SIZE = 2
+        
+        updates = [
+            update async for update in self.processor.process_recipients_streaming(content)
+        ]
+        
+        assert updates[-1]['total_rows'] == 5
+        assert updates[-1]['valid_count'] == 2
+        assert updates[-1]['duplicates_count'] == 1
+        assert updates[-1]['invalid_count'] == 2
+    
+    @pytest.mark.asyncio
+    async def test_process_recipients_streaming_dedup_across_uploads(self):
+        """Test a shared Bloom filter flags numbers seen in an earlier upload"""
+        from src.utils.bloom_filter import BloomFilter
+        
+        dedup_filter = BloomFilter(capacity=100)
+        first = "phone_number,visit_timestamp\n0501234567,2025-01-08 14:30:00\n".encode('utf-8')
+        second = (
+            "phone_number,visit_timestamp\n"
+            "0501234567,2025-01-09 14:30:00\n"
+            "0502345678,2025-01-09 15:45:00\n"
+        ).encode('utf-8')
+        
+        results = []
+        for content in (first, second):
+            async for update in self.processor.process_recipients_streaming(
+                content, dedup_filter=dedup_filter
+            ):
+                results.append(update)
+        
+        completed = [r for r in results if r['type'] == 'completed']
+        assert [r['valid_count'] for r in completed] == [1, 1]
+        assert completed[1]['duplicates_count'] == 1
+        assert results[-2] == {'type': 'recipients_chunk', 'data': [
+            {'phone_number': '+966502345678', 'visit_timestamp': '2025-01-09T15:45:00', 'metadata': {}}
+        ]}
+        assert '+966502345678' in dedup_filter
+    
+    @pytest.mark.asyncio
+    async def test_validate_csv_streaming_row_estimate(self):
+        """Test streaming validation counts rows from newlines across the whole file"""
+        row = "0501234567,2025-01-08 14:30:00\n"
+        content = ("phone_number,visit_timestamp\n" + row * 300).encode('utf-8')
+        
+        result = await self.processor.validate_csv_streaming(content)
+        assert result['valid'] is True
+        assert result['estimated_rows'] == 300
+        
+        result = await self.processor.validate_csv_streaming(content.rstrip(b'\n'))
+        assert result['estimated_rows'] == 300
+        
+        self.processor.MAX_ROWS = 299
+        result = await self.processor.validate_csv_streaming(content)
+        assert result['valid'] is False
+        
+        result = await self.processor.validate_csv_streaming(b"phone_number,visit_timestamp")
+        assert result['errors'] == ['File appears to be empty']
+    
+    @pytest.mark.asyncio
+    async def test_process_recipients_streaming_errors(self):
+        """Test streaming processing reports empty and non-UTF-8 files"""
+        empty = [u async for u in self.processor.process_recipients_streaming(b'')]
+        assert empty == [{'type': 'error', 'message': 'No columns found in CSV file'}]
+        
+        latin1 = 'phone_number,visit_timestamp\n0501234567,caf\xe9\n'.encode('latin-1')
+        updates = [u async for u in self.processor.process_recipients_streaming(latin1)]
+        assert updates[-1]['type'] == 'error'
+        assert 'UTF-8' in updates[-1]['message']
+    
     def test_generate_warnings_future_timestamps(self):
         """Test warning generation for future timestamps"""
         future_date = (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S')
@@ -191,6 +443,31 @@ class TestCSVProcessor:
         
         assert any('older than 30 days' in warning for warning in result.get('warnings', []))
     
+    def test_generate_warnings_counts_raw_timestamps(self):
+        """Test warnings count future and old visits from unparsed timestamps"""
+        future_date = (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S')
+        old_date = (datetime.now() - timedelta(days=35)).strftime('%Y-%m-%d %H:%M:%S')
+        df = pd.DataFrame({
+            'phone_number': ['0501234567'] * 4,
+            'visit_timestamp': [future_date, future_date, old_date, 'not a date']
+        })
+        
+        warnings = self.processor._generate_warnings(df, [{}] * 4)
+        
+        assert warnings == ['2 visits have future timestamps', '1 visits are older than 30 days']
+    
+    @pytest.mark.parametrize("aware_timestamp", [None, '2025-01-08T14:30:00+03:00'])
+    def test_generate_warnings_from_recipients(self, aware_timestamp):
+        """Test streaming warnings count future and old visits, skipping tz-aware ones"""
+        future_date = (datetime.now() + timedelta(days=1)).isoformat()
+        old_date = (datetime.now() - timedelta(days=35)).isoformat()
+        timestamps = [future_date, future_date, old_date] + ([aware_timestamp] if aware_timestamp else [])
+        recipients = [{'visit_timestamp': timestamp} for timestamp in timestamps]
+        
+        warnings = self.processor._generate_warnings_from_recipients(recipients, len(recipients))
+        
+        assert warnings == ['2 visits have future timestamps', '1 visits are older than 30 days']
+    
     def test_generate_warnings_low_success_rate(self):
         """Test warning generation for low success rate"""
         df = pd.DataFrame({
@@ -8,22 +8,83 @@ from datetime import datetime, timedelta
 from uuid import uuid4
 
 from src.services.feedback_scheduler import FeedbackScheduler
+from src.utils.circuit_breaker import CircuitBreakerException
 from src.repositories.campaign_repository import CampaignRepository
 
 
+class FakeRedis:
+    """In-memory stand-in for the shared Redis cache (TTLs are ignored)"""
+    
+    def __init__(self):
+        self.store = {}
+    
+    async def get(self, key):
+        return self.store.get(key)
+    
+    async def mget(self, keys):
+        return [self.store.get(key) for key in keys]
+    
+    async def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.store:
+            return None
+        self.store[key] = str(value)
+        return True
+    
+    async def exists(self, key):
+        return int(key in self.store)
+    
+    async def delete(self, key):
+        return int(self.store.pop(key, None) is not None)
+    
+    def pipeline(self):
+        redis = self
+        
+        class Pipeline:
+            def __init__(self):
+                self.commands = []
+            
+            def set(self, *args, **kwargs):
+                self.commands.append((args, kwargs))
+            
+            async def execute(self):
+                return [await redis.set(*args, **kwargs) for args, kwargs in self.commands]
+        
+        return Pipeline()
+    
+    async def aclose(self):
+        pass
+
+
+def _recipient_stream(recipients):
+    """Stand-in for CampaignRepository.iter_campaign_recipients"""
+    async def stream(campaign_id, page_size=1000, **kwargs):
+        for recipient in recipients:
+            yield recipient
+    return stream
+
+
 class TestFeedbackScheduler:
     
     @pytest.fixture
     def mock_campaign_repo(self):
         repo = Mock(spec=CampaignRepository)
-        repo.get_campaign_recipients = AsyncMock()
+        repo.iter_campaign_recipients = _recipient_stream([])
         repo.create_campaign_message = AsyncMock()
+        repo.bulk_create_campaign_messages = AsyncMock(
+            side_effect=lambda rows: [{'id': str(uuid4()), **row} for row in rows]
+        )
         return repo
     
     @pytest.fixture
-    def scheduler(self, mock_campaign_repo):
+    def fake_redis(self):
+        return FakeRedis()
+    
+    @pytest.fixture
+    def scheduler(self, mock_campaign_repo, fake_redis):
         scheduler = FeedbackScheduler()
         scheduler.campaign_repo = mock_campaign_repo
+        scheduler._redis = fake_redis
+        scheduler.prayer_api_breaker.reset()
         return scheduler
     
     @pytest.fixture
@@ -76,137 +137,39 @@ class TestFeedbackScheduler:
         result = scheduler._calculate_time_since_visit(three_days_ago)
         assert result == "قبل 3 أيام"
     
-    @pytest.mark.asyncio
-    async def test_calculate_send_time_basic(self, scheduler):
-        """Test basic send time calculation"""
-        visit_time = datetime.now() - timedelta(hours=1)
-        customer_phone = '+966501234567'
-        
-        with patch.object(scheduler, '_check_prayer_time_conflict') as mock_prayer:
-            mock_prayer.return_value = {
-                'is_prayer_time': False,
-                'next_available_time': visit_time + timedelta(hours=3)
-            }
-            
-            send_time = await scheduler._calculate_send_time(visit_time, customer_phone)
-            
-            # Should be approximately 3 hours after visit
-            expected_time = visit_time + timedelta(hours=3)
-            time_diff = abs((send_time - expected_time).total_seconds())
-            assert time_diff < 60  # Within 1 minute
-    
-    @pytest.mark.asyncio
-    async def test_calculate_send_time_with_prayer_time(self, scheduler):
-        """Test send time calculation with prayer time conflict"""
-        visit_time = datetime.now() - timedelta(hours=1)
-        customer_phone = '+966501234567'
-        
-        # Mock prayer time conflict
-        prayer_end_time = visit_time + timedelta(hours=3, minutes=30)
-        with patch.object(scheduler, '_check_prayer_time_conflict') as mock_prayer:
-            mock_prayer.return_value = {
-                'is_prayer_time': True,
-                'next_available_time': prayer_end_time + timedelta(minutes=30)
-            }
-            
-            send_time = await scheduler._calculate_send_time(visit_time, customer_phone)
-            
-            # Should be after prayer time + 30 minutes buffer
-            expected_time = prayer_end_time + timedelta(minutes=30)
-            assert send_time >= expected_time
-    
-    @pytest.mark.asyncio
-    async def test_calculate_send_time_min_max_bounds(self, scheduler):
-        """Test send time respects min/max delay bounds"""
-        visit_time = datetime.now() - timedelta(hours=5)  # Old visit
-        customer_phone = '+966501234567'
-        
-        with patch.object(scheduler, '_check_prayer_time_conflict') as mock_prayer:
-            mock_prayer.return_value = {
-                'is_prayer_time': False,
-                'next_available_time': visit_time + timedelta(hours=3)
-            }
-            
-            send_time = await scheduler._calculate_send_time(visit_time, customer_phone)
-            
-            # Should respect max delay (4 hours)
-            max_time = visit_time + timedelta(hours=4)
-            assert send_time <= max_time
-            
-            # Should respect min delay (2 hours)
-            min_time = visit_time + timedelta(hours=2)
-            assert send_time >= min_time
-    
-    @pytest.mark.asyncio
-    @patch('httpx.AsyncClient')
-    async def test_check_prayer_time_conflict_success(self, mock_httpx, scheduler):
-        """Test prayer time check with successful API response"""
-        proposed_time = datetime.now()
-        
-        # Mock successful prayer time API response
-        mock_response = Mock()
-        mock_response.status_code = 200
-        mock_response.json.return_value = {
-            'is_prayer_time': True,
-            'prayer_end_time': (proposed_time + timedelta(minutes=30)).isoformat()
-        }
-        
-        mock_client = Mock()
-        mock_client.post = AsyncMock(return_value=mock_response)
-        mock_httpx.return_value.__aenter__.return_value = mock_client
-        
-        result = await scheduler._check_prayer_time_conflict(proposed_time)
-        
-        assert result['is_prayer_time'] is True
-        expected_next_time = proposed_time + timedelta(minutes=30, seconds=1800)  # +30 min buffer
-        time_diff = abs((result['next_available_time'] - expected_next_time).total_seconds())
-        assert time_diff < 60  # Within 1 minute
-    
     @pytest.mark.asyncio
     @patch('httpx.AsyncClient')
-    async def test_check_prayer_time_conflict_api_failure(self, mock_httpx, scheduler):
-        """Test prayer time check handles API failure gracefully"""
-        proposed_time = datetime.now()
-        
-        # Mock API failure
+    async def test_http_client_is_shared(self, mock_httpx, scheduler):
+        """Test prayer API calls reuse one pooled client until closed"""
         mock_client = Mock()
-        mock_client.post = AsyncMock(side_effect=Exception("API error"))
-        mock_httpx.return_value.__aenter__.return_value = mock_client
+        mock_client.is_closed = False
+        mock_client.aclose = AsyncMock()
+        mock_httpx.return_value = mock_client
         
-        result = await scheduler._check_prayer_time_conflict(proposed_time)
+        assert scheduler._get_http_client() is scheduler._get_http_client()
+        mock_httpx.assert_called_once()
         
-        # Should fall back to original time
-        assert result['is_prayer_time'] is False
-        assert result['next_available_time'] == proposed_time
+        await scheduler.aclose()
+        mock_client.aclose.assert_awaited_once()
+        assert scheduler._http_client is None
     
     @pytest.mark.asyncio
     async def test_schedule_campaign_success(self, scheduler, mock_campaign_repo, sample_recipients):
         """Test successful campaign scheduling"""
         campaign_id = uuid4()
-        mock_campaign_repo.get_campaign_recipients.return_value = sample_recipients
+        mock_campaign_repo.iter_campaign_recipients = _recipient_stream(sample_recipients)
         
-        # Mock message creation
-        def create_message_side_effect(message_data):
-            return {
-                'id': str(uuid4()),
-                **message_data
-            }
-        
-        mock_campaign_repo.create_campaign_message.side_effect = create_message_side_effect
-        
-        # Mock Celery task
-        with patch.object(scheduler, 'celery_app') as mock_celery:
-            mock_task = Mock()
-            mock_task.id = 'test_task_id'
-            mock_celery.send_task.return_value = mock_task
-            
+        # Mock Celery dispatch
+        with patch.object(scheduler, 'celery_app') as mock_celery, \
+                patch('src.services.feedback_scheduler.group') as mock_group:
             schedule_params = {
                 'start_time': datetime.now(),
                 'end_time': datetime.now() + timedelta(days=1),
                 'template': 'test_template'
             }
             
-            with patch.object(scheduler, '_calculate_send_time') as mock_calc_time:
+            with patch.object(scheduler, '_prefetch_prayer_schedule', AsyncMock(return_value=None)), \
+                    patch.object(scheduler, '_resolve_send_time_local') as mock_calc_time:
                 # Mock send times for each recipient
                 send_times = [
                     datetime.now() + timedelta(hours=1),
@@ -221,11 +184,23 @@ class TestFeedbackScheduler:
                 assert len(result) == 3
                 for i, job in enumerate(result):
                     assert 'message_id' in job
-                    assert job['task_id'] == 'test_task_id'
+                    assert job['scheduled_time'] == send_times[i].isoformat()
                     assert job['phone_number'] == sample_recipients[i]['phone_number']
                 
-                # Verify repository calls
-                assert mock_campaign_repo.create_campaign_message.call_count == 3
+                # Verify one bulk insert, with task ids stored on the rows
+                mock_campaign_repo.bulk_create_campaign_messages.assert_awaited_once()
+                rows = mock_campaign_repo.bulk_create_campaign_messages.call_args.args[0]
+                assert [row['task_id'] for row in rows] == [job['task_id'] for job in result]
+                mock_campaign_repo.create_campaign_message.assert_not_called()
+                
+                # Verify one group dispatch with a signature per message
+                mock_group.return_value.apply_async.assert_called_once_with()
+                assert mock_celery.signature.call_count == 3
+                first_call = mock_celery.signature.call_args_list[0]
+                assert first_call.kwargs['eta'] == send_times[0]
+                assert first_call.kwargs['task_id'] == result[0]['task_id']
+                assert first_call.kwargs['args'] == [result[0]['message_id']]
+                mock_celery.send_task.assert_not_called()
     
     @pytest.mark.asyncio
     async def test_schedule_campaign_filters_by_time_window(
@@ -236,7 +211,7 @@ class TestFeedbackScheduler:
     ):
         """Test campaign scheduling filters recipients by time window"""
         campaign_id = uuid4()
-        mock_campaign_repo.get_campaign_recipients.return_value = sample_recipients
+        mock_campaign_repo.iter_campaign_recipients = _recipient_stream(sample_recipients)
         
         # Set narrow time window
         start_time = datetime.now() + timedelta(hours=2)
@@ -248,12 +223,10 @@ class TestFeedbackScheduler:
             'template': 'test_template'
         }
         
-        with patch.object(scheduler, 'celery_app') as mock_celery:
-            mock_task = Mock()
-            mock_task.id = 'test_task_id'
-            mock_celery.send_task.return_value = mock_task
-            
-            with patch.object(scheduler, '_calculate_send_time') as mock_calc_time:
+        with patch.object(scheduler, 'celery_app') as mock_celery, \
+                patch('src.services.feedback_scheduler.group') as mock_group:
+            with patch.object(scheduler, '_prefetch_prayer_schedule', AsyncMock(return_value=None)), \
+                    patch.object(scheduler, '_resolve_send_time_local') as mock_calc_time:
                 # Mock send times - some outside window
                 mock_calc_time.side_effect = [
                     datetime.now() + timedelta(hours=1),      # Before window
@@ -261,17 +234,159 @@ class TestFeedbackScheduler:
                     datetime.now() + timedelta(hours=3)       # After window
                 ]
                 
-                mock_campaign_repo.create_campaign_message.side_effect = lambda data: {
-                    'id': str(uuid4()), **data
-                }
-                
                 result = await scheduler.schedule_campaign(campaign_id, schedule_params)
                 
                 # Should only schedule messages within the time window
                 # First recipient should be moved to start_time (within window)
                 # Second recipient should be scheduled as calculated (within window)  
                 # Third recipient should be skipped (outside window)
-                assert len(result) >= 1  # At least one should be scheduled
+                assert len(result) == 2
+                assert result[0]['scheduled_time'] == start_time.isoformat()
+                assert mock_celery.signature.call_count == 2
+    
+    @pytest.mark.asyncio
+    async def test_schedule_campaign_prefetches_prayer_schedule_once(
+        self,
+        scheduler,
+        mock_campaign_repo,
+        sample_recipients
+    ):
+        """Test campaign scheduling fetches prayer windows once, not per recipient"""
+        mock_campaign_repo.iter_campaign_recipients = _recipient_stream(sample_recipients)
+        base_time = sample_recipients[0]['visit_timestamp'] + timedelta(hours=3)
+        prayer_start = base_time - timedelta(minutes=5)
+        prayer_end = base_time + timedelta(minutes=15)
+        
+        with patch.object(scheduler, 'celery_app'), \
+                patch('src.services.feedback_scheduler.group'), \
+                patch.object(scheduler, '_fetch_prayer_schedule', AsyncMock(return_value={
+                    'location': 'Riyadh',
+                    'schedule': {
+                        base_time.date().isoformat(): [{
+                            'name': 'Asr',
+                            'start': prayer_start.isoformat(),
+                            'end': prayer_end.isoformat()
+                        }]
+                    }
+                })) as mock_fetch:
+            result = await scheduler.schedule_campaign(uuid4(), {})
+        
+        mock_fetch.assert_awaited_once()
+        assert len(result) == 3
+        # First recipient lands in the prayer window and moves past it
+        assert result[0]['scheduled_time'] == (prayer_end + timedelta(minutes=30)).isoformat()
+        assert result[1]['scheduled_time'] == (base_time + timedelta(minutes=30)).isoformat()
+    
+    @pytest.mark.asyncio
+    async def test_prefetch_prayer_schedule_shared_cache(self, scheduler, fake_redis, mock_campaign_repo):
+        """Test prayer windows cached by one worker are reused by another"""
+        day = datetime(2024, 1, 1).date()
+        schedule = {
+            'schedule': {
+                day.isoformat(): [{
+                    'name': 'Dhuhr',
+                    'start': datetime(2024, 1, 1, 11, 50).isoformat(),
+                    'end': datetime(2024, 1, 1, 12, 10).isoformat()
+                }]
+            }
+        }
+        with patch.object(scheduler, '_fetch_prayer_schedule', AsyncMock(return_value=schedule)) as mock_fetch:
+            first = await scheduler._prefetch_prayer_schedule({day})
+        mock_fetch.assert_awaited_once()
+        
+        other_worker = FeedbackScheduler()
+        other_worker.campaign_repo = mock_campaign_repo
+        other_worker._redis = fake_redis
+        with patch.object(other_worker, '_fetch_prayer_schedule', AsyncMock()) as mock_other_fetch:
+            second = await other_worker._prefetch_prayer_schedule({day})
+        mock_other_fetch.assert_not_called()
+        assert second == first
+    
+    @pytest.mark.asyncio
+    async def test_open_circuit_shared_across_workers(self, scheduler, fake_redis):
+        """Test an open prayer API circuit makes other workers fail fast"""
+        failing_fetch = AsyncMock(side_effect=Exception("API error"))
+        for _ in range(scheduler.prayer_api_breaker.config.failure_threshold):
+            with pytest.raises(Exception):
+                await scheduler._call_prayer_api(failing_fetch)
+        assert await fake_redis.exists(scheduler._breaker_open_key)
+        
+        # Another worker with its own (closed) breaker skips the API call
+        scheduler.prayer_api_breaker.reset()
+        fetch = AsyncMock()
+        with pytest.raises(CircuitBreakerException):
+            await scheduler._call_prayer_api(fetch)
+        fetch.assert_not_called()
+        
+        await scheduler.reset_circuit_breaker()
+        assert not await fake_redis.exists(scheduler._breaker_open_key)
+    
+    @pytest.mark.parametrize("proposed, expected, is_prayer", [
+        (datetime(2024, 1, 1, 10, 15), datetime(2024, 1, 1, 10, 15), False),
+        (datetime(2024, 1, 1, 12, 15), datetime(2024, 1, 1, 13, 0), True),
+        # Maghrib runs into Isha, so skip past both
+        (datetime(2024, 1, 1, 18, 45), datetime(2024, 1, 1, 20, 0), True),
+    ])
+    def test_fallback_prayer_check(self, scheduler, proposed, expected, is_prayer):
+        """Test fallback rules move prayer hours to the next safe hour"""
+        result = scheduler._fallback_prayer_check(proposed, 'Riyadh')
+        
+        assert result['is_prayer_time'] is is_prayer
+        assert result['next_available_time'] == expected
+    
+    def test_resolve_send_time_local(self, scheduler):
+        """Test local send time resolution against a prefetched schedule"""
+        visit_time = datetime(2024, 1, 1, 9, 0)
+        windows = [
+            (datetime(2024, 1, 1, 11, 50), datetime(2024, 1, 1, 12, 10), 'Dhuhr'),
+            (datetime(2024, 1, 1, 15, 10), datetime(2024, 1, 1, 15, 30), 'Asr')
+        ]
+        schedule = ([window[0] for window in windows], windows)
+        
+        # Inside Dhuhr window: moved 30 minutes past its end
+        assert scheduler._resolve_send_time_local(visit_time, schedule) == datetime(2024, 1, 1, 12, 40)
+        # Between windows: unchanged
+        assert scheduler._resolve_send_time_local(
+            datetime(2024, 1, 1, 10, 0), schedule
+        ) == datetime(2024, 1, 1, 13, 0)
+        # No schedule: basic fallback rules (12:00 -> 13:00)
+        assert scheduler._resolve_send_time_local(visit_time, None) == datetime(2024, 1, 1, 13, 0)
+    
+    @pytest.mark.asyncio
+    async def test_schedule_campaign_pages_recipients(
+        self,
+        scheduler,
+        mock_campaign_repo,
+        sample_recipients
+    ):
+        """Test large campaigns are inserted and dispatched one page at a time"""
+        scheduler.recipient_page_size = 2
+        mock_campaign_repo.iter_campaign_recipients = _recipient_stream(sample_recipients)
+        
+        with patch.object(scheduler, 'celery_app'), \
+                patch('src.services.feedback_scheduler.group') as mock_group, \
+                patch.object(scheduler, '_prefetch_prayer_schedule', AsyncMock(return_value=None)):
+            result = await scheduler.schedule_campaign(uuid4(), {})
+        
+        assert len(result) == 3
+        page_sizes = [
+            len(call.args[0])
+            for call in mock_campaign_repo.bulk_create_campaign_messages.call_args_list
+        ]
+        assert page_sizes == [2, 1]
+        assert mock_group.return_value.apply_async.call_count == 2
+    
+    @pytest.mark.asyncio
+    async def test_schedule_campaign_no_recipients(self, scheduler, mock_campaign_repo):
+        """Test scheduling an empty campaign makes no insert or dispatch"""
+        mock_campaign_repo.iter_campaign_recipients = _recipient_stream([])
+        
+        with patch('src.services.feedback_scheduler.group') as mock_group:
+            result = await scheduler.schedule_campaign(uuid4(), {})
+        
+        assert result == []
+        mock_campaign_repo.bulk_create_campaign_messages.assert_not_called()
+        mock_group.assert_not_called()
     
     @pytest.mark.asyncio
     async def test_cancel_campaign(self, scheduler, mock_campaign_repo):
@@ -1,6 +1,6 @@
-from pydantic import BaseModel, Field
-from typing import Optional, List, Dict, Any
-from datetime import datetime
+from pydantic import BaseModel, Discriminator, Field, Tag
+from typing import Optional, List, Dict, Any, Literal, Annotated, Union
+from datetime import datetime, timezone
 
 class WhatsAppProfile(BaseModel):
     name: str
@@ -25,17 +25,63 @@ class WhatsAppInteractiveMessage(BaseModel):
     footer: Optional[Dict[str, Any]] = None
     action: Optional[Dict[str, Any]] = None
 
-class WhatsAppMessage(BaseModel):
+class WhatsAppMessageBase(BaseModel):
     from_: str = Field(alias="from")
     id: str
-    timestamp: str
+    # Unix seconds; WhatsApp sends a numeric string, coerced to int here
+    timestamp: int
+
+    @property
+    def sent_at(self) -> datetime:
+        return datetime.fromtimestamp(self.timestamp, tz=timezone.utc)
+
+class WhatsAppInboundText(WhatsAppMessageBase):
+    type: Literal["text"]
+    text: WhatsAppTextMessage
+
+class WhatsAppInboundImage(WhatsAppMessageBase):
+    type: Literal["image"]
+    image: WhatsAppMediaMessage
+
+class WhatsAppInboundVideo(WhatsAppMessageBase):
+    type: Literal["video"]
+    video: WhatsAppMediaMessage
+
+class WhatsAppInboundAudio(WhatsAppMessageBase):
+    type: Literal["audio"]
+    audio: WhatsAppMediaMessage
+
+class WhatsAppInboundDocument(WhatsAppMessageBase):
+    type: Literal["document"]
+    document: WhatsAppMediaMessage
+
+class WhatsAppInboundInteractive(WhatsAppMessageBase):
+    type: Literal["interactive"]
+    interactive: WhatsAppInteractiveMessage
+
+class WhatsAppInboundUnsupported(WhatsAppMessageBase):
+    # location, sticker, reaction, ...: queued so the handler can reply
     type: str
-    text: Optional[WhatsAppTextMessage] = None
-    image: Optional[WhatsAppMediaMessage] = None
-    video: Optional[WhatsAppMediaMessage] = None
-    audio: Optional[WhatsAppMediaMessage] = None
-    document: Optional[WhatsAppMediaMessage] = None
-    interactive: Optional[WhatsAppInteractiveMessage] = None
+
+_MESSAGE_VARIANTS = {"text", "image", "video", "audio", "document", "interactive"}
+
+def _message_variant(message: Any) -> str:
+    message_type = message.get("type") if isinstance(message, dict) else getattr(message, "type", None)
+    return message_type if message_type in _MESSAGE_VARIANTS else "unsupported"
+
+# Tagged on "type", so validation dispatches straight to one variant
+WhatsAppMessage = Annotated[
+    Union[
+        Annotated[WhatsAppInboundText, Tag("text")],
+        Annotated[WhatsAppInboundImage, Tag("image")],
+        Annotated[WhatsAppInboundVideo, Tag("video")],
+        Annotated[WhatsAppInboundAudio, Tag("audio")],
+        Annotated[WhatsAppInboundDocument, Tag("document")],
+        Annotated[WhatsAppInboundInteractive, Tag("interactive")],
+        Annotated[WhatsAppInboundUnsupported, Tag("unsupported")]
+    ],
+    Discriminator(_message_variant)
+]
 
 class WhatsAppStatus(BaseModel):
     id: str
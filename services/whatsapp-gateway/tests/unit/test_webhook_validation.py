@@ -2,10 +2,17 @@ import pytest
 import hmac
 import hashlib
 import json
+from datetime import datetime, timezone
 from fastapi.testclient import TestClient
 from unittest.mock import patch
 from src.main import app
 from src.utils.security import verify_webhook_signature
+from src.models.whatsapp import (
+    WhatsAppValue,
+    WhatsAppInboundText,
+    WhatsAppInboundImage,
+    WhatsAppInboundUnsupported
+)
 
 client = TestClient(app)
 
@@ -112,4 +119,37 @@ def test_webhook_post_with_invalid_signature():
             json=payload,
             headers={"X-Hub-Signature-256": "sha256=invalid"}
         )
-        assert response.status_code == 401
\ No newline at end of file
+        assert response.status_code == 401
+
+def test_webhook_messages_dispatch_on_type(sample_text_message, sample_media_message):
+    location_message = {
+        'from': '1234567890',
+        'id': 'msg_789',
+        'timestamp': '1234567890',
+        'type': 'location',
+        'location': {'latitude': 24.7, 'longitude': 46.7}
+    }
+    value = WhatsAppValue(
+        messaging_product="whatsapp",
+        metadata={},
+        messages=[sample_text_message, sample_media_message, location_message]
+    )
+    
+    text, image, location = value.messages
+    assert isinstance(text, WhatsAppInboundText)
+    assert text.text.body == 'Hello, world!'
+    assert text.timestamp == 1234567890
+    assert text.sent_at == datetime(2009, 2, 13, 23, 31, 30, tzinfo=timezone.utc)
+    assert isinstance(image, WhatsAppInboundImage)
+    assert image.image.id == 'media_123'
+    # Types without a dedicated variant still reach the handler
+    assert isinstance(location, WhatsAppInboundUnsupported)
+    assert location.type == 'location'
+
+def test_webhook_message_missing_variant_payload_rejected():
+    with pytest.raises(ValueError):
+        WhatsAppValue(
+            messaging_product="whatsapp",
+            metadata={},
+            messages=[{'from': '1', 'id': 'msg_1', 'timestamp': '1', 'type': 'text'}]
+        )